@@ -6,13 +6,102 @@ Calls Recruitment agent to get updated enrollment data
 
 import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 import pandas as pd
 import numpy as np
 
+# Add parent directory to path if needed (for call_recruitment_agent)
+_parent_dir = str(Path(__file__).parent.parent.parent)
+if _parent_dir not in sys.path:
+    sys.path.insert(0, _parent_dir)
+
+from call_recruitment_agent import RecruitmentAgentClient
+from app.data_loader import load_data
+
+# Try to import numba for the JIT-compiled aggregation kernel
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# Fallback site list when the default data has no sites
+_DEFAULT_SITE_LIST: Tuple[str, ...] = tuple(f"SITE_{i:03d}" for i in range(1, 11))
+
+# Site list from the default data directory, cached as (loaded_at, site_ids)
+_SITE_LIST_TTL_SECONDS = 300.0
+_site_list_cache: Optional[Tuple[float, Tuple[str, ...]]] = None
+
+# Shared Recruitment agent client, opened lazily and reused across calls.
+# The lock also serializes requests, since responses on the shared
+# websocket are read in order.
+_client_lock = asyncio.Lock()
+_client: Optional[RecruitmentAgentClient] = None
+
+
+def _get_default_site_list() -> List[str]:
+    """Get site IDs from the default data directory, reloading at most every _SITE_LIST_TTL_SECONDS."""
+    global _site_list_cache
+    now = time.monotonic()
+    if _site_list_cache is None or now - _site_list_cache[0] > _SITE_LIST_TTL_SECONDS:
+        data = load_data(upload_dir=None)
+        if "sites" in data and not data["sites"].empty:
+            site_ids = tuple(data["sites"]["site_id"].tolist())
+        else:
+            site_ids = _DEFAULT_SITE_LIST
+        _site_list_cache = (now, site_ids)
+    return list(_site_list_cache[1])
+
+
+async def _get_recruitment_client() -> RecruitmentAgentClient:
+    """
+    Return the shared Recruitment agent client, (re)connecting if needed.
+    
+    Caller must hold _client_lock.
+    """
+    global _client
+    if _client is None or not _client.is_connected:
+        client = RecruitmentAgentClient()
+        await client.connect()
+        _client = client
+    return _client
+
+
+async def _discard_recruitment_client() -> None:
+    """
+    Drop the shared client so the next call reconnects.
+    
+    Caller must hold _client_lock.
+    """
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.warning(f"Error disconnecting from Recruitment agent: {e}")
+
+
+async def warm_recruitment_client() -> None:
+    """Open the shared Recruitment agent connection ahead of the first A2A request (best effort)."""
+    try:
+        async with _client_lock:
+            await _get_recruitment_client()
+    except Exception as e:
+        logger.warning(f"Recruitment agent not reachable at startup, will connect on first use: {e}")
+
+
+async def close_recruitment_client() -> None:
+    """Close the shared Recruitment agent connection (called on app shutdown)."""
+    async with _client_lock:
+        await _discard_recruitment_client()
+
 
 async def call_recruitment_agent_for_enrollment(
     study_id: str = "STUDY_001",
@@ -33,46 +122,30 @@ async def call_recruitment_agent_for_enrollment(
         Enrollment projection from Recruitment agent
     """
     try:
-        # Import here to avoid circular dependencies
-        import sys
-        from pathlib import Path
-        
-        # Add parent directory to path if needed
-        parent_dir = Path(__file__).parent.parent.parent
-        if str(parent_dir) not in sys.path:
-            sys.path.insert(0, str(parent_dir))
+        logger.info(f"Calling Recruitment agent for enrollment forecast: study_id={study_id}")
         
-        from call_recruitment_agent import RecruitmentAgentClient
+        # Get site list from data if not provided
+        if site_list is None:
+            site_list = _get_default_site_list()
         
-        logger.info(f"Calling Recruitment agent for enrollment forecast: study_id={study_id}")
+        async with _client_lock:
+            client = await _get_recruitment_client()
+            try:
+                # Request enrollment projection
+                enrollment_projection = await client.request_enrollment_projection(
+                    study_id=study_id,
+                    site_list=site_list,
+                    monthly_rate=monthly_rate,
+                    screen_fail_rate=screen_fail_rate
+                )
+            except Exception:
+                # Connection may be broken; reconnect on the next call
+                await _discard_recruitment_client()
+                raise
         
-        client = RecruitmentAgentClient()
-        await client.connect()
+        logger.info("Successfully received enrollment projection from Recruitment agent")
+        return enrollment_projection
         
-        try:
-            # Get site list from data if not provided
-            if site_list is None:
-                from app.data_loader import load_data
-                data = load_data(upload_dir=None)
-                if "sites" in data and not data["sites"].empty:
-                    site_list = data["sites"]["site_id"].tolist()
-                else:
-                    site_list = [f"SITE_{i:03d}" for i in range(1, 11)]  # Default
-            
-            # Request enrollment projection
-            enrollment_projection = await client.request_enrollment_projection(
-                study_id=study_id,
-                site_list=site_list,
-                monthly_rate=monthly_rate,
-                screen_fail_rate=screen_fail_rate
-            )
-            
-            logger.info("Successfully received enrollment projection from Recruitment agent")
-            return enrollment_projection
-            
-        finally:
-            await client.disconnect()
-            
     except Exception as e:
         logger.error(f"Error calling Recruitment agent: {e}", exc_info=True)
         # Return empty result instead of failing
@@ -87,6 +160,73 @@ async def call_recruitment_agent_for_enrollment(
         }
 
 
+def _agg_site_means_kernel(
+    codes: np.ndarray,
+    weekly: np.ndarray,
+    screen_fail: np.ndarray,
+    n_sites: int
+) -> Tuple[float, float]:
+    """
+    Single pass over the enrollment rows returning
+    (sum of per-site mean weekly enrollment, mean screen fail rate).
+    
+    Missing site codes (-1) and NaN values are skipped, as in pandas.
+    """
+    sums = np.zeros(n_sites, dtype=np.float64)
+    counts = np.zeros(n_sites, dtype=np.int64)
+    fail_total = 0.0
+    fail_count = 0
+    for i in range(codes.size):
+        code = codes[i]
+        value = weekly[i]
+        if code >= 0 and not np.isnan(value):
+            sums[code] += value
+            counts[code] += 1
+        rate = screen_fail[i]
+        if not np.isnan(rate):
+            fail_total += rate
+            fail_count += 1
+    
+    total = 0.0
+    for j in range(n_sites):
+        if counts[j] > 0:
+            total += sums[j] / counts[j]
+    
+    mean_fail = fail_total / fail_count if fail_count > 0 else np.nan
+    return total, mean_fail
+
+
+def _agg_site_means_numpy(
+    codes: np.ndarray,
+    weekly: np.ndarray,
+    screen_fail: np.ndarray,
+    n_sites: int
+) -> Tuple[float, float]:
+    """NumPy equivalent of _agg_site_means_kernel used when numba is unavailable."""
+    valid = (codes >= 0) & ~np.isnan(weekly)
+    sums = np.bincount(codes[valid], weights=weekly[valid], minlength=n_sites)
+    counts = np.bincount(codes[valid], minlength=n_sites)
+    has_values = counts > 0
+    total = float((sums[has_values] / counts[has_values]).sum())
+    
+    rates = screen_fail[~np.isnan(screen_fail)]
+    mean_fail = float(rates.mean()) if rates.size else np.nan
+    return total, mean_fail
+
+
+if NUMBA_AVAILABLE:
+    _agg_site_means = njit(cache=True)(_agg_site_means_kernel)
+    # Compile once at import so the first request doesn't pay the JIT cost
+    _agg_site_means(
+        np.zeros(1, dtype=np.int64),
+        np.zeros(1, dtype=np.float64),
+        np.zeros(1, dtype=np.float64),
+        1
+    )
+else:
+    _agg_site_means = _agg_site_means_numpy
+
+
 def extract_enrollment_curve_from_supply_data(
     enrollment_df: pd.DataFrame,
     months: int = 12
@@ -106,8 +246,6 @@ def extract_enrollment_curve_from_supply_data(
         List of monthly enrollment numbers
     """
     try:
-        enrollment_curve = []
-        
         if enrollment_df.empty:
             logger.warning("Enrollment data is empty")
             return [0] * months
@@ -118,38 +256,58 @@ def extract_enrollment_curve_from_supply_data(
             # Average weeks per month = 365.25 / 12 / 7 ≈ 4.348
             weeks_per_month = 4.348
             
+            has_screen_fail = "screen_fail_rate" in enrollment_df.columns
+            
             # Get average weekly enrollment across all sites
             if "site_id" in enrollment_df.columns:
-                # Group by site and get average weekly enrollment per site
-                site_weekly_avg = enrollment_df.groupby("site_id")["weekly_enrollment"].mean()
-                total_weekly_enrollment = site_weekly_avg.sum()
+                # Sum of per-site average weekly enrollment and mean screen
+                # fail rate, computed together in one pass
+                weekly = enrollment_df["weekly_enrollment"].to_numpy(dtype=np.float64)
+                if has_screen_fail:
+                    screen_fail = enrollment_df["screen_fail_rate"].to_numpy(dtype=np.float64)
+                else:
+                    screen_fail = np.full(weekly.size, np.nan)
+                codes, uniques = pd.factorize(enrollment_df["site_id"])
+                total_weekly_enrollment, avg_screen_fail_rate = _agg_site_means(
+                    codes.astype(np.int64), weekly, screen_fail, len(uniques)
+                )
             else:
                 # Sum all weekly enrollment values
                 total_weekly_enrollment = enrollment_df["weekly_enrollment"].sum()
+                if has_screen_fail:
+                    avg_screen_fail_rate = enrollment_df["screen_fail_rate"].mean()
             
             # Convert to monthly enrollment
             avg_monthly_enrollment = int(total_weekly_enrollment * weeks_per_month)
             
             # Apply screen fail rate if available (adjust for successful enrollments)
-            if "screen_fail_rate" in enrollment_df.columns:
-                avg_screen_fail_rate = enrollment_df["screen_fail_rate"].mean()
+            if has_screen_fail:
                 # Adjust for successful enrollments (1 - screen_fail_rate)
                 avg_monthly_enrollment = int(avg_monthly_enrollment * (1 - avg_screen_fail_rate))
             
             # Project forward for all months
-            for month in range(months):
-                enrollment_curve.append(avg_monthly_enrollment)
+            enrollment_curve = [avg_monthly_enrollment] * months
             
             logger.info(f"Extracted enrollment curve from weekly_enrollment: {enrollment_curve} (total: {sum(enrollment_curve)})")
             return enrollment_curve
         
         # Check for enrollment_date + subject_count format (historical format)
         elif "enrollment_date" in enrollment_df.columns and "subject_count" in enrollment_df.columns:
-            enrollment_df["enrollment_date"] = pd.to_datetime(enrollment_df["enrollment_date"])
-            
-            # Calculate monthly totals
-            enrollment_df["year_month"] = enrollment_df["enrollment_date"].dt.to_period("M")
-            monthly_totals = enrollment_df.groupby("year_month")["subject_count"].sum()
+            # Calculate monthly totals on integer month buckets (months since
+            # the earliest enrollment); missing dates are skipped
+            enrollment_months = pd.to_datetime(enrollment_df["enrollment_date"]).values.astype("datetime64[M]")
+            has_date = ~np.isnat(enrollment_months)
+            month_idx = enrollment_months[has_date].astype(np.int64)
+            subject_counts = np.nan_to_num(
+                enrollment_df["subject_count"].to_numpy(dtype=np.float64)[has_date]
+            )
+            if month_idx.size > 0:
+                month_idx -= month_idx.min()
+                monthly_totals = np.bincount(month_idx, weights=subject_counts)
+                # Average over months that have enrollment records only
+                monthly_totals = monthly_totals[np.bincount(month_idx) > 0]
+            else:
+                monthly_totals = month_idx
             
             # Get average monthly enrollment
             if len(monthly_totals) > 0:
@@ -158,8 +316,7 @@ def extract_enrollment_curve_from_supply_data(
                 avg_monthly = enrollment_df["subject_count"].sum() / max(1, months)
             
             # Project forward
-            for month in range(months):
-                enrollment_curve.append(int(avg_monthly))
+            enrollment_curve = [int(avg_monthly)] * months
             
             logger.info(f"Extracted enrollment curve from enrollment_date: {enrollment_curve} (total: {sum(enrollment_curve)})")
             return enrollment_curve
@@ -1,6 +1,9 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable
+import atexit
+import threading
 import time
-from contextlib import contextmanager
+from collections import deque
+from contextlib import nullcontext
 from app.config import Config
 
 try:
@@ -11,6 +14,61 @@ except ImportError:
     print("Warning: AgentOps not available. Install with: pip install agentops")
 
 
+# Buffered events are recorded by a background thread every
+# EVENT_FLUSH_INTERVAL_SECONDS; the oldest are dropped past EVENT_QUEUE_SIZE
+EVENT_QUEUE_SIZE = 4096
+EVENT_FLUSH_INTERVAL_SECONDS = 0.05
+
+# Shared no-op context manager used when AgentOps is not available
+_NULL_TRACE = nullcontext()
+
+# Shared defaults for calls without tags/metadata (never mutated)
+_EMPTY_TAGS: Dict[str, str] = {}
+_EMPTY_METADATA: Dict[str, Any] = {}
+
+
+class _Trace:
+    """Context manager for a single AgentOps trace."""
+    
+    __slots__ = ("_tracer", "_record", "_name", "_tags", "_trace", "_start_ns")
+    
+    def __init__(
+        self,
+        tracer: Any,
+        record: Callable[[str, Optional[Dict[str, Any]]], None],
+        name: str,
+        tags: Optional[Dict[str, str]]
+    ):
+        self._tracer = tracer
+        self._record = record
+        self._name = name
+        self._tags = tags
+        self._trace = None
+        self._start_ns = 0
+    
+    def __enter__(self):
+        try:
+            # Create trace
+            tags = self._tags if self._tags is not None else _EMPTY_TAGS
+            self._trace = self._tracer.create_trace(name=self._name, tags=tags)
+            self._start_ns = time.perf_counter_ns()
+        except Exception as e:
+            print(f"Warning: AgentOps trace error: {e}")
+            self._trace = None
+        return self._trace
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        # Log completion
+        if exc_type is None and self._trace:
+            duration = (time.perf_counter_ns() - self._start_ns) / 1e9
+            self._record(
+                f"{self._name}_completed",
+                {"duration_seconds": duration}
+            )
+        # Never suppress exceptions raised inside the traced block
+        return False
+
+
 class AgentOpsInstrumentation:
     """Wrapper for AgentOps instrumentation."""
     
@@ -27,8 +85,20 @@ class AgentOpsInstrumentation:
             except Exception as e:
                 print(f"Warning: Failed to initialize AgentOps: {e}")
                 self.tracer = None
+        
+        # Events are queued by log_event and recorded in batches off the caller's thread
+        self._event_queue: deque = deque(maxlen=EVENT_QUEUE_SIZE)
+        self._stop_flushing = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if self.tracer:
+            self._flusher = threading.Thread(
+                target=self._flush_loop,
+                name="agentops-event-flusher",
+                daemon=True
+            )
+            self._flusher.start()
+            atexit.register(self._stop_flusher)
     
-    @contextmanager
     def trace(self, name: str, tags: Optional[Dict[str, str]] = None):
         """
         Context manager for creating traces.
@@ -39,25 +109,8 @@ class AgentOpsInstrumentation:
         """
         if not self.tracer:
             # No-op if AgentOps not available
-            yield None
-            return
-        
-        try:
-            # Create trace
-            trace = self.tracer.create_trace(name=name, tags=tags or {})
-            start_time = time.time()
-            yield trace
-            
-            # Log completion
-            duration = time.time() - start_time
-            if trace:
-                self.tracer.record(
-                    f"{name}_completed",
-                    metadata={"duration_seconds": duration}
-                )
-        except Exception as e:
-            print(f"Warning: AgentOps trace error: {e}")
-            yield None
+            return _NULL_TRACE
+        return _Trace(self.tracer, self.log_event, name, tags)
     
     def log_event(
         self,
@@ -74,14 +127,40 @@ class AgentOpsInstrumentation:
         if not self.tracer:
             return
         
-        try:
-            self.tracer.record(event_name, metadata=metadata or {})
-        except Exception as e:
-            print(f"Warning: AgentOps log error: {e}")
+        self._event_queue.append(
+            (event_name, metadata if metadata is not None else _EMPTY_METADATA)
+        )
+    
+    def flush(self):
+        """Record all queued events to AgentOps."""
+        while True:
+            try:
+                event_name, metadata = self._event_queue.popleft()
+            except IndexError:
+                return
+            try:
+                self.tracer.record(event_name, metadata=metadata)
+            except Exception as e:
+                print(f"Warning: AgentOps log error: {e}")
+    
+    def _flush_loop(self):
+        """Background loop recording queued events until stopped."""
+        while not self._stop_flushing.wait(EVENT_FLUSH_INTERVAL_SECONDS):
+            self.flush()
+    
+    def _stop_flusher(self):
+        """Stop the background flusher and record any remaining events."""
+        self._stop_flushing.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        if self.tracer:
+            self.flush()
     
     def end_session(self):
         """End AgentOps session."""
         if self.tracer:
+            self._stop_flusher()
             try:
                 self.tracer.end_session("Success")
             except Exception as e:
@@ -90,12 +169,18 @@ class AgentOpsInstrumentation:
 
 # Global instance
 _instrumentation: Optional[AgentOpsInstrumentation] = None
+_instrumentation_lock = threading.Lock()
 
 
 def get_instrumentation() -> AgentOpsInstrumentation:
-    """Get or create global instrumentation instance."""
+    """Get or create global instrumentation instance (thread-safe)."""
     global _instrumentation
-    if _instrumentation is None:
-        _instrumentation = AgentOpsInstrumentation()
-    return _instrumentation
+    instance = _instrumentation
+    if instance is None:
+        # Double-checked so concurrent first calls create a single AgentOps session
+        with _instrumentation_lock:
+            if _instrumentation is None:
+                _instrumentation = AgentOpsInstrumentation()
+            instance = _instrumentation
+    return instance
 
@@ -1,6 +1,10 @@
-import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+import orjson
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -14,28 +18,153 @@ from app.waste_analyzer import WasteAnalyzer
 from app.temp_excursion_handler import TempExcursionHandler
 from app.depot_optimizer import DepotOptimizer
 from app.data_loader import load_data
-from app.a2a_integration import call_recruitment_agent_for_enrollment
+from app.a2a_integration import (
+    call_recruitment_agent_for_enrollment,
+    close_recruitment_client,
+    extract_enrollment_curve_from_supply_data,
+    warm_recruitment_client,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _warm_up_pipeline() -> None:
+    """Exercise pandas and the enrollment aggregation once so the first request doesn't pay for it."""
+    pd.DataFrame({"a": [1]}).groupby("a").sum()
+    extract_enrollment_curve_from_supply_data(
+        pd.DataFrame({"site_id": ["S"], "weekly_enrollment": [1.0], "screen_fail_rate": [0.0]}),
+        months=1
+    )
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response serialized with orjson (handles numpy scalars natively)."""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hooks."""
+    await asyncio.to_thread(Config.provision_upload_slots)
+    await asyncio.to_thread(_warm_up_pipeline)
+    # Connect to the Recruitment agent in the background; startup doesn't wait on it
+    warm_a2a_task = asyncio.create_task(warm_recruitment_client())
+    yield
+    warm_a2a_task.cancel()
+    # Close the shared A2A connection to the Recruitment agent
+    await close_recruitment_client()
+
+
 app = FastAPI(
     title="Clinical Supply Copilot API",
     description="API for clinical supply forecasting and resupply recommendations",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Filenames every upload must include
+_REQUIRED_FILENAMES: frozenset[str] = frozenset(Config.REQUIRED_CSV_FILES.values())
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:3001", "http://127.0.0.1:3000"],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Only the methods/headers the frontends actually send
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
 )
 
 
+def _csv_mtimes(data_dir: Path) -> Tuple[Optional[int], ...]:
+    """Modification times of the required CSV files in a directory (None if missing)."""
+    mtimes = []
+    for filename in Config.REQUIRED_CSV_FILES.values():
+        try:
+            mtimes.append((data_dir / filename).stat().st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+@lru_cache(maxsize=4)
+def _load_data_cached(data_dir: Path, mtimes: Tuple[Optional[int], ...]) -> Dict[str, pd.DataFrame]:
+    """Parse the default data directory; cached per (directory, CSV mtimes)."""
+    return load_data(upload_dir=None)
+
+
+def _load_default_data() -> Dict[str, pd.DataFrame]:
+    """
+    Load the default data directory, reusing parsed DataFrames while the
+    CSV files are unchanged.
+    
+    Returns copies, since the analyzers add columns to their inputs.
+    """
+    data_dir = Config.DATA_DIR
+    data = _load_data_cached(data_dir, _csv_mtimes(data_dir))
+    return {key: df.copy() for key, df in data.items()}
+
+
+@lru_cache(maxsize=1024)
+def _parse_date(value: str) -> datetime:
+    """Parse a YYYY-MM-DD date string (month and day may be unpadded)."""
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def _extract_local_enrollment_curve(upload_dir: Path) -> Optional[List[int]]:
+    """Extract a 12-month enrollment curve from the uploaded enrollment data (A2A fallback)."""
+    data = load_data(upload_dir=upload_dir)
+    if "enrollment" in data and not data["enrollment"].empty:
+        return extract_enrollment_curve_from_supply_data(data["enrollment"], months=12)
+    return None
+
+
+def _calculate_supply_forecast(enrollment_curve: List[int]) -> Dict:
+    """Calculate a supply forecast for an enrollment curve using the supply MCP server logic."""
+    from server_supply import SupplyMCPServer
+    supply_server = SupplyMCPServer()
+    return supply_server.calculate_supply_forecast(
+        enrollment_curve=enrollment_curve,
+        visit_schedule=None,  # Use defaults
+        kit_usage_per_visit=1.0
+    )
+
+
+async def _local_supply_fallback(local_curve_task: asyncio.Task, reason: str) -> Optional[Dict]:
+    """
+    Calculate a supply forecast from the local enrollment curve when the
+    Recruitment agent curve is unavailable.
+    
+    Args:
+        local_curve_task: Task producing the local enrollment curve
+        reason: Description of why the fallback is used (for logging)
+        
+    Returns:
+        Supply forecast, or None if the local data has no usable enrollment
+    """
+    try:
+        local_curve = await local_curve_task
+        if local_curve and sum(local_curve) > 0:
+            supply_forecast = await asyncio.to_thread(_calculate_supply_forecast, local_curve)
+            logger.info(f"[A2A] Used local enrollment data as fallback {reason}")
+            return supply_forecast
+    except Exception as fallback_error:
+        logger.error(f"[A2A] Fallback enrollment extraction failed {reason}: {fallback_error}", exc_info=True)
+    return None
+
+
+def _consume_task_result(task: asyncio.Task) -> None:
+    """Done-callback that retrieves a discarded task's exception so it isn't reported as unhandled."""
+    if not task.cancelled():
+        task.exception()
+
+
 class ErrorResponse(BaseModel):
     """Error response model."""
     error: str
@@ -78,11 +207,20 @@ async def upload_and_run(
     - shipment_logs.csv
     - waste.csv
     
+    The uploads are saved to a pooled directory that is cleared when the
+    request finishes (or, with a Gemini batch job, once its answers are
+    merged), so output_path is only valid while it runs; the results are
+    returned in the response.
+    
     Returns:
         JSON response with results, summary, session_id, and output_path
     """
-    session_id = str(uuid.uuid4())
-    upload_dir = Config.get_upload_dir(session_id)
+    try:
+        upload_dir = Config.acquire_upload_dir()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    local_curve_task = None
+    orchestrator = None
     
     try:
         # Validate filenames
@@ -97,9 +235,8 @@ async def upload_and_run(
         
         # Check all required files are present
         received_filenames = set(uploaded_files.keys())
-        required_filenames = set(Config.REQUIRED_CSV_FILES.values())
         
-        missing_files = required_filenames - received_filenames
+        missing_files = _REQUIRED_FILENAMES - received_filenames
         if missing_files:
             raise HTTPException(
                 status_code=400,
@@ -112,10 +249,18 @@ async def upload_and_run(
         # Run orchestrator
         output_path = upload_dir / "results.jsonl"
         orchestrator = Orchestrator()
-        result = orchestrator.run(upload_dir=upload_dir, output_path=output_path)
+        # Run the CPU/IO-heavy pipeline off the event loop thread
+        result = await asyncio.to_thread(orchestrator.run, upload_dir=upload_dir, output_path=output_path)
         
         # A2A Integration: Optionally call Recruitment agent for updated enrollment
         if enable_a2a:
+            # Speculatively compute the local fallback curve while the
+            # Recruitment agent call is in flight; discarded if not needed
+            local_curve_task = asyncio.create_task(
+                asyncio.to_thread(_extract_local_enrollment_curve, upload_dir)
+            )
+            local_curve_task.add_done_callback(_consume_task_result)
+            
             try:
                 logger.info("[A2A] Starting A2A integration with Recruitment agent...")
                 
@@ -139,13 +284,7 @@ async def upload_and_run(
                 if enrollment_curve and len(enrollment_curve) > 0 and sum(enrollment_curve) > 0:
                     # Calculate supply forecast using A2A enrollment curve
                     try:
-                        from server_supply import SupplyMCPServer
-                        supply_server = SupplyMCPServer()
-                        supply_forecast = supply_server.calculate_supply_forecast(
-                            enrollment_curve=enrollment_curve,
-                            visit_schedule=None,  # Use defaults
-                            kit_usage_per_visit=1.0
-                        )
+                        supply_forecast = await asyncio.to_thread(_calculate_supply_forecast, enrollment_curve)
                         logger.info(f"[A2A] Supply forecast calculated: {supply_forecast.get('summary', {}).get('total_kits_needed', 0)} kits needed")
                     except Exception as forecast_error:
                         logger.error(f"[A2A] Error calculating supply forecast: {forecast_error}", exc_info=True)
@@ -153,22 +292,7 @@ async def upload_and_run(
                 else:
                     logger.warning("[A2A] Enrollment curve is empty or invalid, skipping supply forecast calculation")
                     # Try to extract from local data as fallback
-                    try:
-                        from app.a2a_integration import extract_enrollment_curve_from_supply_data
-                        data = load_data(upload_dir=upload_dir)
-                        if "enrollment" in data and not data["enrollment"].empty:
-                            local_curve = extract_enrollment_curve_from_supply_data(data["enrollment"], months=12)
-                            if local_curve and sum(local_curve) > 0:
-                                from server_supply import SupplyMCPServer
-                                supply_server = SupplyMCPServer()
-                                supply_forecast = supply_server.calculate_supply_forecast(
-                                    enrollment_curve=local_curve,
-                                    visit_schedule=None,
-                                    kit_usage_per_visit=1.0
-                                )
-                                logger.info("[A2A] Used local enrollment data as fallback for supply forecast")
-                    except Exception as fallback_error:
-                        logger.error(f"[A2A] Fallback enrollment extraction failed: {fallback_error}", exc_info=True)
+                    supply_forecast = await _local_supply_fallback(local_curve_task, "for supply forecast")
                 
                 # Add A2A results to response
                 result["a2a_integration"] = {
@@ -185,23 +309,7 @@ async def upload_and_run(
                 logger.error(f"[A2A] Error in A2A integration: {a2a_error}", exc_info=True)
                 
                 # Try fallback: extract enrollment from local data
-                supply_forecast = None
-                try:
-                    from app.a2a_integration import extract_enrollment_curve_from_supply_data
-                    data = load_data(upload_dir=upload_dir)
-                    if "enrollment" in data and not data["enrollment"].empty:
-                        local_curve = extract_enrollment_curve_from_supply_data(data["enrollment"], months=12)
-                        if local_curve and sum(local_curve) > 0:
-                            from server_supply import SupplyMCPServer
-                            supply_server = SupplyMCPServer()
-                            supply_forecast = supply_server.calculate_supply_forecast(
-                                enrollment_curve=local_curve,
-                                visit_schedule=None,
-                                kit_usage_per_visit=1.0
-                            )
-                            logger.info("[A2A] Used local enrollment data as fallback after A2A failure")
-                except Exception as fallback_error:
-                    logger.error(f"[A2A] Fallback enrollment extraction also failed: {fallback_error}", exc_info=True)
+                supply_forecast = await _local_supply_fallback(local_curve_task, "after A2A failure")
                 
                 result["a2a_integration"] = {
                     "enabled": True,
@@ -212,7 +320,7 @@ async def upload_and_run(
         else:
             result["a2a_integration"] = {"enabled": False}
         
-        return JSONResponse(content=result)
+        return ORJSONResponse(content=result)
         
     except UploadValidationError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -223,6 +331,19 @@ async def upload_and_run(
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )
+    finally:
+        # The speculative local curve reads the uploaded CSVs; let it finish
+        # before the slot is cleared and handed to another upload
+        if local_curve_task is not None:
+            await asyncio.gather(local_curve_task, return_exceptions=True)
+        batch_job_merge = orchestrator.batch_job_merge if orchestrator else None
+        if batch_job_merge is not None:
+            # A background batch job merge still rewrites output_path; the
+            # slot is released from its thread once it finishes
+            batch_job_merge.add_done_callback(lambda _: Config.release_upload_dir(upload_dir))
+        else:
+            # Clearing the slot deletes files; keep it off the event loop
+            await asyncio.to_thread(Config.release_upload_dir, upload_dir)
 
 
 @app.post("/run-default")
@@ -236,9 +357,9 @@ async def run_default():
     try:
         orchestrator = Orchestrator()
         output_path = Config.DATA_DIR / "results.jsonl"
-        result = orchestrator.run(upload_dir=None, output_path=output_path)
+        result = await asyncio.to_thread(orchestrator.run, upload_dir=None, output_path=output_path)
         
-        return JSONResponse(content=result)
+        return ORJSONResponse(content=result)
         
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -258,14 +379,15 @@ async def get_waste_analysis():
         JSON response with waste analysis results
     """
     try:
-        data = load_data(upload_dir=None)
+        data = await asyncio.to_thread(_load_default_data)
         waste_analyzer = WasteAnalyzer()
-        analysis = waste_analyzer.analyze_waste_patterns(
+        analysis = await asyncio.to_thread(
+            waste_analyzer.analyze_waste_patterns,
             data.get("waste", pd.DataFrame()),
             data.get("inventory", pd.DataFrame()),
             data.get("dispense", pd.DataFrame())
         )
-        return JSONResponse(content=analysis)
+        return ORJSONResponse(content=analysis)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -284,13 +406,14 @@ async def get_temp_excursions():
         JSON response with temperature excursion data
     """
     try:
-        data = load_data(upload_dir=None)
+        data = await asyncio.to_thread(_load_default_data)
         temp_handler = TempExcursionHandler()
-        excursions = temp_handler.detect_excursions(
+        excursions = await asyncio.to_thread(
+            temp_handler.detect_excursions,
             data.get("shipment", pd.DataFrame()),
             data.get("waste", pd.DataFrame())
         )
-        return JSONResponse(content=excursions)
+        return ORJSONResponse(content=excursions)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -320,8 +443,12 @@ async def generate_temp_justification(
         JSON response with justification text
     """
     try:
-        from datetime import datetime
-        data = load_data(upload_dir=None)
+        excursion_date = _parse_date(date)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid date {date!r}; expected YYYY-MM-DD")
+    
+    try:
+        data = await asyncio.to_thread(_load_default_data)
         temp_handler = TempExcursionHandler()
         
         # Get site name
@@ -333,15 +460,15 @@ async def generate_temp_justification(
                 site_name = site_row.iloc[0].get("site_name", site_id)
         
         # Get excursion data
-        excursions = temp_handler.detect_excursions(
+        excursions = await asyncio.to_thread(
+            temp_handler.detect_excursions,
             data.get("shipment", pd.DataFrame()),
             data.get("waste", pd.DataFrame())
         )
         excursion_data = excursions.get(site_id, {})
         
-        excursion_date = datetime.strptime(date, "%Y-%m-%d")
-        
-        justification = temp_handler.generate_justification(
+        justification = await asyncio.to_thread(
+            temp_handler.generate_justification,
             excursion_data,
             site_id,
             site_name,
@@ -350,7 +477,7 @@ async def generate_temp_justification(
             temperature
         )
         
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "site_id": site_id,
             "site_name": site_name,
             "justification": justification
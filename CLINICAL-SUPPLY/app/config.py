@@ -1,6 +1,9 @@
 import os
+import shutil
+import threading
+from collections import deque
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, Tuple
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -17,21 +20,16 @@ class Config:
     GEMINI_API_KEY_2: str = os.getenv("GEMINI_API_KEY_2", "")
     GEMINI_API_KEY_3: str = os.getenv("GEMINI_API_KEY_3", "")
     
+    # Configured keys in priority order (primary first), computed once
+    _API_KEYS: Tuple[str, ...] = tuple(
+        key for key in (GEMINI_API_KEY, GEMINI_API_KEY_1, GEMINI_API_KEY_2, GEMINI_API_KEY_3)
+        if key
+    )
+    
     @classmethod
-    def get_gemini_api_keys(cls) -> List[str]:
+    def get_gemini_api_keys(cls) -> Tuple[str, ...]:
         """Get all available Gemini API keys."""
-        keys = []
-        # Add primary key if set
-        if cls.GEMINI_API_KEY:
-            keys.append(cls.GEMINI_API_KEY)
-        # Add numbered keys if set
-        if cls.GEMINI_API_KEY_1:
-            keys.append(cls.GEMINI_API_KEY_1)
-        if cls.GEMINI_API_KEY_2:
-            keys.append(cls.GEMINI_API_KEY_2)
-        if cls.GEMINI_API_KEY_3:
-            keys.append(cls.GEMINI_API_KEY_3)
-        return keys
+        return cls._API_KEYS
     
     # Use latest available models (as of 2025)
     # Default: gemini-2.0-flash (Latest and fastest model)
@@ -41,6 +39,10 @@ class Config:
         "GEMINI_BASE_URL",
         "https://generativelanguage.googleapis.com/v1beta"
     )
+    # Client-side request pacing per API key (Gemini Flash free tier is ~60 RPM)
+    GEMINI_REQUESTS_PER_MINUTE: int = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+    # Gzip request bodies above ~one packet (off unless the endpoint is known to accept it)
+    GEMINI_GZIP_REQUESTS: bool = os.getenv("GEMINI_GZIP_REQUESTS", "false").lower() == "true"
     
     # AgentOps Configuration
     AGENTOPS_API_KEY: str = os.getenv("AGENTOPS_API_KEY", "")
@@ -59,6 +61,12 @@ class Config:
     
     DATA_DIR: Path = Path(os.getenv("DATA_DIR", str(_default_data_dir)))
     UPLOAD_BASE_DIR: Path = Path(os.getenv("UPLOAD_BASE_DIR", "/tmp/uploads"))
+    # Pooled upload directories per process; uploads beyond this many at once are rejected
+    UPLOAD_SLOT_COUNT: int = int(os.getenv("UPLOAD_SLOT_COUNT", "1024"))
+    _free_upload_slots: deque = deque()
+    _upload_slots_in_use: set = set()
+    _upload_slot_root: Optional[Path] = None  # Slot directory of the process that provisioned the pool
+    _upload_slot_lock = threading.Lock()
     
     # Environment
     ENV: str = os.getenv("ENV", "development")
@@ -90,30 +98,97 @@ class Config:
     # Batch API calls
     BATCH_API_SIZE: int = int(os.getenv("BATCH_API_SIZE", "5"))  # Sites per API call
     USE_BATCH_API: bool = os.getenv("USE_BATCH_API", "true").lower() == "true"
+    # Adapt the batch size to observed latency, starting from BATCH_API_SIZE
+    USE_ADAPTIVE_BATCH_SIZE: bool = os.getenv("USE_ADAPTIVE_BATCH_SIZE", "true").lower() == "true"
+    LLM_BATCH_SIZE_MAX: int = int(os.getenv("LLM_BATCH_SIZE_MAX", "16"))  # Larger batches lose accuracy
+    LLM_BATCH_LATENCY_BUDGET_MS: float = float(os.getenv("LLM_BATCH_LATENCY_BUDGET_MS", "30000"))  # p95 per call
     
     # Parallel processing
     MAX_CONCURRENT_REQUESTS: int = int(os.getenv("MAX_CONCURRENT_REQUESTS", "3"))
     USE_PARALLEL: bool = os.getenv("USE_PARALLEL", "true").lower() == "true"
+    # Micro-batch individual LLM calls when the batch API is off (1 disables)
+    LLM_MAX_BATCH_SIZE: int = int(os.getenv("LLM_MAX_BATCH_SIZE", "1"))  # Sites per flushed batch
+    LLM_BATCH_TIMEOUT_MS: float = float(os.getenv("LLM_BATCH_TIMEOUT_MS", "50"))  # Max wait to fill a batch
     
     # Selective LLM usage
     LLM_PRIORITY_THRESHOLD: float = float(os.getenv("LLM_PRIORITY_THRESHOLD", "1.5"))  # Urgency score threshold
     LLM_EXPIRY_THRESHOLD: int = int(os.getenv("LLM_EXPIRY_THRESHOLD", "60"))  # Days to expiry threshold
     USE_SELECTIVE_LLM: bool = os.getenv("USE_SELECTIVE_LLM", "true").lower() == "true"
     
+    # Gemini Batch Mode jobs (discounted, asynchronous) for medium-urgency LLM sites:
+    # LLM_BATCH_THRESHOLD <= urgency_score < LLM_PRIORITY_THRESHOLD
+    USE_GEMINI_BATCH_JOBS: bool = os.getenv("USE_GEMINI_BATCH_JOBS", "false").lower() == "true"
+    LLM_BATCH_THRESHOLD: float = float(os.getenv("LLM_BATCH_THRESHOLD", "1.0"))  # Urgency score lower bound
+    # Seconds to wait for the job in the background before it is cancelled and
+    # its sites keep their rules results
+    GEMINI_BATCH_JOB_TIMEOUT: float = float(os.getenv("GEMINI_BATCH_JOB_TIMEOUT", "900"))
+    
+    # LLM result cache (shared across pipeline runs in one process)
+    LLM_CACHE_TTL: int = int(os.getenv("LLM_CACHE_TTL", "3600"))  # Seconds; 0 disables the cache
+    
     @classmethod
     def validate(cls) -> None:
         """Validate required configuration."""
         # Check if at least one Gemini API key is configured
-        api_keys = cls.get_gemini_api_keys()
-        if not api_keys:
+        if not cls._API_KEYS:
             raise ValueError("At least one GEMINI_API_KEY is required. Set GEMINI_API_KEY or GEMINI_API_KEY_1, GEMINI_API_KEY_2, GEMINI_API_KEY_3")
         if not cls.AGENTOPS_API_KEY:
             raise ValueError("AGENTOPS_API_KEY is required")
     
     @classmethod
-    def get_upload_dir(cls, session_id: str) -> Path:
-        """Get upload directory for a session."""
-        upload_dir = cls.UPLOAD_BASE_DIR / session_id
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        return upload_dir
-
+    def provision_upload_slots(cls) -> None:
+        """
+        Pre-create this process's upload slot directories and mark them all free.
+        
+        Slots live under a per-process directory, so workers sharing
+        UPLOAD_BASE_DIR (and a restarted process) never touch each other's files.
+        """
+        root = cls.UPLOAD_BASE_DIR / f"worker_{os.getpid()}"
+        with cls._upload_slot_lock:
+            if cls._upload_slot_root == root:
+                return
+            for slot in range(cls.UPLOAD_SLOT_COUNT):
+                (root / f"slot_{slot:04d}").mkdir(parents=True, exist_ok=True)
+            cls._free_upload_slots = deque(range(cls.UPLOAD_SLOT_COUNT))
+            cls._upload_slots_in_use = set()
+            cls._upload_slot_root = root
+    
+    @classmethod
+    def acquire_upload_dir(cls) -> Path:
+        """
+        Take a free pooled upload directory; return it with release_upload_dir.
+        
+        Raises:
+            RuntimeError: If every slot is in use
+        """
+        if cls._upload_slot_root != cls.UPLOAD_BASE_DIR / f"worker_{os.getpid()}":
+            cls.provision_upload_slots()
+        with cls._upload_slot_lock:
+            if not cls._free_upload_slots:
+                raise RuntimeError(f"All {cls.UPLOAD_SLOT_COUNT} upload slots are in use")
+            slot = cls._free_upload_slots.popleft()
+            cls._upload_slots_in_use.add(slot)
+            return cls._upload_slot_root / f"slot_{slot:04d}"
+    
+    @classmethod
+    def release_upload_dir(cls, upload_dir: Path) -> None:
+        """
+        Clear an acquired upload directory and return its slot to the pool.
+        
+        Clearing is blocking file I/O; async callers should run this in a
+        worker thread.
+        """
+        slot = int(upload_dir.name.split("_")[1])
+        with cls._upload_slot_lock:
+            if upload_dir.parent != cls._upload_slot_root or slot not in cls._upload_slots_in_use:
+                return
+        
+        for child in upload_dir.iterdir():
+            if child.is_dir():
+                shutil.rmtree(child)
+            else:
+                child.unlink()
+        
+        with cls._upload_slot_lock:
+            cls._upload_slots_in_use.discard(slot)
+            cls._free_upload_slots.append(slot)
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Optional
 import pandas as pd
@@ -5,6 +6,12 @@ from app.config import Config
 from app.upload_handler import load_uploaded_csvs, UploadValidationError
 
 
+@lru_cache(maxsize=2)
+def _data_dir_exists(data_dir: Path) -> bool:
+    """Check (once per directory) that the default data directory exists."""
+    return data_dir.exists()
+
+
 def load_data(upload_dir: Optional[Path] = None) -> Dict[str, pd.DataFrame]:
     """
     Load CSV data from either upload directory or default data directory.
@@ -34,7 +41,9 @@ def load_data(upload_dir: Optional[Path] = None) -> Dict[str, pd.DataFrame]:
     else:
         # Load from default data directory
         data_dir = Config.DATA_DIR
-        if not data_dir.exists():
+        if not _data_dir_exists(data_dir):
+            # Don't remember a missing directory; it may be created later
+            _data_dir_exists.cache_clear()
             raise FileNotFoundError(
                 f"Default data directory not found: {data_dir}. "
                 f"Please create the directory and add your CSV files, or set DATA_DIR in your .env file."
@@ -3,6 +3,66 @@ import pandas as pd
 import numpy as np
 from app.config import Config
 
+# Try to import numba for the JIT-compiled safety stock kernel
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Z-score for service level (95% = 1.645)
+_Z_SCORES = {
+    0.90: 1.28,
+    0.95: 1.645,
+    0.99: 2.33
+}
+
+
+def _safety_stock_kernel(
+    avg_demand: np.ndarray,
+    lead_time: np.ndarray,
+    cv: np.ndarray,
+    z: float
+) -> np.ndarray:
+    """
+    Safety stock per site: Z * (demand during lead time * cv) * sqrt(lead time in weeks).
+    
+    Values are truncated towards zero and clipped at 0.
+    """
+    n = avg_demand.size
+    out = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        weeks = lead_time[i] / 7
+        std_demand = avg_demand[i] * weeks * cv[i]
+        safety_stock = int(z * std_demand * np.sqrt(weeks))
+        out[i] = max(0, safety_stock)
+    return out
+
+
+def _safety_stock_numpy(
+    avg_demand: np.ndarray,
+    lead_time: np.ndarray,
+    cv: np.ndarray,
+    z: float
+) -> np.ndarray:
+    """NumPy equivalent of _safety_stock_kernel used when numba is unavailable."""
+    weeks = lead_time / 7
+    std_demand = avg_demand * weeks * cv
+    return np.maximum(0, (z * std_demand * np.sqrt(weeks)).astype(np.int64))
+
+
+if NUMBA_AVAILABLE:
+    _safety_stock = njit(cache=True)(_safety_stock_kernel)
+    # Compile once at import so the first request doesn't pay the JIT cost
+    _safety_stock(
+        np.zeros(1, dtype=np.float64),
+        np.full(1, 7.0, dtype=np.float64),
+        np.zeros(1, dtype=np.float64),
+        1.645
+    )
+else:
+    _safety_stock = _safety_stock_numpy
+
 
 class DepotOptimizer:
     """Optimizes depot-to-site allocation and multi-echelon inventory."""
@@ -40,51 +100,55 @@ class DepotOptimizer:
             "optimization_score": 0.0
         }
         
-        # Calculate net demand (demand - current inventory)
-        net_demands = {}
-        for site_id, demand in site_demands.items():
-            current_inv = site_inventory.get(site_id, 0)
-            net_demands[site_id] = max(0, demand - current_inv)
+        site_ids, depot_ids, net_demand, avail, score = self._build_matrices(
+            site_demands, depot_inventory, site_inventory, lead_times, shipping_costs
+        )
+        
+        # Site-major copy of the scores; depots without stock are masked out
+        # once instead of filtering the candidates for every site
+        site_scores = np.ascontiguousarray(score.T)
+        site_scores[:, avail <= 0] = np.inf
         
         # Simple greedy allocation algorithm
         # Priority: sites with highest urgency first
-        sorted_sites = sorted(net_demands.items(), key=lambda x: x[1], reverse=True)
-        
-        remaining_depot_inv = depot_inventory.copy()
-        
-        for site_id, net_demand in sorted_sites:
-            if net_demand <= 0:
+        for s in np.argsort(-net_demand, kind="stable"):
+            demand = net_demand[s]
+            if demand <= 0:
                 continue
+            site_id = site_ids[s]
             
-            # Find best depot for this site
-            best_depot = self._find_best_depot(
-                site_id, net_demand, remaining_depot_inv, lead_times, shipping_costs
-            )
+            # Best depot for this site: lowest score among depots with stock left
+            site_score = site_scores[s]
+            d = int(np.argmin(site_score)) if site_score.size else -1
             
-            if best_depot:
-                depot_id, allocated_qty = best_depot
+            if d >= 0 and site_score[d] < np.inf:
+                depot_id = depot_ids[d]
+                allocated_qty = min(demand, avail[d])
+                avail[d] -= allocated_qty
+                if avail[d] <= 0:
+                    site_scores[:, d] = np.inf
+                allocated_qty = allocated_qty.item()
                 allocation_plan["allocations"].append({
                     "depot_id": depot_id,
                     "site_id": site_id,
                     "quantity": allocated_qty,
-                    "lead_time_days": lead_times.get(depot_id, {}).get(site_id, 7)
+                    "lead_time_days": lead_times[depot_id][site_id]
                 })
                 allocation_plan["total_allocated"] += allocated_qty
-                remaining_depot_inv[depot_id] -= allocated_qty
                 
-                if allocated_qty < net_demand:
-                    allocation_plan["unmet_demand"][site_id] = net_demand - allocated_qty
+                if allocated_qty < demand:
+                    allocation_plan["unmet_demand"][site_id] = (demand - allocated_qty).item()
             else:
                 # No depot can fulfill demand
-                allocation_plan["unmet_demand"][site_id] = net_demand
+                allocation_plan["unmet_demand"][site_id] = demand.item()
         
         # Calculate excess inventory at depots
-        for depot_id, remaining in remaining_depot_inv.items():
+        for depot_id, remaining in zip(depot_ids, avail.tolist()):
             if remaining > 0:
                 allocation_plan["excess_inventory"][depot_id] = remaining
         
         # Calculate optimization score (percentage of demand met)
-        total_demand = sum(net_demands.values())
+        total_demand = sum(net_demand.tolist())
         if total_demand > 0:
             allocation_plan["optimization_score"] = (
                 allocation_plan["total_allocated"] / total_demand
@@ -92,45 +156,51 @@ class DepotOptimizer:
         
         return allocation_plan
     
-    def _find_best_depot(
+    def _build_matrices(
         self,
-        site_id: str,
-        demand: int,
+        site_demands: Dict[str, int],
         depot_inventory: Dict[str, int],
+        site_inventory: Dict[str, int],
         lead_times: Dict[str, Dict[str, int]],
         shipping_costs: Optional[Dict[str, Dict[str, float]]]
-    ) -> Optional[Tuple[str, int]]:
-        """Find the best depot to fulfill site demand."""
-        candidates = []
+    ) -> Tuple[List[str], List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Lay out the allocation inputs as arrays.
         
-        for depot_id, available in depot_inventory.items():
-            if available <= 0:
-                continue
-            
-            # Check if depot can serve this site
-            if depot_id not in lead_times or site_id not in lead_times[depot_id]:
-                continue
-            
-            lead_time = lead_times[depot_id][site_id]
-            allocatable = min(demand, available)
-            
-            # Calculate score (lower is better)
-            # Prioritize: lower lead time, lower cost, higher availability
-            score = lead_time
-            
-            if shipping_costs and depot_id in shipping_costs and site_id in shipping_costs[depot_id]:
-                score += shipping_costs[depot_id][site_id] * 0.1  # Weight cost less than lead time
-            
-            candidates.append((depot_id, allocatable, score))
+        Returns:
+            Tuple of (site_ids, depot_ids, net_demand[S], available[D], score[D, S]) where
+            score is lead time plus 0.1 * shipping cost (lower is better) and np.inf marks
+            depot-site pairs with no known lead time
+        """
+        site_ids = list(site_demands)
+        depot_ids = list(depot_inventory)
+        site_index = {site_id: i for i, site_id in enumerate(site_ids)}
         
-        if not candidates:
-            return None
+        # Net demand (demand - current inventory)
+        net_demand = np.maximum(0, np.array([
+            demand - site_inventory.get(site_id, 0) for site_id, demand in site_demands.items()
+        ]))
+        avail = np.array(list(depot_inventory.values()))
+        # One dtype for demand and stock, so float demands are not truncated
+        # when allocated out of integer stock
+        dtype = np.result_type(net_demand, avail)
+        net_demand = net_demand.astype(dtype, copy=False)
+        avail = avail.astype(dtype, copy=False)
         
-        # Sort by score (best first)
-        candidates.sort(key=lambda x: x[2])
-        best_depot_id, best_qty, _ = candidates[0]
+        score = np.full((len(depot_ids), len(site_ids)), np.inf)
+        for d, depot_id in enumerate(depot_ids):
+            depot_costs = (shipping_costs or {}).get(depot_id, {})
+            for site_id, lead_time in lead_times.get(depot_id, {}).items():
+                s = site_index.get(site_id)
+                if s is None:
+                    continue
+                # Weight cost less than lead time
+                if site_id in depot_costs:
+                    score[d, s] = lead_time + depot_costs[site_id] * 0.1
+                else:
+                    score[d, s] = lead_time
         
-        return (best_depot_id, best_qty)
+        return site_ids, depot_ids, net_demand, avail, score
     
     def optimize_safety_stock(
         self,
@@ -151,30 +221,23 @@ class DepotOptimizer:
         Returns:
             Dictionary mapping site_id to recommended safety stock
         """
-        safety_stocks = {}
+        z = _Z_SCORES.get(service_level, 1.645)
         
-        # Z-score for service level (95% = 1.645)
-        z_scores = {
-            0.90: 1.28,
-            0.95: 1.645,
-            0.99: 2.33
-        }
-        z = z_scores.get(service_level, 1.645)
+        n_sites = len(site_demands)
+        avg_demand = np.fromiter(site_demands.values(), dtype=np.float64, count=n_sites)
+        # Lead time defaults to 7 days, variability (cv) to 0.2
+        lead_time = np.fromiter(
+            (lead_times.get(site_id, 7) for site_id in site_demands),
+            dtype=np.float64, count=n_sites
+        )
+        variability = demand_variability or {}
+        cv = np.fromiter(
+            (variability.get(site_id, 0.2) for site_id in site_demands),
+            dtype=np.float64, count=n_sites
+        )
         
-        for site_id, avg_demand in site_demands.items():
-            lead_time = lead_times.get(site_id, 7)  # Default 7 days
-            
-            # Calculate demand during lead time
-            demand_during_lt = avg_demand * (lead_time / 7)  # Assuming weekly demand
-            
-            # Get variability (default to 0.2 if not provided)
-            cv = demand_variability.get(site_id, 0.2) if demand_variability else 0.2
-            std_demand = demand_during_lt * cv
-            
-            # Safety stock = Z * std_dev * sqrt(lead_time)
-            safety_stock = int(z * std_demand * np.sqrt(lead_time / 7))
-            
-            safety_stocks[site_id] = max(0, safety_stock)
+        # Safety stock = Z * std_dev * sqrt(lead_time)
+        safety_stocks = dict(zip(site_demands, _safety_stock(avg_demand, lead_time, cv, z).tolist()))
         
         return safety_stocks
     
@@ -233,21 +296,24 @@ class DepotOptimizer:
         Returns:
             Total cost estimate
         """
-        total_cost = 0.0
+        allocations = allocation_plan.get("allocations", [])
         
-        # Shipping costs
-        for allocation in allocation_plan.get("allocations", []):
-            depot_id = allocation["depot_id"]
-            site_id = allocation["site_id"]
-            quantity = allocation["quantity"]
-            
-            if depot_id in shipping_costs and site_id in shipping_costs[depot_id]:
-                total_cost += shipping_costs[depot_id][site_id] * quantity
+        # Shipping costs (pairs without a known cost contribute nothing)
+        quantities = np.fromiter(
+            (allocation["quantity"] for allocation in allocations),
+            dtype=np.float64, count=len(allocations)
+        )
+        unit_costs = np.fromiter(
+            (
+                shipping_costs.get(allocation["depot_id"], {}).get(allocation["site_id"], 0.0)
+                for allocation in allocations
+            ),
+            dtype=np.float64, count=len(allocations)
+        )
+        total_cost = float(unit_costs @ quantities)
         
         # Holding costs (simplified - based on average inventory)
-        for depot_id, cost_per_unit in holding_costs.items():
-            # Estimate average inventory (simplified)
-            total_cost += cost_per_unit * 100  # Placeholder calculation
+        total_cost += sum(holding_costs.values()) * 100  # Placeholder calculation
         
         return total_cost
 
@@ -0,0 +1,111 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+
+# Queued on context exit to stop the consumer once earlier items are flushed
+_CLOSE = object()
+
+
+class DynamicBatcher:
+    """
+    Groups individually submitted items into batches for one flush call.
+    
+    A batch is flushed as soon as it holds max_size items or timeout_ms after
+    its first item arrived, whichever comes first. Up to max_in_flight
+    flushes run at once. Use as an async context manager:
+    
+        async with DynamicBatcher(8, 50, flush_fn) as batcher:
+            result = await batcher.submit(item)
+    """
+    
+    def __init__(
+        self,
+        max_size: int,
+        timeout_ms: float,
+        flush_fn: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_in_flight: int = 1
+    ):
+        """
+        Initialize batcher.
+        
+        Args:
+            max_size: Maximum items per flush
+            timeout_ms: Longest time a batch waits to fill up before flushing
+            flush_fn: Coroutine function taking a list of items and returning
+                one result per item, in order
+            max_in_flight: Maximum concurrent flush_fn calls
+        """
+        self.max_size = max(1, max_size)
+        self.timeout = timeout_ms / 1000
+        self.flush_fn = flush_fn
+        self.max_in_flight = max(1, max_in_flight)
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+    
+    async def __aenter__(self) -> "DynamicBatcher":
+        self._queue = asyncio.Queue()
+        self._consumer = asyncio.create_task(self._consume())
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self._queue.put(_CLOSE)
+        await self._consumer
+    
+    async def submit(self, item: Any) -> Any:
+        """Queue item and wait for its result (or the exception its batch raised)."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+    
+    async def _consume(self) -> None:
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        flushes = set()
+        closing = False
+        
+        while not closing:
+            entry = await self._queue.get()
+            if entry is _CLOSE:
+                break
+            batch = [entry]
+            deadline = loop.time() + self.timeout
+            
+            while len(batch) < self.max_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if entry is _CLOSE:
+                    closing = True
+                    break
+                batch.append(entry)
+            
+            await in_flight.acquire()
+            task = asyncio.create_task(self._flush(batch, in_flight))
+            flushes.add(task)
+            task.add_done_callback(flushes.discard)
+        
+        if flushes:
+            await asyncio.gather(*flushes)
+    
+    async def _flush(self, batch: List[tuple], in_flight: asyncio.Semaphore) -> None:
+        try:
+            results = await self.flush_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            in_flight.release()
+        
+        for idx, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if idx < len(results):
+                future.set_result(results[idx])
+            else:
+                future.set_exception(RuntimeError("Batch flush returned fewer results than items"))
@@ -3,16 +3,67 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+# Trend label per slope class: 0 = < -0.1, 1 = within +/-0.1, 2 = > 0.1, 3 = too few points
+_TREND_LABELS = np.array(["decreasing", "stable", "increasing", "unknown"], dtype=object)
+
+
+def _group_slopes(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Least-squares slope of each group's values against their position in the group.
+    
+    Args:
+        codes: Group number per row (-1 rows are ignored)
+        values: Value per row, in series order within each group
+        n_groups: Number of groups
+        
+    Returns:
+        Slope per group (NaN for groups with fewer than two values)
+    """
+    valid = codes >= 0
+    codes = codes[valid]
+    y = values[valid].astype(np.float64)
+    
+    # Position of each row within its group
+    order = np.argsort(codes, kind="stable")
+    n = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(n) - n
+    x = np.empty(codes.size, dtype=np.float64)
+    x[order] = np.arange(codes.size) - np.repeat(starts, n)
+    
+    sum_x = np.bincount(codes, weights=x, minlength=n_groups)
+    sum_y = np.bincount(codes, weights=y, minlength=n_groups)
+    sum_xy = np.bincount(codes, weights=x * y, minlength=n_groups)
+    sum_xx = np.bincount(codes, weights=x * x, minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+    return np.where(n < 2, np.nan, slopes)
+
+
+def _trend_labels(slopes: np.ndarray) -> np.ndarray:
+    """Classify slopes as increasing / decreasing / stable (unknown for NaN from short series)."""
+    index = (slopes > 0.1).view(np.int8) - (slopes < -0.1).view(np.int8) + 1
+    index[np.isnan(slopes)] = 3
+    return _TREND_LABELS[index]
+
+
+# Per-site fields returned by predict_enrollment, in order
+_PREDICTION_COLUMNS = ["predicted_30d_enrollment", "avg_weekly_enrollment", "enrollment_trend"]
+
 
 class EnrollmentPredictor:
-    """Predicts future enrollment and screen fail rates."""
+    """
+    Predicts future enrollment and screen fail rates.
+    
+    The predictor holds no state; its methods are static and can be called
+    on the class without creating an instance.
+    """
     
     def __init__(self):
         """Initialize enrollment predictor."""
         pass
     
+    @staticmethod
     def predict_enrollment(
-        self,
         enrollment_df: pd.DataFrame,
         forecast_days: int = 30
     ) -> Dict[str, Any]:
@@ -26,69 +77,100 @@ class EnrollmentPredictor:
         Returns:
             Dictionary with enrollment predictions per site
         """
-        predictions = {}
+        if enrollment_df is None or enrollment_df.empty or "site_id" not in enrollment_df.columns:
+            return {}
+        
+        summary = EnrollmentPredictor._summarize_enrollment(enrollment_df, forecast_days)
+        return summary[_PREDICTION_COLUMNS].to_dict("index")
+    
+    @staticmethod
+    def predict_all(
+        enrollment_df: pd.DataFrame,
+        forecast_days: int = 30
+    ) -> pd.DataFrame:
+        """
+        Predict enrollment and screen fail rates in a single pass over the data.
+        
+        Args:
+            enrollment_df: DataFrame with enrollment data
+            forecast_days: Number of days to forecast ahead
+            
+        Returns:
+            DataFrame with one row per site: site_id, predicted_30d_enrollment,
+            avg_weekly_enrollment, enrollment_trend and screen_fail_rate
+        """
+        columns = ["site_id", *_PREDICTION_COLUMNS, "screen_fail_rate"]
+        if enrollment_df is None or enrollment_df.empty or "site_id" not in enrollment_df.columns:
+            return pd.DataFrame(columns=columns)
+        
+        summary = EnrollmentPredictor._summarize_enrollment(enrollment_df, forecast_days, include_fail_rate=True)
+        if "screen_fail_rate" not in summary.columns:
+            # Default fail rate if not available (industry average ~30%)
+            summary["screen_fail_rate"] = 0.30
+        return summary.reset_index()[columns]
+    
+    @staticmethod
+    def _summarize_enrollment(
+        enrollment_df: pd.DataFrame,
+        forecast_days: int,
+        include_fail_rate: bool = False
+    ) -> pd.DataFrame:
+        """Per-site enrollment predictions (indexed by site_id) from one groupby."""
+        aggregations = {}
+        if include_fail_rate and "screen_fail_rate" in enrollment_df.columns:
+            aggregations["screen_fail_rate"] = ("screen_fail_rate", "mean")
         
         # Check if we have weekly enrollment data
         if "weekly_enrollment" in enrollment_df.columns:
-            for site_id, group in enrollment_df.groupby("site_id"):
-                weekly_enrollment = group["weekly_enrollment"].values
-                
-                # Use simple moving average for prediction
-                # If we have historical data, use average; otherwise use current value
-                if len(weekly_enrollment) > 0:
-                    avg_weekly = np.mean(weekly_enrollment)
-                    predicted_30d = int(avg_weekly * (forecast_days / 7))
-                else:
-                    # Fallback to current value if available
-                    current = group["weekly_enrollment"].iloc[-1] if len(group) > 0 else 0
-                    predicted_30d = int(current * (forecast_days / 7))
-                
-                predictions[site_id] = {
-                    "predicted_30d_enrollment": predicted_30d,
-                    "avg_weekly_enrollment": float(avg_weekly) if len(weekly_enrollment) > 0 else 0.0,
-                    "enrollment_trend": self._calculate_trend(weekly_enrollment)
-                }
+            grouped = enrollment_df.groupby("site_id", sort=False)
+            
+            # Use simple moving average for prediction
+            summary = grouped.agg(avg_weekly_enrollment=("weekly_enrollment", "mean"), **aggregations)
+            summary["predicted_30d_enrollment"] = (
+                summary["avg_weekly_enrollment"].to_numpy() * (forecast_days / 7)
+            ).astype(np.int64)
+            
+            # Trend from each site's series in row order
+            slopes = _group_slopes(
+                grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64),
+                enrollment_df["weekly_enrollment"].to_numpy(),
+                len(summary)
+            )
+            summary["enrollment_trend"] = _trend_labels(slopes)
         elif "enrollment_date" in enrollment_df.columns and "subject_count" in enrollment_df.columns:
             # Calculate from historical enrollment dates
-            enrollment_df["enrollment_date"] = pd.to_datetime(enrollment_df["enrollment_date"])
+            # Parse into a new frame; the caller's enrollment_df is left as is
+            enrollment_dates = pd.to_datetime(enrollment_df["enrollment_date"])
             
-            for site_id, group in enrollment_df.groupby("site_id"):
-                if len(group) > 0:
-                    # Calculate weekly enrollment rate
-                    date_range = (group["enrollment_date"].max() - group["enrollment_date"].min()).days + 1
-                    total_subjects = group["subject_count"].sum()
-                    
-                    if date_range > 0:
-                        weekly_enrollment = (total_subjects / date_range) * 7
-                    else:
-                        weekly_enrollment = total_subjects
-                    
-                    predicted_30d = int(weekly_enrollment * (forecast_days / 7))
-                    
-                    predictions[site_id] = {
-                        "predicted_30d_enrollment": predicted_30d,
-                        "avg_weekly_enrollment": float(weekly_enrollment),
-                        "enrollment_trend": "stable"  # Would need more data for trend
-                    }
-                else:
-                    predictions[site_id] = {
-                        "predicted_30d_enrollment": 0,
-                        "avg_weekly_enrollment": 0.0,
-                        "enrollment_trend": "unknown"
-                    }
+            summary = enrollment_df.assign(enrollment_date=enrollment_dates).groupby("site_id", sort=False).agg(
+                min_date=("enrollment_date", "min"),
+                max_date=("enrollment_date", "max"),
+                total_subjects=("subject_count", "sum"),
+                **aggregations
+            )
+            
+            # Calculate weekly enrollment rate
+            date_range = (summary["max_date"] - summary["min_date"]).dt.days.to_numpy() + 1
+            total_subjects = summary["total_subjects"].to_numpy()
+            weekly_enrollment = np.where(date_range > 0, (total_subjects / date_range) * 7, total_subjects)
+            
+            summary["predicted_30d_enrollment"] = (weekly_enrollment * (forecast_days / 7)).astype(np.int64)
+            summary["avg_weekly_enrollment"] = weekly_enrollment.astype(np.float64)
+            summary["enrollment_trend"] = "stable"  # Would need more data for trend
         else:
             # No enrollment data available
-            for site_id in enrollment_df["site_id"].unique():
-                predictions[site_id] = {
-                    "predicted_30d_enrollment": 0,
-                    "avg_weekly_enrollment": 0.0,
-                    "enrollment_trend": "unknown"
-                }
+            if aggregations:
+                summary = enrollment_df.groupby("site_id", sort=False).agg(**aggregations)
+            else:
+                summary = pd.DataFrame(index=pd.Index(enrollment_df["site_id"].unique(), name="site_id"))
+            summary["predicted_30d_enrollment"] = 0
+            summary["avg_weekly_enrollment"] = 0.0
+            summary["enrollment_trend"] = "unknown"
         
-        return predictions
+        return summary
     
+    @staticmethod
     def predict_screen_fail_rate(
-        self,
         enrollment_df: pd.DataFrame
     ) -> Dict[str, float]:
         """
@@ -100,13 +182,15 @@ class EnrollmentPredictor:
         Returns:
             Dictionary mapping site_id to predicted screen fail rate
         """
+        if enrollment_df is None or enrollment_df.empty or "site_id" not in enrollment_df.columns:
+            return {}
+        
         fail_rates = {}
         
         if "screen_fail_rate" in enrollment_df.columns:
-            for site_id, group in enrollment_df.groupby("site_id"):
-                # Use average screen fail rate for the site
-                avg_fail_rate = float(group["screen_fail_rate"].mean())
-                fail_rates[site_id] = avg_fail_rate
+            # Use average screen fail rate for the site
+            avg_fail_rate = enrollment_df.groupby("site_id", sort=False)["screen_fail_rate"].mean()
+            fail_rates = dict(zip(avg_fail_rate.index, avg_fail_rate.tolist()))
         else:
             # Default fail rate if not available (industry average ~30%)
             for site_id in enrollment_df["site_id"].unique():
@@ -114,8 +198,8 @@ class EnrollmentPredictor:
         
         return fail_rates
     
+    @staticmethod
     def adjust_demand_for_enrollment(
-        self,
         base_demand: int,
         predicted_enrollment: int,
         screen_fail_rate: float
@@ -142,20 +226,3 @@ class EnrollmentPredictor:
         adjusted_demand = max(base_demand, enrollment_based_demand)
         
         return adjusted_demand
-    
-    def _calculate_trend(self, values: np.ndarray) -> str:
-        """Calculate trend from time series values."""
-        if len(values) < 2:
-            return "unknown"
-        
-        # Simple linear trend
-        x = np.arange(len(values))
-        slope = np.polyfit(x, values, 1)[0]
-        
-        if slope > 0.1:
-            return "increasing"
-        elif slope < -0.1:
-            return "decreasing"
-        else:
-            return "stable"
-
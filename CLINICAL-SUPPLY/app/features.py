@@ -1,9 +1,16 @@
 from datetime import datetime, timedelta
 from typing import Dict
+import numpy as np
 import pandas as pd
 from app.enrollment_predictor import EnrollmentPredictor
 
 
+def _as_site_category(site_ids, site_category: pd.CategoricalDtype) -> pd.Categorical:
+    """Encode site ids against the site categories; unknown sites become NaN."""
+    codes = site_category.categories.get_indexer(site_ids)
+    return pd.Categorical.from_codes(codes, dtype=site_category)
+
+
 def compute_site_features(
     data: Dict[str, pd.DataFrame]
 ) -> pd.DataFrame:
@@ -16,39 +23,47 @@ def compute_site_features(
     Returns:
         DataFrame with computed features per site
     """
-    sites_df = data["sites"].copy()
-    dispense_df = data["dispense"].copy()
-    inventory_df = data["inventory"].copy()
+    # The input frames are never modified; derived columns go through assign()
+    sites_df = data["sites"]
     
     # Handle site_name - create if missing
     if "site_name" not in sites_df.columns:
-        sites_df["site_name"] = sites_df["site_id"]
+        sites_df = sites_df.assign(site_name=sites_df["site_id"])
+    
+    # Key every table on the same categorical site_id so groupbys and merges
+    # work on integer codes; rows for unknown sites drop out of the groupbys
+    site_id_dtype = sites_df["site_id"].dtype
+    site_category = pd.CategoricalDtype(categories=sites_df["site_id"].dropna().unique())
+    sites_df = sites_df.assign(site_id=sites_df["site_id"].astype(site_category))
+    dispense_df = data["dispense"].assign(
+        site_id=_as_site_category(data["dispense"]["site_id"], site_category)
+    )
+    inventory_df = data["inventory"].assign(
+        site_id=_as_site_category(data["inventory"]["site_id"], site_category)
+    )
     
     # Handle weekly dispense kits
     if "weekly_dispense_kits" in dispense_df.columns:
         # Already aggregated weekly
-        dispense_summary = dispense_df.groupby("site_id")["weekly_dispense_kits"].mean().reset_index()
+        dispense_summary = dispense_df.groupby("site_id", observed=True, sort=False)["weekly_dispense_kits"].mean().reset_index()
     elif "kits_dispensed" in dispense_df.columns:
         # Need to calculate from historical data
         if "dispense_date" in dispense_df.columns:
-            dispense_df["dispense_date"] = pd.to_datetime(dispense_df["dispense_date"])
-            date_range = dispense_df.groupby("site_id")["dispense_date"].agg([
-                ("min_date", "min"),
-                ("max_date", "max")
-            ]).reset_index()
-            date_range["days_covered"] = (
-                date_range["max_date"] - date_range["min_date"]
-            ).dt.days + 1
-            
-            dispense_summary = dispense_df.groupby("site_id")["kits_dispensed"].sum().reset_index()
-            dispense_summary = dispense_summary.merge(date_range, on="site_id")
-            dispense_summary["days_covered"] = dispense_summary["days_covered"].clip(lower=1)
+            dispense_df = dispense_df.assign(dispense_date=pd.to_datetime(dispense_df["dispense_date"]))
+            dispense_summary = dispense_df.groupby("site_id", observed=True, sort=False).agg(
+                kits_dispensed=("kits_dispensed", "sum"),
+                min_date=("dispense_date", "min"),
+                max_date=("dispense_date", "max")
+            ).reset_index()
+            days_covered = (
+                (dispense_summary["max_date"] - dispense_summary["min_date"]).dt.days + 1
+            ).clip(lower=1)
             dispense_summary["weekly_dispense_kits"] = (
-                dispense_summary["kits_dispensed"] * (7 / dispense_summary["days_covered"])
+                dispense_summary["kits_dispensed"] * (7 / days_covered)
             )
         else:
             # No dates, assume weekly aggregation
-            dispense_summary = dispense_df.groupby("site_id")["kits_dispensed"].mean().reset_index()
+            dispense_summary = dispense_df.groupby("site_id", observed=True, sort=False)["kits_dispensed"].mean().reset_index()
             dispense_summary["weekly_dispense_kits"] = dispense_summary["kits_dispensed"]
     else:
         # No dispense data, set to 0
@@ -60,26 +75,32 @@ def compute_site_features(
     ).round().astype(int)
     
     # Adjust demand based on enrollment predictions
-    enrollment_predictor = EnrollmentPredictor()
-    enrollment_predictions = enrollment_predictor.predict_enrollment(data.get("enrollment", pd.DataFrame()))
-    screen_fail_rates = enrollment_predictor.predict_screen_fail_rate(data.get("enrollment", pd.DataFrame()))
-    
-    # Adjust demand for each site
-    adjusted_demands = []
-    for site_id in dispense_summary["site_id"]:
-        base_demand = dispense_summary[dispense_summary["site_id"] == site_id]["projected_30d_demand_base"].iloc[0] if len(dispense_summary[dispense_summary["site_id"] == site_id]) > 0 else 0
-        pred_enrollment = enrollment_predictions.get(site_id, {}).get("predicted_30d_enrollment", 0)
-        fail_rate = screen_fail_rates.get(site_id, 0.30)
-        
-        adjusted_demand = enrollment_predictor.adjust_demand_for_enrollment(
-            base_demand, pred_enrollment, fail_rate
-        )
-        adjusted_demands.append(adjusted_demand)
+    enrollment_summary = EnrollmentPredictor.predict_all(data.get("enrollment", pd.DataFrame()))
+    
+    # Adjust demand for each site: the higher of the dispense-based demand and
+    # the expected successful enrollments (one kit per enrolled subject)
+    # Predictions for sites outside sites_df have no category and are dropped
+    enrollment_summary["site_id"] = _as_site_category(enrollment_summary["site_id"], site_category)
+    enrollment_summary = enrollment_summary.dropna(subset=["site_id"])
+    dispense_summary = dispense_summary.merge(
+        enrollment_summary[["site_id", "predicted_30d_enrollment", "screen_fail_rate"]],
+        on="site_id", how="left"
+    )
     
-    dispense_summary["projected_30d_demand"] = adjusted_demands
+    pred_enrollment = dispense_summary["predicted_30d_enrollment"].fillna(0).to_numpy(dtype=np.float64)
+    fail_rate = dispense_summary["screen_fail_rate"].fillna(0.30).to_numpy(dtype=np.float64)
+    dispense_summary["projected_30d_demand"] = np.maximum(
+        dispense_summary["projected_30d_demand_base"].to_numpy(),
+        (pred_enrollment * (1 - fail_rate)).astype(np.int64)
+    )
     
     # Get current inventory per site
-    inventory_summary = inventory_df.groupby("site_id")["current_inventory"].sum().reset_index()
+    inventory_summary = inventory_df.groupby("site_id", observed=True, sort=False)["current_inventory"].sum().reset_index()
+    
+    # Merge all features
+    features = sites_df.merge(dispense_summary[["site_id", "weekly_dispense_kits", "projected_30d_demand"]], 
+                              on="site_id", how="left")
+    features = features.merge(inventory_summary, on="site_id", how="left")
     
     # Handle expiry date (could be expiry_date or batch_expiry_date)
     expiry_col = None
@@ -89,23 +110,15 @@ def compute_site_features(
             break
     
     if expiry_col:
-        expiry_summary = inventory_df.groupby("site_id")[expiry_col].min().reset_index()
-        expiry_summary[expiry_col] = pd.to_datetime(expiry_summary[expiry_col])
-        expiry_summary["days_to_expiry"] = (
-            expiry_summary[expiry_col] - pd.Timestamp.now()
-        ).dt.days
-    else:
-        # No expiry date, set to large number
-        expiry_summary = inventory_df[["site_id"]].drop_duplicates().copy()
-        expiry_summary["days_to_expiry"] = 999
-    
-    # Merge all features
-    features = sites_df.merge(dispense_summary[["site_id", "weekly_dispense_kits", "projected_30d_demand"]], 
-                              on="site_id", how="left")
-    features = features.merge(inventory_summary, on="site_id", how="left")
-    if expiry_col:
+        # Parse before aggregating so the minimum is chronological, not lexicographic
+        expiry_summary = (
+            inventory_df.assign(expiry=pd.to_datetime(inventory_df[expiry_col]))
+            .groupby("site_id", observed=True, sort=False)["expiry"].min().reset_index()
+        )
+        expiry_summary["days_to_expiry"] = (expiry_summary["expiry"] - pd.Timestamp.now()).dt.days
         features = features.merge(expiry_summary[["site_id", "days_to_expiry"]], on="site_id", how="left")
     else:
+        # No expiry date, set to large number
         features["days_to_expiry"] = 999
     
     # Fill missing values
@@ -115,27 +128,32 @@ def compute_site_features(
     features["days_to_expiry"] = features["days_to_expiry"].fillna(999)
     
     # Calculate urgency score
-    features["urgency_score"] = (
-        features["projected_30d_demand"] / (features["current_inventory"] + 1)
-    )
+    demand = features["projected_30d_demand"].to_numpy(dtype=np.float64)
+    inventory = features["current_inventory"].to_numpy(dtype=np.float64)
+    features["urgency_score"] = np.divide(demand, inventory + 1.0)
     
     # Ensure region mapping exists
     if "region" not in features.columns:
         features["region"] = "Unknown"
     
-    # Add enrollment prediction data
-    features["predicted_30d_enrollment"] = features["site_id"].map(
-        lambda sid: enrollment_predictions.get(sid, {}).get("predicted_30d_enrollment", 0)
-    ).astype(int)
-    features["avg_weekly_enrollment"] = features["site_id"].map(
-        lambda sid: enrollment_predictions.get(sid, {}).get("avg_weekly_enrollment", 0.0)
-    ).astype(float)
-    features["enrollment_trend"] = features["site_id"].map(
-        lambda sid: enrollment_predictions.get(sid, {}).get("enrollment_trend", "unknown")
-    )
-    features["screen_fail_rate"] = features["site_id"].map(
-        lambda sid: screen_fail_rates.get(sid, 0.30)
-    ).astype(float)
+    # Add enrollment prediction data (constant defaults when there is none)
+    if not enrollment_summary.empty:
+        features = features.merge(enrollment_summary, on="site_id", how="left")
+    else:
+        features["predicted_30d_enrollment"] = np.zeros(len(features), dtype=np.int64)
+        features["avg_weekly_enrollment"] = np.zeros(len(features), dtype=np.float64)
+        features["enrollment_trend"] = "unknown"
+        features["screen_fail_rate"] = np.full(len(features), 0.30)
+    features = features.fillna({
+        "predicted_30d_enrollment": 0,
+        "avg_weekly_enrollment": 0.0,
+        "enrollment_trend": "unknown",
+        "screen_fail_rate": 0.30,
+    })
+    features["predicted_30d_enrollment"] = features["predicted_30d_enrollment"].astype(int)
+    features["avg_weekly_enrollment"] = features["avg_weekly_enrollment"].astype(float)
+    features["screen_fail_rate"] = features["screen_fail_rate"].astype(float)
+    features["site_id"] = features["site_id"].astype(site_id_dtype)
     
     return features[["site_id", "site_name", "region", "weekly_dispense_kits", 
                      "projected_30d_demand", "current_inventory", "days_to_expiry", 
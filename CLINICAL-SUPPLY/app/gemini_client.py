@@ -1,13 +1,317 @@
-import json
+import gzip
+import hashlib
+import os
+import random
+import re
+import threading
 import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
 from typing import Dict, Any, Optional, List
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from app.config import Config
 
 
+@dataclass
+class TokenBucket:
+    """Client-side request budget for one API key (refills continuously)."""
+    capacity: int
+    rate: float  # tokens (requests) per second
+    tokens: float = 0.0
+    last_refill: float = 0.0
+    
+    def refill(self, now: float) -> None:
+        """Add the tokens earned since the last refill, up to capacity."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+    
+    def seconds_until_token(self) -> float:
+        """Time until at least one token is available."""
+        return max(0.0, (1.0 - self.tokens) / self.rate)
+
+
+class ClientShutdownError(RuntimeError):
+    """Raised when a wait is interrupted because the client is shutting down."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the API while the shared circuit breaker is open."""
+
+
+@dataclass(slots=True)
+class SiteFeatures:
+    """Prompt fields for one site, with defaults and types applied once."""
+    site_id: str
+    site_name: str
+    region: str
+    projected_30d_demand: int
+    current_inventory: int
+    weekly_dispense_kits: float
+    days_to_expiry: int
+    urgency_score: float
+    
+    @classmethod
+    def from_dict(cls, site_id: str, site_features: Dict[str, Any]) -> "SiteFeatures":
+        """Build from a computed site_features dictionary."""
+        return cls(
+            site_id=site_id,
+            site_name=site_features.get("site_name", "Unknown"),
+            region=site_features.get("region", "Unknown"),
+            projected_30d_demand=int(site_features.get("projected_30d_demand", 0)),
+            current_inventory=int(site_features.get("current_inventory", 0)),
+            weekly_dispense_kits=float(site_features.get("weekly_dispense_kits", 0)),
+            days_to_expiry=int(site_features.get("days_to_expiry", 999)),
+            urgency_score=float(site_features.get("urgency_score", 0)),
+        )
+
+
+def _retry_after_seconds(response: Optional[requests.Response]) -> Optional[float]:
+    """
+    Seconds until the server accepts requests again, from Retry-After
+    (delta seconds or HTTP-date) or X-RateLimit-Reset (delta or epoch seconds).
+    """
+    if response is None:
+        return None
+    headers = response.headers
+    
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    
+    reset = headers.get("X-RateLimit-Reset")
+    if reset:
+        try:
+            reset_value = float(reset)
+        except ValueError:
+            return None
+        # Large values are absolute epoch timestamps rather than deltas
+        if reset_value > 1e9:
+            reset_value -= time.time()
+        return max(0.0, reset_value)
+    
+    return None
+
+
+# Single-site prompt sections, formatted with format_map
+_SITE_PROMPT_HEADER = """You are an expert Clinical Supply Chain & IRT Forecasting Analyst. Analyze the following site data and provide a comprehensive recommendation.
+
+**Site Information:**
+- Site ID: {site.site_id}
+- Site Name: {site.site_name}
+- Region: {site.region}
+
+**Supply Metrics:**
+- Projected 30-day Demand: {site.projected_30d_demand} kits
+- Current Inventory: {site.current_inventory} kits
+- Weekly Dispense Rate: {site.weekly_dispense_kits:.2f} kits/week
+- Days to Expiry: {site.days_to_expiry} days ({expiry_status})
+- Urgency Score: {site.urgency_score:.2f}
+
+**Analysis Requirements:**
+1. Calculate actual days of inventory coverage: Current Inventory / Weekly Dispense Rate * 7
+2. Assess expiry risk: If inventory expires soon, prioritize replacement
+3. Evaluate demand risk: Compare projected demand vs current inventory
+4. Consider region-specific factors (shipping times, regulations)
+5. Determine optimal resupply quantity considering:
+   - Minimum 30-day coverage plus safety buffer (20-30%)
+   - Expiry timeline (prioritize if < 30 days)
+   - Economic order quantities
+   - Risk of stockout vs overstock
+
+"""
+
+_SITE_RULES_TEMPLATE = """**Rules-Based Recommendation (for reference only - analyze independently):**
+- Action: {action}
+- Quantity: {quantity} kits
+- Reason: {reason}
+
+"""
+
+_SITE_CONTEXT_TEMPLATE = """**Network Context:**
+- Average site inventory: {avg_inventory} kits
+- Average projected demand: {avg_demand} kits
+- Sites needing resupply: {sites_needing_resupply} / {total_sites}
+
+"""
+
+_SITE_PROMPT_FOOTER = """**Your Task:**
+Perform independent analysis (do NOT simply follow rules). Consider:
+- If days_to_expiry is negative, the inventory has already expired - urgent replacement needed
+- If inventory coverage < 30 days, resupply is critical
+- If urgency_score > 2.0, this is a high-priority site
+- Balance cost (overstock) vs risk (stockout)
+
+**Required JSON Response:**
+{
+  "structured_result": {
+    "action": "resupply" or "no_resupply",
+    "quantity": integer (0 if no_resupply, otherwise calculated optimal quantity),
+    "confidence": float between 0.0-1.0 (confidence in recommendation),
+    "reasons": ["reason1", "reason2", ...]
+  },
+  "draft_message": "Two detailed paragraphs explaining your analysis, reasoning, and recommendation. Include specific calculations and risk considerations."
+}
+
+Return ONLY valid JSON, no other text."""
+
+# Constant prose of the batch prompt, built once at import instead of per call
+_BATCH_PROMPT_HEADER = """You are an expert Clinical Supply Chain & IRT Forecasting Analyst. Analyze the following sites and provide comprehensive recommendations for each.
+
+**Analysis Requirements for Each Site:**
+1. Calculate actual days of inventory coverage: Current Inventory / Weekly Dispense Rate * 7
+2. Assess expiry risk: If inventory expires soon, prioritize replacement
+3. Evaluate demand risk: Compare projected demand vs current inventory
+4. Consider region-specific factors (shipping times, regulations)
+5. Determine optimal resupply quantity considering:
+   - Minimum 30-day coverage plus safety buffer (20-30%)
+   - Expiry timeline (prioritize if < 30 days)
+   - Economic order quantities
+   - Risk of stockout vs overstock
+
+"""
+
+_BATCH_CONTEXT_TEMPLATE = """**Network Context:**
+- Total sites: {total_sites}
+- Average site inventory: {avg_inventory} kits
+- Average projected demand: {avg_demand} kits
+- Average urgency score: {avg_urgency}
+
+"""
+
+_BATCH_SITE_TEMPLATE = """Site {idx}: {site.site_id}
+- Site Name: {site.site_name}
+- Region: {site.region}
+- Projected 30-day Demand: {site.projected_30d_demand} kits
+- Current Inventory: {site.current_inventory} kits
+- Weekly Dispense Rate: {site.weekly_dispense_kits:.2f} kits/week
+- Days to Expiry: {site.days_to_expiry} days ({expiry_status})
+- Urgency Score: {site.urgency_score:.2f}
+"""
+
+# Fallback when the model omits structured_result; callers get a shallow copy,
+# so reasons is a tuple to keep the shared value immutable
+_DEFAULT_STRUCTURED_RESULT = {
+    "action": "no_resupply",
+    "quantity": 0,
+    "confidence": 0.5,
+    "reasons": ("Unable to parse structured result",)
+}
+
+_DEFAULT_DRAFT_MESSAGE = "Unable to generate justification message."
+
+# Per-field defaults for a structured_result the model returned incompletely
+_STRUCTURED_FIELD_DEFAULTS = {
+    "action": "no_resupply",
+    "quantity": 0,
+    "confidence": 0.5,
+    "reasons": ()
+}
+
+
+def _apply_reply_defaults(reply: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fill in the reply schema's defaults, in place.
+    
+    A missing or non-object structured_result is replaced by the default
+    result, a structured_result missing some fields gets the per-field
+    defaults, and a missing draft_message gets the default message.
+    """
+    structured = reply.get("structured_result")
+    if not isinstance(structured, dict):
+        reply["structured_result"] = _DEFAULT_STRUCTURED_RESULT.copy()
+    elif not _STRUCTURED_FIELD_DEFAULTS.keys() <= structured.keys():
+        reply["structured_result"] = {**_STRUCTURED_FIELD_DEFAULTS, **structured}
+    reply.setdefault("draft_message", _DEFAULT_DRAFT_MESSAGE)
+    return reply
+
+
+# Help text appended to 404 errors (the head takes the model name)
+_MODEL_NOT_FOUND_HEAD = "\n\nModel '{}' not found. Available models may include: gemini-2.5-flash, gemini-2.5-pro, gemini-1.5-flash, gemini-1.5-pro"
+_MODEL_NOT_FOUND_TAIL = "\nCheck your API key permissions and model availability at: https://ai.google.dev/models"
+
+# Gemini API keys are 39 characters; shorter values are not scrubbed from messages
+_MIN_SCRUB_KEY_LENGTH = 20
+_KEY_PLACEHOLDER = "***API_KEY_HIDDEN***"
+
+# Request bodies smaller than one Ethernet packet are not worth compressing
+_GZIP_MIN_BYTES = 1400
+
+# Terminal states of a Gemini Batch Mode job
+_BATCH_JOB_SUCCEEDED = "BATCH_STATE_SUCCEEDED"
+_BATCH_JOB_FINAL_STATES = frozenset({
+    _BATCH_JOB_SUCCEEDED, "BATCH_STATE_FAILED", "BATCH_STATE_CANCELLED", "BATCH_STATE_EXPIRED"
+})
+
+# Expiry status buckets: days < 0, 0 <= days < 30, days >= 30
+_EXPIRY_BOUNDS = np.array([0, 30])
+_EXPIRY_LABELS = np.array(["expired", "expiring soon", "valid"], dtype=object)
+
+_BATCH_RULES_TEMPLATE = "- Rules Recommendation: {action}, Quantity: {quantity} kits\n"
+
+_BATCH_PROMPT_FOOTER = """**Your Task:**
+For EACH site, perform independent analysis. Consider:
+- If days_to_expiry is negative, the inventory has already expired - urgent replacement needed
+- If inventory coverage < 30 days, resupply is critical
+- If urgency_score > 2.0, this is a high-priority site
+- Balance cost (overstock) vs risk (stockout)
+
+**Required JSON Response Format:**
+{
+  "sites": [
+    {
+      "site_id": "SITE_001",
+      "structured_result": {
+        "action": "resupply" or "no_resupply",
+        "quantity": integer (0 if no_resupply, otherwise calculated optimal quantity),
+        "confidence": float between 0.0-1.0,
+        "reasons": ["reason1", "reason2", ...]
+      },
+      "draft_message": "Two detailed paragraphs explaining analysis, reasoning, and recommendation."
+    },
+    {
+      "site_id": "SITE_002",
+      ...
+    }
+  ]
+}
+
+Return ONLY valid JSON, no other text. Ensure the response includes all sites in the same order as provided."""
+
+
 class GeminiClient:
     """Client for interacting with Gemini API with multi-key support."""
     
+    # Per-key request budgets and cooldowns are shared by every client in the
+    # process: the quota belongs to the API key, and a new client is built per
+    # orchestrator run, so per-instance state would restart pacing each time
+    # Cooldowns are a struct-of-arrays column indexed by the key's row, so
+    # a client checks all of its keys with one vectorized comparison
+    _key_lock = threading.Lock()
+    _buckets: Dict[str, TokenBucket] = {}
+    _key_row: Dict[str, int] = {}  # key -> row in the shared per-key arrays
+    _cooldowns = np.zeros(0, dtype=np.float64)  # row -> monotonic time the key can be retried
+    
+    # Circuit breaker: after enough consecutive non-404 failures across all
+    # keys, every client fails fast for a cooldown window instead of retrying
+    # into an outage
+    _breaker_failures = 0
+    _breaker_open_until = 0.0
+    _breaker_threshold = 10
+    _breaker_cooldown = 30.0  # seconds
+    
     def __init__(self):
         """Initialize Gemini client with multiple API keys for load balancing."""
         # Get all available API keys
@@ -15,15 +319,57 @@ class GeminiClient:
         if not self.api_keys:
             raise ValueError("No GEMINI_API_KEY configured. Set at least one of: GEMINI_API_KEY, GEMINI_API_KEY_1, GEMINI_API_KEY_2, GEMINI_API_KEY_3")
         
+        # Matches any configured key, for scrubbing keys out of error messages
+        # (longest first so a key that contains another is hidden whole).
+        # Values too short to be real keys are left out so they cannot match
+        # ordinary words in the message.
+        self._scrubbed_keys = frozenset(key for key in self.api_keys if len(key) >= _MIN_SCRUB_KEY_LENGTH)
+        unscrubbed = sum(1 for key in self.api_keys if len(key) < _MIN_SCRUB_KEY_LENGTH)
+        if unscrubbed:
+            print(
+                f"Warning: {unscrubbed} API key(s) shorter than {_MIN_SCRUB_KEY_LENGTH} characters "
+                "will not be hidden in error messages"
+            )
+        self._key_re = re.compile(
+            "|".join(map(re.escape, sorted(self._scrubbed_keys, key=len, reverse=True)))
+        ) if self._scrubbed_keys else None
+        
         self.model = Config.GEMINI_MODEL
         self.base_url = Config.GEMINI_BASE_URL
+        # API version root (e.g. .../v1beta) for non-model resources such as batch jobs
+        self.api_root = self.base_url.split("/models")[0].rstrip("/")
+        self._batch_job_keys: Dict[str, str] = {}  # job name -> key that created it
         
         # Key rotation state
         self.current_key_index = 0
-        self.key_failures = {key: 0 for key in self.api_keys}  # Track failures per key
-        self.key_cooldown = {key: 0 for key in self.api_keys}  # Track cooldown until key can be retried
-        import time
-        self.current_time = time.time
+        
+        # Pace requests under the per-key quota instead of waiting for 429s;
+        # a key already used by another client keeps its bucket and cooldown
+        requests_per_minute = max(1, Config.GEMINI_REQUESTS_PER_MINUTE)
+        with self._key_lock:
+            for key in self.api_keys:
+                if key not in self._buckets:
+                    self._buckets[key] = TokenBucket(
+                        capacity=requests_per_minute,
+                        rate=requests_per_minute / 60.0,
+                        tokens=float(requests_per_minute),
+                        last_refill=time.monotonic()
+                    )
+                if key not in self._key_row:
+                    self._key_row[key] = len(self._key_row)
+            if self._cooldowns.size < len(self._key_row):
+                GeminiClient._cooldowns = np.concatenate(
+                    [self._cooldowns, np.zeros(len(self._key_row) - self._cooldowns.size)]
+                )
+        self.buckets = {key: self._buckets[key] for key in self.api_keys}
+        # Rows of this client's keys in the shared arrays, in api_keys order
+        self.key_rows = np.array([self._key_row[key] for key in self.api_keys], dtype=np.intp)
+        
+        # Set by shutdown() to wake any thread waiting in a backoff or pacing sleep
+        self._shutdown_event = threading.Event()
+        
+        # Backoff jitter source, seeded per process so workers don't retry in lockstep
+        self._rng = random.Random(os.getpid())
         
         # Validate and normalize model name
         # Remove common prefixes that cause issues
@@ -46,6 +392,7 @@ class GeminiClient:
         self.max_delay = 10.0  # seconds - reduced max delay
         self.chunk_delay = 2.0  # delay between chunks - increased to avoid rate limits
         self.api_timeout = 30  # seconds - increased for better reliability
+        self.gzip_requests = Config.GEMINI_GZIP_REQUESTS
         
         # Fallback models to try if primary model fails (in order of preference)
         self.fallback_models = [
@@ -55,6 +402,73 @@ class GeminiClient:
             "gemini-pro",                # Older stable model
             "gemini-1.5-flash",          # Without -latest suffix
         ]
+        # Model that last answered for the configured model, and models known to 404,
+        # so later calls skip the fallback probing
+        self._resolved_model: Optional[str] = None
+        self._dead_models: set = set()
+        
+        # Endpoint URLs per model and query params per key, built once
+        self._url_for_model: Dict[str, str] = {}
+        for model in [self.model, self.model.replace("-latest", "")] + self.fallback_models:
+            self._model_url(model)
+        self._params_for_key = {key: {"key": key} for key in self.api_keys}
+        
+        # Responses by prompt hash; temperature is 0.0, so an identical prompt
+        # to the same model is answered from here without an API call
+        self._response_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        self._response_cache_size = 512
+        self._cache_lock = threading.Lock()
+        
+        # Upper bound on requests in flight at once (orchestrator threads and async calls)
+        self.max_in_flight = max(len(self.api_keys) * 4, Config.MAX_CONCURRENT_REQUESTS)
+        
+        # Pooled HTTP session so retries and subsequent calls reuse open
+        # TCP/TLS connections instead of handshaking on every request.
+        # The pool holds one keep-alive connection per in-flight request and
+        # blocks rather than opening throwaway connections beyond that.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(self.api_keys) * 2,
+            pool_maxsize=self.max_in_flight,
+            pool_block=True,
+            max_retries=0  # Retries are handled explicitly below
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Connection": "keep-alive"
+        })
+        self._session_finalizer = weakref.finalize(self, self.session.close)
+    
+    def close(self):
+        """Close the pooled HTTP session."""
+        self._session_finalizer()
+    
+    def shutdown(self):
+        """Interrupt pending retry waits; they raise ClientShutdownError."""
+        self._shutdown_event.set()
+    
+    def _sleep(self, seconds: float) -> None:
+        """Sleep that returns early with ClientShutdownError once shutdown() is called."""
+        if self._shutdown_event.wait(seconds):
+            raise ClientShutdownError("Gemini client is shutting down")
+    
+    def generate_content(self, prompt: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Send a JSON-mode prompt and return the raw generateContent response.
+        
+        Uses the same key rotation, model fallback, circuit breaker and
+        response cache as the recommendation calls, but no retry backoff.
+        
+        Args:
+            prompt: Prompt text; the model is asked for a JSON response
+            timeout: Per-request timeout in seconds (default api_timeout)
+            
+        Returns:
+            Parsed generateContent response
+        """
+        return self._call_gemini_api(prompt, timeout=timeout)
     
     def get_recommendation_justification(
         self,
@@ -84,38 +498,21 @@ class GeminiClient:
                 "draft_message": str
             }
         """
-        # Prepare site-level aggregated data
-        site_data = {
-            "site_id": site_id,
-            "site_name": site_features.get("site_name", "Unknown"),
-            "region": site_features.get("region", "Unknown"),
-            "projected_30d_demand": int(site_features.get("projected_30d_demand", 0)),
-            "current_inventory": int(site_features.get("current_inventory", 0)),
-            "weekly_dispense_kits": float(site_features.get("weekly_dispense_kits", 0)),
-            "days_to_expiry": int(site_features.get("days_to_expiry", 999)),
-            "urgency_score": float(site_features.get("urgency_score", 0)),
-        }
-        
-        if rules_result:
-            site_data["rules_recommendation"] = {
-                "action": rules_result["action"],
-                "quantity": rules_result["quantity"],
-                "reason": rules_result["reason"]
-            }
-        
-        if context_data:
-            site_data["context"] = context_data
-        
         # Construct enhanced prompt
-        prompt = self._build_prompt(site_data)
+        prompt = self._build_prompt(SiteFeatures.from_dict(site_id, site_features), rules_result, context_data)
         
         # Call Gemini API with retries
         for attempt in range(self.max_retries):
             try:
-                response = self._call_gemini_api(prompt)
+                # Retries bypass (and refresh) the cache in case the cached response was unusable
+                response = self._call_gemini_api(prompt, use_cache=attempt == 0)
                 return self._parse_response(response)
+            except (ClientShutdownError, CircuitOpenError):
+                raise
             except requests.exceptions.HTTPError as e:
-                status_code = getattr(e.response, 'status_code', None) if hasattr(e, 'response') and e.response else None
+                # HTTPError always carries .response (None for timeouts); a Response
+                # is falsy for 4xx/5xx, so it must be compared with None
+                status_code = e.response.status_code if e.response is not None else None
                 
                 # Handle 429 (Rate Limited) and 503 (Service Unavailable)
                 if status_code in [429, 503]:
@@ -127,11 +524,10 @@ class GeminiClient:
                             base_delay *= 1.5
                         delay = min(base_delay, self.max_delay)
                         # Add random jitter to avoid thundering herd
-                        import random
-                        delay += random.uniform(0, 2)  # Increased jitter range
+                        delay += self._rng.uniform(0, 2)  # Increased jitter range
                         error_type = "Rate limited" if status_code == 429 else "Service unavailable"
                         print(f"{error_type} ({status_code}), retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
-                        time.sleep(delay)
+                        self._sleep(delay)
                         continue
                 elif status_code is None:
                     # Handle timeout or connection errors - retry with exponential backoff
@@ -141,10 +537,9 @@ class GeminiClient:
                             self.initial_delay * (2 ** attempt),
                             self.max_delay
                         )
-                        import random
-                        delay += random.uniform(0, 1)
+                        delay += self._rng.uniform(0, 1)
                         print(f"Connection error (timeout/network), retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
-                        time.sleep(delay)
+                        self._sleep(delay)
                         continue
                     # Last attempt failed
                     error_msg = f"Connection error after {self.max_retries} attempts. The API may be slow or overloaded."
@@ -156,10 +551,9 @@ class GeminiClient:
                         self.initial_delay * (2 ** attempt),
                         self.max_delay
                     )
-                    import random
-                    delay += random.uniform(0, 1)
+                    delay += self._rng.uniform(0, 1)
                     print(f"Error occurred, retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
-                    time.sleep(delay)
+                    self._sleep(delay)
                     continue
                 
                 # Last attempt failed, raise with helpful error (sanitized)
@@ -171,10 +565,7 @@ class GeminiClient:
                 raise Exception(error_msg)
             except Exception as e:
                 # Sanitize error messages to remove API keys
-                error_str = str(e)
-                for key in self.api_keys:
-                    if key in error_str:
-                        error_str = error_str.replace(key, "***API_KEY_HIDDEN***")
+                error_str = self._scrub_keys(str(e))
                 
                 if attempt < self.max_retries - 1:
                     delay = min(
@@ -182,7 +573,7 @@ class GeminiClient:
                         self.max_delay
                     )
                     print(f"Error occurred, retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries}): {error_str[:100]}")
-                    time.sleep(delay)
+                    self._sleep(delay)
                     continue
                 # Re-raise with sanitized error
                 raise Exception(error_str)
@@ -209,15 +600,21 @@ class GeminiClient:
             return []
         
         # Build batch prompt
-        prompt = self._build_batch_prompt(sites_data, context_data)
+        sites = [SiteFeatures.from_dict(site["site_id"], site["site_features"]) for site in sites_data]
+        prompt = self._build_batch_prompt(sites, [site.get("rules_result") for site in sites_data], context_data)
         
         # Call Gemini API with retries
         for attempt in range(self.max_retries):
             try:
-                response = self._call_gemini_api(prompt)
-                return self._parse_batch_response(response, [site["site_id"] for site in sites_data])
+                # Retries bypass (and refresh) the cache in case the cached response was unusable
+                response = self._call_gemini_api(prompt, use_cache=attempt == 0)
+                return self._parse_batch_response(response, [site.site_id for site in sites])
+            except (ClientShutdownError, CircuitOpenError):
+                raise
             except requests.exceptions.HTTPError as e:
-                status_code = getattr(e.response, 'status_code', None) if hasattr(e, 'response') and e.response else None
+                # HTTPError always carries .response (None for timeouts); a Response
+                # is falsy for 4xx/5xx, so it must be compared with None
+                status_code = e.response.status_code if e.response is not None else None
                 
                 # Handle 429 (Rate Limited) and 503 (Service Unavailable)
                 if status_code in [429, 503]:
@@ -226,29 +623,26 @@ class GeminiClient:
                         if status_code == 429:
                             base_delay *= 1.5
                         delay = min(base_delay, self.max_delay)
-                        import random
-                        delay += random.uniform(0, 2)
+                        delay += self._rng.uniform(0, 2)
                         error_type = "Rate limited" if status_code == 429 else "Service unavailable"
                         print(f"{error_type} ({status_code}), retrying batch in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
-                        time.sleep(delay)
+                        self._sleep(delay)
                         continue
                 elif status_code is None:
                     if attempt < self.max_retries - 1:
                         delay = min(self.initial_delay * (2 ** attempt), self.max_delay)
-                        import random
-                        delay += random.uniform(0, 1)
+                        delay += self._rng.uniform(0, 1)
                         print(f"Connection error (timeout/network), retrying batch in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
-                        time.sleep(delay)
+                        self._sleep(delay)
                         continue
                     raise Exception(f"Connection error after {self.max_retries} attempts. The API may be slow or overloaded.")
                 
                 # Handle other HTTP errors
                 if attempt < self.max_retries - 1:
                     delay = min(self.initial_delay * (2 ** attempt), self.max_delay)
-                    import random
-                    delay += random.uniform(0, 1)
+                    delay += self._rng.uniform(0, 1)
                     print(f"Error occurred, retrying batch in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
-                    time.sleep(delay)
+                    self._sleep(delay)
                     continue
                 
                 # Last attempt failed
@@ -259,173 +653,262 @@ class GeminiClient:
                     error_msg += " Service temporarily unavailable. Try again later."
                 raise Exception(error_msg)
             except Exception as e:
-                error_str = str(e)
-                for key in self.api_keys:
-                    if key in error_str:
-                        error_str = error_str.replace(key, "***API_KEY_HIDDEN***")
+                error_str = self._scrub_keys(str(e))
                 
                 if attempt < self.max_retries - 1:
                     delay = min(self.initial_delay * (2 ** attempt), self.max_delay)
                     print(f"Error occurred, retrying batch in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries}): {error_str[:100]}")
-                    time.sleep(delay)
+                    self._sleep(delay)
                     continue
                 raise Exception(error_str)
         
         raise Exception("Failed to get LLM response after all retries")
     
-    def _build_prompt(self, site_data: Dict[str, Any]) -> str:
+    def get_batch_recommendations_many(
+        self,
+        batches: List[List[Dict[str, Any]]],
+        context_data: Optional[Dict[str, Any]] = None
+    ) -> List[Any]:
+        """
+        Get recommendations for several site batches concurrently.
+        
+        Each batch goes through get_batch_recommendations (with its retries)
+        on a worker thread sharing the pooled session, at most max_in_flight
+        at once; key pacing is shared, so the per-key quota still holds.
+        Safe to call from any thread, with or without a running event loop.
+        
+        Args:
+            batches: List of sites_data lists, one per batch API call
+            context_data: Optional context data shared by all batches
+            
+        Returns:
+            One entry per batch, in order: the list of site results, or the
+            exception raised for that batch so callers can fall back per batch
+        """
+        def run_batch(sites_data: List[Dict[str, Any]]) -> Any:
+            try:
+                return self.get_batch_recommendations(sites_data, context_data)
+            except Exception as e:
+                return e
+        
+        if len(batches) <= 1:
+            # A single batch doesn't need a worker thread
+            return [run_batch(sites_data) for sites_data in batches]
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(batches))) as executor:
+            return list(executor.map(run_batch, batches))
+    
+    def submit_batch_job(
+        self,
+        sites_data: List[Dict[str, Any]],
+        context_data: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Submit single-site prompts as one Gemini Batch Mode job.
+        
+        Batch jobs are billed at a discount but complete asynchronously
+        (minutes to hours), so they suit sites that do not need an answer
+        within the run; collect results with poll_batch_job.
+        
+        Args:
+            sites_data: List of dicts with keys: site_id, site_features, rules_result (optional)
+            context_data: Optional context data shared by all sites
+            
+        Returns:
+            Job name (e.g. "batches/123")
+        """
+        requests_list = [
+            {
+                "request": {
+                    "contents": [{
+                        "parts": [{"text": self._build_prompt(
+                            SiteFeatures.from_dict(site["site_id"], site["site_features"]),
+                            site.get("rules_result"),
+                            context_data
+                        )}]
+                    }],
+                    "generationConfig": {
+                        "temperature": 0.0,
+                        "responseMimeType": "application/json"
+                    }
+                },
+                "metadata": {"key": site["site_id"]}
+            }
+            for site in sites_data
+        ]
+        body = {
+            "batch": {
+                "display_name": f"clinical-supply-{int(time.time())}",
+                "input_config": {"requests": {"requests": requests_list}}
+            }
+        }
+        
+        model_name = (self._resolved_model or self.model).strip().replace("models/", "")
+        api_key = self._get_next_available_key()
+        if not api_key:
+            raise ValueError("No available API keys")
+        
+        job = self._batch_job_request(
+            "POST", f"{self.api_root}/models/{model_name}:batchGenerateContent", api_key,
+            model_name=model_name, data=orjson.dumps(body)
+        )
+        job_name = job["name"]
+        # Jobs belong to the key's project, so later calls must use the same key
+        self._batch_job_keys[job_name] = api_key
+        return job_name
+    
+    def poll_batch_job(self, job_name: str, timeout: float) -> Dict[str, Dict[str, Any]]:
+        """
+        Wait for a batch job to finish and parse its responses.
+        
+        Polls with exponential backoff (5s doubling up to 60s). A job still
+        running after timeout seconds is cancelled.
+        
+        Args:
+            job_name: Name returned by submit_batch_job
+            timeout: Maximum seconds to wait
+            
+        Returns:
+            Parsed result (as from get_recommendation_justification) by
+            site_id, for the sites whose request succeeded
+            
+        Raises:
+            TimeoutError: If the job did not finish in time
+            RuntimeError: If the job failed, was cancelled or expired
+        """
+        api_key = self._batch_job_keys.get(job_name) or self._get_next_available_key()
+        url = f"{self.api_root}/{job_name}"
+        deadline = time.monotonic() + timeout
+        delay = 5.0
+        
+        while True:
+            job = self._batch_job_request("GET", url, api_key)
+            state = job.get("metadata", {}).get("state")
+            if job.get("done") or state in _BATCH_JOB_FINAL_STATES:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.cancel_batch_job(job_name)
+                raise TimeoutError(f"Batch job {job_name} did not finish within {timeout:.0f}s (state: {state})")
+            self._sleep(min(delay, remaining))
+            delay = min(delay * 2, 60.0)
+        
+        self._batch_job_keys.pop(job_name, None)
+        if "error" in job or (state is not None and state != _BATCH_JOB_SUCCEEDED):
+            raise RuntimeError(f"Batch job {job_name} ended in state {state}: {job.get('error', {}).get('message', '')}")
+        
+        results = {}
+        inlined = job.get("response", {}).get("inlinedResponses", {}).get("inlinedResponses", [])
+        for item in inlined:
+            site_id = item.get("metadata", {}).get("key")
+            if site_id is None or "response" not in item:
+                continue  # Per-request errors are reported in item["error"]
+            try:
+                results[site_id] = self._parse_response(item["response"])
+            except ValueError as e:
+                print(f"Skipping unparseable batch job response for {site_id}: {e}")
+        return results
+    
+    def cancel_batch_job(self, job_name: str) -> None:
+        """Best-effort cancellation of a batch job."""
+        api_key = self._batch_job_keys.pop(job_name, None) or self._get_next_available_key()
+        try:
+            self._batch_job_request("POST", f"{self.api_root}/{job_name}:cancel", api_key)
+        except Exception as e:
+            print(f"Warning: Could not cancel batch job {job_name}: {e}")
+    
+    def _batch_job_request(
+        self,
+        method: str,
+        url: str,
+        api_key: str,
+        model_name: Optional[str] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Send a batch job API request and decode the JSON reply.
+        
+        API keys are scrubbed from errors; model_name adds model help to
+        errors from model endpoints.
+        """
+        try:
+            response = self.session.request(
+                method, url, params=self._params_for_key[api_key], timeout=self.api_timeout, **kwargs
+            )
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            if model_name:
+                raise self._sanitized_error(e, model_name) from None
+            raise requests.exceptions.HTTPError(self._scrub_keys(str(e)), response=e.response) from None
+        except requests.exceptions.RequestException as e:
+            raise requests.exceptions.RequestException(self._scrub_keys(str(e))) from None
+        return orjson.loads(response.content) if response.content else {}
+    
+    def _build_prompt(
+        self,
+        site: SiteFeatures,
+        rules_result: Optional[Dict[str, Any]] = None,
+        context: Optional[Dict[str, Any]] = None
+    ) -> str:
         """Build enhanced prompt for Gemini with deeper analysis."""
-        days_to_expiry = site_data['days_to_expiry']
+        days_to_expiry = site.days_to_expiry
         expiry_status = "expired" if days_to_expiry < 0 else "expiring soon" if days_to_expiry < 30 else "valid"
         
-        prompt = f"""You are an expert Clinical Supply Chain & IRT Forecasting Analyst. Analyze the following site data and provide a comprehensive recommendation.
-
-**Site Information:**
-- Site ID: {site_data['site_id']}
-- Site Name: {site_data['site_name']}
-- Region: {site_data['region']}
-
-**Supply Metrics:**
-- Projected 30-day Demand: {site_data['projected_30d_demand']} kits
-- Current Inventory: {site_data['current_inventory']} kits
-- Weekly Dispense Rate: {site_data['weekly_dispense_kits']:.2f} kits/week
-- Days to Expiry: {days_to_expiry} days ({expiry_status})
-- Urgency Score: {site_data['urgency_score']:.2f}
-
-**Analysis Requirements:**
-1. Calculate actual days of inventory coverage: Current Inventory / Weekly Dispense Rate * 7
-2. Assess expiry risk: If inventory expires soon, prioritize replacement
-3. Evaluate demand risk: Compare projected demand vs current inventory
-4. Consider region-specific factors (shipping times, regulations)
-5. Determine optimal resupply quantity considering:
-   - Minimum 30-day coverage plus safety buffer (20-30%)
-   - Expiry timeline (prioritize if < 30 days)
-   - Economic order quantities
-   - Risk of stockout vs overstock
-
-"""
-        
-        if "rules_recommendation" in site_data:
-            prompt += f"""**Rules-Based Recommendation (for reference only - analyze independently):**
-- Action: {site_data['rules_recommendation']['action']}
-- Quantity: {site_data['rules_recommendation']['quantity']} kits
-- Reason: {site_data['rules_recommendation']['reason']}
-
-"""
+        parts = [_SITE_PROMPT_HEADER.format(site=site, expiry_status=expiry_status)]
         
-        if "context" in site_data:
-            context = site_data["context"]
-            prompt += f"""**Network Context:**
-- Average site inventory: {context.get('avg_inventory', 'N/A')} kits
-- Average projected demand: {context.get('avg_demand', 'N/A')} kits
-- Sites needing resupply: {context.get('sites_needing_resupply', 'N/A')} / {context.get('total_sites', 'N/A')}
-
-"""
+        if rules_result:
+            parts.append(_SITE_RULES_TEMPLATE.format_map(rules_result))
         
-        prompt += """**Your Task:**
-Perform independent analysis (do NOT simply follow rules). Consider:
-- If days_to_expiry is negative, the inventory has already expired - urgent replacement needed
-- If inventory coverage < 30 days, resupply is critical
-- If urgency_score > 2.0, this is a high-priority site
-- Balance cost (overstock) vs risk (stockout)
-
-**Required JSON Response:**
-{
-  "structured_result": {
-    "action": "resupply" or "no_resupply",
-    "quantity": integer (0 if no_resupply, otherwise calculated optimal quantity),
-    "confidence": float between 0.0-1.0 (confidence in recommendation),
-    "reasons": ["reason1", "reason2", ...]
-  },
-  "draft_message": "Two detailed paragraphs explaining your analysis, reasoning, and recommendation. Include specific calculations and risk considerations."
-}
-
-Return ONLY valid JSON, no other text."""
+        if context:
+            parts.append(_SITE_CONTEXT_TEMPLATE.format_map({
+                "avg_inventory": context.get('avg_inventory', 'N/A'),
+                "avg_demand": context.get('avg_demand', 'N/A'),
+                "sites_needing_resupply": context.get('sites_needing_resupply', 'N/A'),
+                "total_sites": context.get('total_sites', 'N/A'),
+            }))
         
-        return prompt
+        parts.append(_SITE_PROMPT_FOOTER)
+        return "".join(parts)
     
-    def _build_batch_prompt(self, sites_data: List[Dict[str, Any]], context_data: Optional[Dict[str, Any]] = None) -> str:
-        """Build enhanced prompt for Gemini with multiple sites."""
-        prompt = """You are an expert Clinical Supply Chain & IRT Forecasting Analyst. Analyze the following sites and provide comprehensive recommendations for each.
-
-**Analysis Requirements for Each Site:**
-1. Calculate actual days of inventory coverage: Current Inventory / Weekly Dispense Rate * 7
-2. Assess expiry risk: If inventory expires soon, prioritize replacement
-3. Evaluate demand risk: Compare projected demand vs current inventory
-4. Consider region-specific factors (shipping times, regulations)
-5. Determine optimal resupply quantity considering:
-   - Minimum 30-day coverage plus safety buffer (20-30%)
-   - Expiry timeline (prioritize if < 30 days)
-   - Economic order quantities
-   - Risk of stockout vs overstock
-
-"""
+    def _build_batch_prompt(
+        self,
+        sites: List[SiteFeatures],
+        rules_results: List[Optional[Dict[str, Any]]],
+        context_data: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Build enhanced prompt for Gemini with multiple sites (rules_results aligned with sites)."""
+        parts = [_BATCH_PROMPT_HEADER]
         
         # Add context if available
         if context_data:
-            prompt += f"""**Network Context:**
-- Total sites: {context_data.get('total_sites', 'N/A')}
-- Average site inventory: {context_data.get('avg_inventory', 'N/A')} kits
-- Average projected demand: {context_data.get('avg_demand', 'N/A')} kits
-- Average urgency score: {context_data.get('avg_urgency', 'N/A')}
-
-"""
+            parts.append(_BATCH_CONTEXT_TEMPLATE.format_map({
+                "total_sites": context_data.get('total_sites', 'N/A'),
+                "avg_inventory": context_data.get('avg_inventory', 'N/A'),
+                "avg_demand": context_data.get('avg_demand', 'N/A'),
+                "avg_urgency": context_data.get('avg_urgency', 'N/A'),
+            }))
+        
+        # Classify expiry status for all sites in one pass
+        days = np.fromiter(
+            (site.days_to_expiry for site in sites),
+            dtype=np.int64,
+            count=len(sites)
+        )
+        expiry_labels = _EXPIRY_LABELS[np.searchsorted(_EXPIRY_BOUNDS, days, side="right")]
         
         # Add each site's data
-        prompt += "**Site Data:**\n\n"
-        for idx, site_info in enumerate(sites_data, 1):
-            site_id = site_info["site_id"]
-            site_features = site_info["site_features"]
-            rules_result = site_info.get("rules_result")
-            
-            days_to_expiry = int(site_features.get("days_to_expiry", 999))
-            expiry_status = "expired" if days_to_expiry < 0 else "expiring soon" if days_to_expiry < 30 else "valid"
-            
-            prompt += f"""Site {idx}: {site_id}
-- Site Name: {site_features.get('site_name', 'Unknown')}
-- Region: {site_features.get('region', 'Unknown')}
-- Projected 30-day Demand: {int(site_features.get('projected_30d_demand', 0))} kits
-- Current Inventory: {int(site_features.get('current_inventory', 0))} kits
-- Weekly Dispense Rate: {float(site_features.get('weekly_dispense_kits', 0)):.2f} kits/week
-- Days to Expiry: {days_to_expiry} days ({expiry_status})
-- Urgency Score: {float(site_features.get('urgency_score', 0)):.2f}
-"""
+        parts.append("**Site Data:**\n\n")
+        for idx, (site, rules_result, expiry_status) in enumerate(
+            zip(sites, rules_results, expiry_labels), 1
+        ):
+            parts.append(_BATCH_SITE_TEMPLATE.format(idx=idx, site=site, expiry_status=expiry_status))
             
             if rules_result:
-                prompt += f"- Rules Recommendation: {rules_result['action']}, Quantity: {rules_result['quantity']} kits\n"
+                parts.append(_BATCH_RULES_TEMPLATE.format_map(rules_result))
             
-            prompt += "\n"
+            parts.append("\n")
         
-        prompt += """**Your Task:**
-For EACH site, perform independent analysis. Consider:
-- If days_to_expiry is negative, the inventory has already expired - urgent replacement needed
-- If inventory coverage < 30 days, resupply is critical
-- If urgency_score > 2.0, this is a high-priority site
-- Balance cost (overstock) vs risk (stockout)
-
-**Required JSON Response Format:**
-{
-  "sites": [
-    {
-      "site_id": "SITE_001",
-      "structured_result": {
-        "action": "resupply" or "no_resupply",
-        "quantity": integer (0 if no_resupply, otherwise calculated optimal quantity),
-        "confidence": float between 0.0-1.0,
-        "reasons": ["reason1", "reason2", ...]
-      },
-      "draft_message": "Two detailed paragraphs explaining analysis, reasoning, and recommendation."
-    },
-    {
-      "site_id": "SITE_002",
-      ...
-    }
-  ]
-}
-
-Return ONLY valid JSON, no other text. Ensure the response includes all sites in the same order as provided."""
-        
-        return prompt
+        parts.append(_BATCH_PROMPT_FOOTER)
+        return "".join(parts)
     
     def _parse_batch_response(self, response: Dict[str, Any], site_ids: List[str]) -> List[Dict[str, Any]]:
         """Parse batch Gemini API response into individual site results."""
@@ -437,43 +920,38 @@ Return ONLY valid JSON, no other text. Ensure the response includes all sites in
                 if parts and "text" in parts[0]:
                     text = parts[0]["text"]
                     # Parse JSON from response
-                    parsed = json.loads(text)
+                    parsed = orjson.loads(text)
                     
                     # Extract sites array
                     if "sites" not in parsed:
                         raise ValueError("Response missing 'sites' array")
                     
-                    # Create a map of site_id to result
-                    results_map = {}
+                    # Write each result straight into its input position
+                    positions: Dict[str, List[int]] = {}
+                    for index, site_id in enumerate(site_ids):
+                        positions.setdefault(site_id, []).append(index)
+                    results: List[Optional[Dict[str, Any]]] = [None] * len(site_ids)
+                    
                     for site_result in parsed["sites"]:
                         site_id = site_result.get("site_id")
-                        if not site_id:
+                        if not site_id or site_id not in positions:
                             continue
                         
                         # Ensure required structure
-                        if "structured_result" not in site_result:
-                            site_result["structured_result"] = {
-                                "action": "no_resupply",
-                                "quantity": 0,
-                                "confidence": 0.5,
-                                "reasons": ["Unable to parse structured result"]
-                            }
-                        if "draft_message" not in site_result:
-                            site_result["draft_message"] = "Unable to generate justification message."
+                        _apply_reply_defaults(site_result)
                         
-                        results_map[site_id] = {
+                        # A site repeated by the model keeps its last entry
+                        result = {
                             "structured_result": site_result["structured_result"],
                             "draft_message": site_result["draft_message"]
                         }
+                        for index in positions[site_id]:
+                            results[index] = result
                     
-                    # Return results in the same order as input site_ids
-                    results = []
-                    for site_id in site_ids:
-                        if site_id in results_map:
-                            results.append(results_map[site_id])
-                        else:
-                            # Fallback if site not in response
-                            results.append({
+                    # Fallback for sites missing from the response
+                    for index, site_id in enumerate(site_ids):
+                        if results[index] is None:
+                            results[index] = {
                                 "structured_result": {
                                     "action": "no_resupply",
                                     "quantity": 0,
@@ -481,79 +959,145 @@ Return ONLY valid JSON, no other text. Ensure the response includes all sites in
                                     "reasons": [f"Site {site_id} not found in batch response"]
                                 },
                                 "draft_message": f"Unable to generate LLM analysis for site {site_id}."
-                            })
+                            }
                     
                     return results
             
             raise ValueError("Invalid response format from Gemini API")
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Failed to parse JSON response: {str(e)}")
         except Exception as e:
             raise ValueError(f"Error parsing batch response: {str(e)}")
     
     def _get_next_available_key(self) -> Optional[str]:
-        """Get next available API key using round-robin with failure tracking."""
-        import time
-        current_time = time.time()
-        
-        # Filter out keys that are in cooldown
-        available_keys = [
-            key for key in self.api_keys
-            if self.key_cooldown[key] <= current_time
-        ]
+        """
+        Get next available API key using round-robin with failure tracking.
         
-        if not available_keys:
-            # All keys in cooldown, reset cooldowns and try again
-            print("All API keys in cooldown, resetting...")
-            for key in self.api_keys:
-                self.key_cooldown[key] = 0
-            available_keys = self.api_keys
+        Keys in cooldown are skipped, and a key is only handed out when its
+        token bucket has budget; if no key has budget, wait for the earliest refill.
+        """
+        while True:
+            with self._key_lock:
+                # Cooldowns are on the monotonic clock so wall-clock steps
+                # cannot release or extend them
+                now = time.monotonic()
+                
+                # Indices (into api_keys) of keys that are not in cooldown
+                ready = np.flatnonzero(self._cooldowns[self.key_rows] <= now)
+                
+                if ready.size == 0:
+                    # All keys in cooldown, reset cooldowns and try again
+                    print("All API keys in cooldown, resetting...")
+                    self._cooldowns[self.key_rows] = 0.0
+                    ready = np.arange(len(self.api_keys))
+                
+                # Round-robin selection among keys with request budget left
+                start = self.current_key_index % ready.size
+                for offset in range(ready.size):
+                    position = (start + offset) % ready.size
+                    key = self.api_keys[ready[position]]
+                    bucket = self.buckets[key]
+                    bucket.refill(now)
+                    if bucket.tokens >= 1.0:
+                        bucket.tokens -= 1.0
+                        self.current_key_index = (position + 1) % ready.size
+                        return key
+                
+                wait = min(self.buckets[self.api_keys[i]].seconds_until_token() for i in ready)
+            
+            self._sleep(wait)
+    
+    def _mark_key_failure(
+        self,
+        key: str,
+        status_code: Optional[int] = None,
+        response: Optional[requests.Response] = None
+    ):
+        """
+        Mark a key as failed and set cooldown period.
         
-        # Round-robin selection
-        if available_keys:
-            key = available_keys[self.current_key_index % len(available_keys)]
-            self.current_key_index = (self.current_key_index + 1) % len(available_keys)
-            return key
+        The cooldown follows the server's Retry-After / X-RateLimit-Reset
+        headers when present, and the key's token bucket is trimmed to
+        X-RateLimit-Remaining; otherwise fixed cooldowns per error type apply.
+        """
+        # Set cooldown based on error type
+        cooldown_seconds = _retry_after_seconds(response)
+        if cooldown_seconds is None:
+            if status_code == 429:  # Rate limited - longer cooldown
+                cooldown_seconds = 60  # 1 minute
+            elif status_code == 503:  # Service unavailable - medium cooldown
+                cooldown_seconds = 30  # 30 seconds
+            else:  # Other errors - short cooldown
+                cooldown_seconds = 10  # 10 seconds
         
-        return None
+        if response is not None:
+            remaining = response.headers.get("X-RateLimit-Remaining")
+            if remaining is not None:
+                try:
+                    with self._key_lock:
+                        bucket = self.buckets[key]
+                        bucket.tokens = min(bucket.tokens, float(remaining))
+                except ValueError:
+                    pass
+        
+        with self._key_lock:
+            self._cooldowns[self._key_row[key]] = time.monotonic() + cooldown_seconds
+        print(f"API key marked for cooldown ({cooldown_seconds:.0f}s) due to error {status_code}")
     
-    def _mark_key_failure(self, key: str, status_code: Optional[int] = None):
-        """Mark a key as failed and set cooldown period."""
-        import time
-        self.key_failures[key] += 1
+    def _call_gemini_api(
+        self,
+        prompt: str,
+        model_override: Optional[str] = None,
+        key_override: Optional[str] = None,
+        use_cache: bool = True,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Call Gemini API with optional model and key override for fallback.
         
-        # Set cooldown based on error type
-        if status_code == 429:  # Rate limited - longer cooldown
-            cooldown_seconds = 60  # 1 minute
-        elif status_code == 503:  # Service unavailable - medium cooldown
-            cooldown_seconds = 30  # 30 seconds
-        else:  # Other errors - short cooldown
-            cooldown_seconds = 10  # 10 seconds
-        
-        self.key_cooldown[key] = time.time() + cooldown_seconds
-        print(f"API key marked for cooldown ({cooldown_seconds}s) due to error {status_code}")
-    
-    def _call_gemini_api(self, prompt: str, model_override: Optional[str] = None, key_override: Optional[str] = None) -> Dict[str, Any]:
-        """Call Gemini API with optional model and key override for fallback."""
-        # Use override model if provided, otherwise use configured model
-        model_name = (model_override or self.model).strip()
+        Fallbacks run in a loop rather than by recursion: a 429/503 or timeout
+        switches to the next key once per model, and a 404 on the requested
+        model walks the fallback models, each starting on a fresh key. If
+        everything fails, the first HTTP error is re-raised for the caller's
+        retry loop to back off on.
+        
+        The model that ends up answering is remembered, and later calls
+        without a model override go straight to it; fallbacks that returned
+        404 are not probed again.
+        
+        Successful responses are kept in a bounded LRU cache keyed on the
+        prompt and model; use_cache=False skips the lookup (the fresh
+        response still replaces the cached one).
+        
+        timeout is the per-request timeout in seconds (default api_timeout).
+        """
+        timeout = timeout or self.api_timeout
+        cache_key = hashlib.blake2b(
+            f"{model_override or self.model}\0{prompt}".encode(), digest_size=16
+        ).digest()
+        if use_cache:
+            with self._cache_lock:
+                cached = self._response_cache.get(cache_key)
+                if cached is not None:
+                    self._response_cache.move_to_end(cache_key)
+                    return cached
+        
+        # Use override model if provided, otherwise the model resolved by an
+        # earlier call, otherwise the configured model
+        if model_override is None and self._resolved_model:
+            model_name = self._resolved_model
+        else:
+            model_name = (model_override or self.model).strip()
         if model_name.startswith("models/"):
             model_name = model_name.replace("models/", "")
+        requested_model = model_name
         
         # Get API key (use override if provided, otherwise get next available)
         api_key = key_override or self._get_next_available_key()
         if not api_key:
             raise ValueError("No available API keys")
         
-        # Construct URL - format: https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent
-        # Ensure base_url doesn't already include /models
-        if "/models" in self.base_url:
-            url = f"{self.base_url}/{model_name}:generateContent"
-        else:
-            url = f"{self.base_url}/models/{model_name}:generateContent"
-        params = {"key": api_key}
-        
-        payload = {
+        payload = orjson.dumps({
             "contents": [{
                 "parts": [{"text": prompt}]
             }],
@@ -561,107 +1105,164 @@ Return ONLY valid JSON, no other text. Ensure the response includes all sites in
                 "temperature": 0.0,
                 "responseMimeType": "application/json"
             }
-        }
+        })
+        headers = None
+        if self.gzip_requests and len(payload) >= _GZIP_MIN_BYTES:
+            # Prompts are repetitive prose; the fastest level already compresses them well
+            payload = gzip.compress(payload, compresslevel=1)
+            headers = {"Content-Encoding": "gzip"}
         
-        try:
-            response = requests.post(url, params=params, json=payload, timeout=self.api_timeout)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.Timeout as e:
-            # Handle timeout errors - mark key for cooldown and try next key
-            self._mark_key_failure(api_key, None)  # None status code for timeout
-            
-            # Try next available key if we have multiple keys
-            if len(self.api_keys) > 1:
-                next_key = self._get_next_available_key()
-                if next_key and next_key != api_key:
-                    print(f"Request timed out, switching to next API key")
-                    try:
-                        return self._call_gemini_api(prompt, model_override=model_override, key_override=next_key)
-                    except (requests.exceptions.HTTPError, requests.exceptions.Timeout):
-                        pass  # Fall through to raise error
-            
-            # If no other keys or all failed, raise error
-            error_msg = f"Request timed out after {self.api_timeout}s. The API may be slow or overloaded."
-            raise requests.exceptions.HTTPError(error_msg)
-        except requests.exceptions.HTTPError as e:
-            status_code = getattr(e.response, 'status_code', None) if hasattr(e, 'response') and e.response else None
+        fallback_models = None  # Filled in after a 404 on the requested model
+        key_switched = key_override is not None
+        first_error = None
+        
+        while True:
+            if time.monotonic() < self._breaker_open_until:
+                raise CircuitOpenError("Gemini API circuit breaker is open after repeated failures; skipping call")
             
-            # Mark this key as failed
-            self._mark_key_failure(api_key, status_code)
+            url = self._url_for_model.get(model_name) or self._model_url(model_name)
+            params = self._params_for_key[api_key]
             
-            # If 404 and not already using a fallback, try fallback models
-            if status_code == 404 and model_override is None:
-                # First, try removing -latest suffix if present
-                if model_name.endswith("-latest"):
-                    try_model = model_name.replace("-latest", "")
-                    try:
-                        print(f"Model '{model_name}' not found (404). Trying without -latest suffix: {try_model}")
-                        return self._call_gemini_api(prompt, model_override=try_model, key_override=None)
-                    except requests.exceptions.HTTPError:
-                        pass  # Continue to fallback models
+            try:
+                # The session already sends Content-Type: application/json
+                response = self.session.post(url, params=params, data=payload, headers=headers, timeout=timeout)
+                response.raise_for_status()
+                # Decode the raw body directly instead of going through response.text
+                result = orjson.loads(response.content)
+                GeminiClient._breaker_failures = 0
+                if model_override is None:
+                    self._resolved_model = model_name
+                with self._cache_lock:
+                    self._response_cache[cache_key] = result
+                    self._response_cache.move_to_end(cache_key)
+                    if len(self._response_cache) > self._response_cache_size:
+                        self._response_cache.popitem(last=False)
+                return result
+            except requests.exceptions.Timeout:
+                # Handle timeout errors - mark key for cooldown and try next key
+                self._mark_key_failure(api_key, None)  # None status code for timeout
+                self._record_breaker_failure()
+                
+                # Try next available key once, so two failing keys cannot
+                # bounce the request back and forth forever
+                if not key_switched and len(self.api_keys) > 1:
+                    key_switched = True
+                    next_key = self._get_next_available_key()
+                    if next_key and next_key != api_key:
+                        print(f"Request timed out, switching to next API key")
+                        api_key = next_key
+                        continue
+                
+                if fallback_models is None:
+                    error_msg = f"Request timed out after {timeout}s. The API may be slow or overloaded."
+                    raise requests.exceptions.HTTPError(error_msg)
+            except requests.exceptions.HTTPError as e:
+                # Note: a Response is falsy for 4xx/5xx, so test against None
+                status_code = e.response.status_code if e.response is not None else None
                 
-                # Try fallback models
-                for fallback_model in self.fallback_models:
-                    if fallback_model != model_name:  # Don't retry the same model
-                        try:
-                            print(f"Model '{model_name}' not found (404). Trying fallback: {fallback_model}")
-                            return self._call_gemini_api(prompt, model_override=fallback_model, key_override=None)
-                        except requests.exceptions.HTTPError:
-                            continue  # Try next fallback
+                # Mark this key as failed
+                self._mark_key_failure(api_key, status_code, e.response)
+                if status_code != 404:
+                    self._record_breaker_failure()
+                if first_error is None:
+                    first_error = e
+                
+                if status_code == 404:
+                    self._dead_models.add(model_name)
+                
+                if status_code == 404 and model_override is None and fallback_models is None:
+                    # First try removing -latest suffix, then the fallback models
+                    fallback_models = []
+                    if model_name.endswith("-latest"):
+                        fallback_models.append(model_name.replace("-latest", ""))
+                    fallback_models.extend(m for m in self.fallback_models if m != model_name)
+                    fallback_models = [m for m in fallback_models if m not in self._dead_models]
+                elif status_code in [429, 503] and not key_switched and len(self.api_keys) > 1:
+                    # For rate limits (429) or service unavailable (503), try next available key once
+                    key_switched = True
+                    next_key = self._get_next_available_key()
+                    if next_key and next_key != api_key:
+                        print(f"Switching to next API key due to {status_code} error")
+                        api_key = next_key
+                        continue
             
-            # For rate limits (429) or service unavailable (503), try next available key
-            if status_code in [429, 503] and len(self.api_keys) > 1:
-                next_key = self._get_next_available_key()
-                if next_key and next_key != api_key:
-                    print(f"Switching to next API key due to {status_code} error")
-                    try:
-                        return self._call_gemini_api(prompt, model_override=model_override, key_override=next_key)
-                    except requests.exceptions.HTTPError:
-                        pass  # Fall through to error handling
+            if fallback_models:
+                fallback_model = fallback_models.pop(0)
+                if requested_model.endswith("-latest") and fallback_model == requested_model.replace("-latest", ""):
+                    print(f"Model '{requested_model}' not found (404). Trying without -latest suffix: {fallback_model}")
+                else:
+                    print(f"Model '{requested_model}' not found (404). Trying fallback: {fallback_model}")
+                model_name = fallback_model
+                api_key = self._get_next_available_key()
+                key_switched = False
+                continue
             
-            # Sanitize URL in error message before re-raising
-            error_msg = str(e)
-            for key in self.api_keys:
-                if key in error_msg:
-                    error_msg = error_msg.replace(key, "***API_KEY_HIDDEN***")
-            # Add helpful message about model availability
-            if status_code == 404:
-                error_msg += f"\n\nModel '{model_name}' not found. Available models may include: gemini-2.5-flash, gemini-2.5-pro, gemini-1.5-flash, gemini-1.5-pro"
-                error_msg += "\nCheck your API key permissions and model availability at: https://ai.google.dev/models"
-            # Create new exception with sanitized message
-            new_exception = requests.exceptions.HTTPError(
-                error_msg,
-                response=e.response if hasattr(e, 'response') else None
-            )
-            raise new_exception
+            raise self._sanitized_error(first_error, requested_model)
+    
+    def _record_breaker_failure(self):
+        """Count a failed request and open the circuit breaker at the threshold."""
+        with self._key_lock:
+            GeminiClient._breaker_failures += 1
+            if GeminiClient._breaker_failures >= self._breaker_threshold:
+                GeminiClient._breaker_open_until = time.monotonic() + self._breaker_cooldown
+                GeminiClient._breaker_failures = 0
+                print(f"Circuit breaker opened for {self._breaker_cooldown:.0f}s after {self._breaker_threshold} consecutive API failures")
+    
+    def _model_url(self, model_name: str) -> str:
+        """Build (and remember) the generateContent URL for a model."""
+        # Construct URL - format: https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent
+        # Ensure base_url doesn't already include /models
+        if "/models" in self.base_url:
+            url = f"{self.base_url}/{model_name}:generateContent"
+        else:
+            url = f"{self.base_url}/models/{model_name}:generateContent"
+        self._url_for_model[model_name] = url
+        return url
+    
+    def _scrub_keys(self, text: str) -> str:
+        """Replace every configured API key in text with a placeholder, in one pass."""
+        # No search() guard needed: sub() returns the same str object untouched
+        # when nothing matches, so key-free messages cost one scan and no copy
+        if self._key_re is None:
+            return text
+        return self._key_re.sub(_KEY_PLACEHOLDER, text)
+    
+    def _sanitized_error(self, error: requests.exceptions.HTTPError, model_name: str) -> requests.exceptions.HTTPError:
+        """
+        Copy of an HTTP error with API keys scrubbed from its message.
+        
+        The original error is returned as-is (keeping its traceback) when
+        there was nothing to scrub or append.
+        """
+        status_code = error.response.status_code if error.response is not None else None
+        
+        # Sanitize URL in error message before re-raising
+        original_msg = str(error)
+        error_msg = self._scrub_keys(original_msg)
+        # Add helpful message about model availability
+        if status_code == 404:
+            error_msg += _MODEL_NOT_FOUND_HEAD.format(model_name) + _MODEL_NOT_FOUND_TAIL
+        if error_msg is original_msg:
+            return error
+        # Create new exception with sanitized message
+        return requests.exceptions.HTTPError(error_msg, response=error.response)
     
     def _parse_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
         """Parse Gemini API response."""
+        # Extract text content
         try:
-            # Extract text content
-            if "candidates" in response and len(response["candidates"]) > 0:
-                content = response["candidates"][0].get("content", {})
-                parts = content.get("parts", [])
-                if parts and "text" in parts[0]:
-                    text = parts[0]["text"]
-                    # Parse JSON from response
-                    parsed = json.loads(text)
-                    
-                    # Ensure required structure
-                    if "structured_result" not in parsed:
-                        parsed["structured_result"] = {
-                            "action": "no_resupply",
-                            "quantity": 0,
-                            "confidence": 0.5,
-                            "reasons": ["Unable to parse structured result"]
-                        }
-                    if "draft_message" not in parsed:
-                        parsed["draft_message"] = "Unable to generate justification message."
-                    
-                    return parsed
-            
+            text = response["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError, TypeError):
             raise ValueError("Invalid response format from Gemini API")
-        except json.JSONDecodeError as e:
+        
+        try:
+            # Parse JSON from response. The envelope was already decoded
+            # from raw bytes, so this is a str; orjson reads its UTF-8
+            # buffer directly and an .encode() first would only add a copy.
+            parsed = orjson.loads(text)
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Failed to parse JSON response: {str(e)}")
+        
+        # Ensure required structure
+        return _apply_reply_defaults(parsed)
 
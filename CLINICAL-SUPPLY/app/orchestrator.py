@@ -1,11 +1,19 @@
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from types import MappingProxyType
+from typing import Dict, List, Any, Optional, Tuple
+import asyncio
+import hashlib
 import json
+import os
+import random
+import threading
 import time
+from collections import OrderedDict, deque
+from contextlib import nullcontext
 from datetime import datetime
+import numpy as np
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Semaphore
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 from app.data_loader import load_data
 from app.features import compute_site_features
@@ -15,12 +23,101 @@ from app.agentops_instrumentation import get_instrumentation
 from app.waste_analyzer import WasteAnalyzer
 from app.temp_excursion_handler import TempExcursionHandler
 from app.depot_optimizer import DepotOptimizer
+from app.dynamic_batcher import DynamicBatcher
 from app.config import Config
 
 
+# Read-only default for per-site lookups that miss
+_EMPTY = MappingProxyType({})
+
+# Output JSONL is fsynced every this many records, so a crash loses at most one block
+_FSYNC_EVERY = 100
+
+# Part of every LLM cache key; bump when prompts or response handling change
+_LLM_CACHE_VERSION = 1
+
+
+class AdaptiveBatchSizer:
+    """
+    Chooses the batch API size online from observed call latency.
+    
+    Throughput (sites per second) is tracked per batch size as an EMA. After
+    each call the size moves to the best of {size / 2, size, size * 2} whose
+    p95 latency stays within budget (an untried larger size first), or with
+    probability epsilon to a random one of them to keep estimates fresh.
+    The current size is kept unless a neighbour beats its throughput by
+    more than tie_tolerance, and larger sizes win remaining ties, so flat
+    throughput does not drift the size down to 1.
+    """
+    
+    def __init__(
+        self,
+        initial_size: int,
+        max_size: int,
+        latency_budget_ms: float,
+        alpha: float = 0.3,
+        epsilon: float = 0.1,
+        history: int = 64,
+        tie_tolerance: float = 0.05
+    ):
+        self.max_size = max(1, max_size)
+        self.size = min(max(1, initial_size), self.max_size)
+        self.latency_budget_ms = latency_budget_ms
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.tie_tolerance = tie_tolerance
+        self.samples: deque = deque(maxlen=history)  # (batch_size, latency_ms, success)
+        self.throughput_ema: Dict[int, float] = {}
+        self._rng = random.Random()
+    
+    def record(self, batch_size: int, latency_ms: float, success: bool) -> None:
+        """Record one batch call and pick the size for the next one."""
+        self.samples.append((batch_size, latency_ms, success))
+        throughput = batch_size * 1000 / max(latency_ms, 1.0) if success else 0.0
+        previous = self.throughput_ema.get(batch_size)
+        self.throughput_ema[batch_size] = (
+            throughput if previous is None else self.alpha * throughput + (1 - self.alpha) * previous
+        )
+        self.size = self._choose_size()
+    
+    def _p95_latency_ms(self, batch_size: int) -> float:
+        """p95 latency of recent calls at batch_size (0 if never sampled)."""
+        latencies = [latency for size, latency, _ in self.samples if size == batch_size]
+        return float(np.percentile(latencies, 95)) if latencies else 0.0
+    
+    def _choose_size(self) -> int:
+        candidates = sorted({max(1, self.size // 2), self.size, min(self.size * 2, self.max_size)})
+        if self._rng.random() < self.epsilon:
+            return self._rng.choice(candidates)
+        
+        within_budget = [size for size in candidates if self._p95_latency_ms(size) <= self.latency_budget_ms]
+        if not within_budget:
+            return candidates[0]
+        # An untried larger size ranks first so the size can grow; an untried
+        # smaller one ranks last (epsilon exploration still reaches it), else
+        # flat throughput would walk the size down one halving at a time. On
+        # equal throughput the larger size wins, as it spends fewer requests.
+        def rank(size: int) -> tuple:
+            if size in self.throughput_ema:
+                return (self.throughput_ema[size], size)
+            return (float("inf") if size > self.size else float("-inf"), size)
+        
+        best = max(within_budget, key=rank)
+        if self.size in within_budget and self.size in self.throughput_ema:
+            if rank(best)[0] <= self.throughput_ema[self.size] * (1 + self.tie_tolerance):
+                return self.size
+        return best
+
+
 class Orchestrator:
     """Main orchestrator for the forecasting pipeline."""
     
+    # Parsed LLM results keyed by a hash of the site features and context,
+    # shared by all orchestrators in the process: key -> (expires_at, gemini_result)
+    _llm_cache: "OrderedDict[str, tuple]" = OrderedDict()
+    _llm_cache_size = 2048
+    _llm_cache_lock = threading.Lock()
+    
     def __init__(self):
         """Initialize orchestrator."""
         # Initialize Gemini client with error handling - make it optional
@@ -36,59 +133,94 @@ class Orchestrator:
         self.chunk_size = 3  # Process sites in smaller chunks to avoid rate limits (reduced from 5)
         self.chunk_delay = 3.0  # Delay between chunks (seconds) - increased to avoid rate limits
         self.waste_analyzer = WasteAnalyzer()
-        self.temp_excursion_handler = TempExcursionHandler()
+        self.temp_excursion_handler = TempExcursionHandler(self.gemini_client)
         self.depot_optimizer = DepotOptimizer()
         
         # Track LLM failures - if too many, disable LLM for this run
         self.llm_failure_count = 0
         self.max_llm_failures = 3  # After 3 failures, skip LLM for remaining sites
         
+        # LLM cache statistics for this orchestrator
+        self.llm_cache_lookups = 0
+        self.llm_cache_hits = 0
+        
         # Hybrid optimization settings
         self.use_streaming = Config.USE_STREAMING
         self.use_batch_api = Config.USE_BATCH_API and self.llm_available
+        self.use_batch_jobs = Config.USE_GEMINI_BATCH_JOBS and self.llm_available
+        # Background merge of the last run's batch job (resolves to the number of sites merged)
+        self.batch_job_merge: Optional[Future] = None
         self.use_parallel = Config.USE_PARALLEL
         self.use_selective_llm = Config.USE_SELECTIVE_LLM
         self.batch_api_size = Config.BATCH_API_SIZE
         self.max_concurrent = Config.MAX_CONCURRENT_REQUESTS
-        
-        # Rate limiting semaphore for parallel processing
-        self.rate_limiter = Semaphore(self.max_concurrent) if self.use_parallel else None
+        self.max_batch_size = Config.LLM_MAX_BATCH_SIZE
+        self.batch_sizer = (
+            AdaptiveBatchSizer(self.batch_api_size, Config.LLM_BATCH_SIZE_MAX, Config.LLM_BATCH_LATENCY_BUDGET_MS)
+            if Config.USE_ADAPTIVE_BATCH_SIZE else None
+        )
     
-    def _should_use_llm(self, site_row: pd.Series) -> bool:
+    def _classify_sites(self, site_features: pd.DataFrame) -> pd.Series:
         """
-        Determine if a site should use LLM analysis based on priority criteria.
+        Determine which sites should use LLM analysis based on priority criteria.
         
         Args:
-            site_row: Series containing site features
+            site_features: DataFrame containing site features
             
         Returns:
-            True if LLM should be used, False for rules engine only
+            Boolean Series aligned with site_features; True if LLM should be used,
+            False for rules engine only
         """
         if not self.use_selective_llm or not self.llm_available:
-            return self.llm_available and self.llm_failure_count < self.max_llm_failures
+            use_llm = self.llm_available and self.llm_failure_count < self.max_llm_failures
+            return pd.Series(use_llm, index=site_features.index)
         
         # Use LLM if any of these conditions are met:
-        urgency_score = float(site_row.get("urgency_score", 0))
-        days_to_expiry = int(site_row.get("days_to_expiry", 999))
-        current_inventory = int(site_row.get("current_inventory", 0))
-        projected_demand = int(site_row.get("projected_30d_demand", 0))
-        
-        # High urgency
-        if urgency_score >= Config.LLM_PRIORITY_THRESHOLD:
-            return True
-        
-        # Expiring soon
-        if days_to_expiry <= Config.LLM_EXPIRY_THRESHOLD:
-            return True
-        
-        # Inventory below demand
-        if current_inventory < projected_demand:
-            return True
-        
-        # Use rules engine for routine cases
-        return False
+        # high urgency, expiring soon, or inventory below demand
+        return (
+            (site_features["urgency_score"] >= Config.LLM_PRIORITY_THRESHOLD)
+            | (site_features["days_to_expiry"] <= Config.LLM_EXPIRY_THRESHOLD)
+            | (site_features["current_inventory"] < site_features["projected_30d_demand"])
+        )
+    
+    def _llm_cache_key(self, site_features: Dict[str, Any], context_stats: Dict[str, Any]) -> str:
+        """Content hash of everything that determines an LLM result for a site."""
+        payload = {
+            "version": _LLM_CACHE_VERSION,
+            "model": Config.GEMINI_MODEL,
+            "site_features": site_features,
+            "context": context_stats,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
     
-    def _process_site_with_rules(self, row: pd.Series, site_id: str) -> Dict[str, Any]:
+    def _llm_cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached, unexpired LLM result for key, or None."""
+        if Config.LLM_CACHE_TTL <= 0:
+            return None
+        self.llm_cache_lookups += 1
+        with self._llm_cache_lock:
+            entry = self._llm_cache.get(key)
+            if entry is None:
+                return None
+            expires_at, gemini_result = entry
+            if expires_at <= time.monotonic():
+                del self._llm_cache[key]
+                return None
+            self._llm_cache.move_to_end(key)
+        self.llm_cache_hits += 1
+        return gemini_result
+    
+    def _llm_cache_put(self, key: str, gemini_result: Dict[str, Any]) -> None:
+        """Cache an LLM result for LLM_CACHE_TTL seconds, evicting the least recently used."""
+        if Config.LLM_CACHE_TTL <= 0:
+            return
+        with self._llm_cache_lock:
+            self._llm_cache[key] = (time.monotonic() + Config.LLM_CACHE_TTL, gemini_result)
+            self._llm_cache.move_to_end(key)
+            if len(self._llm_cache) > self._llm_cache_size:
+                self._llm_cache.popitem(last=False)
+    
+    def _process_site_with_rules(self, row: Dict[str, Any], site_id: str) -> Dict[str, Any]:
         """Process a single site using rules engine only."""
         rules_result = recommend_resupply(row)
         return {
@@ -114,89 +246,414 @@ class Orchestrator:
         """Process a batch of sites using batch LLM API call."""
         if not self.gemini_client or not sites_batch:
             return []
+        return self._process_sites_batches_llm([sites_batch], context_stats)[0]
+    
+    def _process_sites_batches_llm(
+        self,
+        batches: List[List[tuple]],
+        context_stats: Dict[str, Any]
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Process several batches of sites with batch LLM API calls, sending
+        the batches concurrently (get_batch_recommendations_many).
         
-        try:
-            # Prepare batch data
-            sites_data = []
-            site_ids = []
-            for row_idx, row in sites_batch:
-                site_id = row["site_id"]
-                site_ids.append(site_id)
-                sites_data.append({
-                    "site_id": site_id,
-                    "site_features": row.to_dict(),
-                    "rules_result": None  # Don't bias LLM
-                })
-            
-            # Call batch API
-            updated_context = context_stats.copy()
-            batch_results = self.gemini_client.get_batch_recommendations(
-                sites_data=sites_data,
-                context_data=updated_context
-            )
-            
-            # Map results to sites
-            processed_sites = []
-            for idx, (row_idx, row) in enumerate(sites_batch):
-                site_id = row["site_id"]
-                if idx < len(batch_results):
-                    gemini_result = batch_results[idx]
-                    processed_sites.append({
-                        "site_id": site_id,
-                        "action": gemini_result["structured_result"]["action"],
-                        "quantity": gemini_result["structured_result"]["quantity"],
-                        "confidence": gemini_result["structured_result"]["confidence"],
-                        "reason": gemini_result["draft_message"],
-                        "llm_used": True,
-                        "latency_ms": 0.0,  # Batch latency tracked separately
-                        "gemini_result": gemini_result
-                    })
-                else:
-                    # Fallback to rules if batch result missing
-                    processed_sites.append(self._process_site_with_rules(row, site_id))
-            
-            self.llm_failure_count = 0  # Reset on success
-            return processed_sites
-            
-        except Exception as e:
-            # Batch failed - fallback to individual processing or rules
-            self.llm_failure_count += 1
-            print(f"Batch LLM processing failed: {e}. Falling back to rules engine.")
-            # Return rules-based results for all sites in batch
-            return [self._process_site_with_rules(row, row["site_id"]) for _, row in sites_batch]
+        Cached results are reused; only cache misses are sent to the LLM. A
+        batch whose call fails falls back to the rules engine on its own.
+        
+        Returns:
+            One list of site results per batch, in order
+        """
+        # Look up cached results; only cache misses are sent to the LLM
+        cache_keys = [[self._llm_cache_key(record, context_stats) for _, record in batch] for batch in batches]
+        gemini_results = [[self._llm_cache_get(key) for key in keys] for keys in cache_keys]
+        misses = [[idx for idx, cached in enumerate(results) if cached is None] for results in gemini_results]
+        live = [batch_num for batch_num, batch_misses in enumerate(misses) if batch_misses]
+        
+        outcomes = {}
+        if live:
+            sites_data = [
+                [
+                    {
+                        "site_id": batches[batch_num][idx][1]["site_id"],
+                        "site_features": batches[batch_num][idx][1],
+                        "rules_result": None  # Don't bias LLM
+                    }
+                    for idx in misses[batch_num]
+                ]
+                for batch_num in live
+            ]
+            outcomes = dict(zip(live, self.gemini_client.get_batch_recommendations_many(
+                sites_data, context_stats.copy()
+            )))
+        
+        processed_batches = []
+        for batch_num, batch in enumerate(batches):
+            try:
+                outcome = outcomes.get(batch_num)
+                if isinstance(outcome, Exception):
+                    raise outcome
+                # Splice fresh results back in between the cached ones
+                for idx, gemini_result in zip(misses[batch_num], outcome or []):
+                    gemini_results[batch_num][idx] = gemini_result
+                    self._llm_cache_put(cache_keys[batch_num][idx], gemini_result)
+                
+                # Map results to sites
+                processed_sites = []
+                for (row_idx, record), gemini_result in zip(batch, gemini_results[batch_num]):
+                    site_id = record["site_id"]
+                    if gemini_result is not None:
+                        processed_sites.append({
+                            "site_id": site_id,
+                            "action": gemini_result["structured_result"]["action"],
+                            "quantity": gemini_result["structured_result"]["quantity"],
+                            "confidence": gemini_result["structured_result"]["confidence"],
+                            "reason": gemini_result["draft_message"],
+                            "llm_used": True,
+                            "latency_ms": 0.0,  # Batch latency tracked separately
+                            "gemini_result": gemini_result
+                        })
+                    else:
+                        # Fallback to rules if batch result missing
+                        processed_sites.append(self._process_site_with_rules(record, site_id))
+                
+                self.llm_failure_count = 0  # Reset on success
+                processed_batches.append(processed_sites)
+            except Exception as e:
+                # Batch failed - fallback to rules
+                self.llm_failure_count += 1
+                print(f"Batch LLM processing failed: {e}. Falling back to rules engine.")
+                # Return rules-based results for all sites in batch
+                processed_batches.append([self._process_site_with_rules(record, record["site_id"]) for _, record in batch])
+        return processed_batches
     
-    def _process_site_individual_llm(self, row: pd.Series, site_id: str, context_stats: Dict[str, Any]) -> Dict[str, Any]:
+    def _llm_site_result(self, site_id: str, gemini_result: Dict[str, Any], latency_ms: float) -> Dict[str, Any]:
+        """Build the per-site result for a successful individual LLM call."""
+        return {
+            "site_id": site_id,
+            "action": gemini_result["structured_result"]["action"],
+            "quantity": gemini_result["structured_result"]["quantity"],
+            "confidence": gemini_result["structured_result"]["confidence"],
+            "reason": gemini_result["draft_message"],
+            "llm_used": True,
+            "latency_ms": round(latency_ms, 2),
+            "gemini_result": gemini_result
+        }
+    
+    def _process_site_individual_llm(self, record: Dict[str, Any], site_id: str, context_stats: Dict[str, Any]) -> Dict[str, Any]:
         """Process a single site using individual LLM API call."""
         if not self.gemini_client:
-            return self._process_site_with_rules(row, site_id)
+            return self._process_site_with_rules(record, site_id)
+        
+        cache_key = self._llm_cache_key(record, context_stats)
+        cached = self._llm_cache_get(cache_key)
+        if cached is not None:
+            return self._llm_site_result(site_id, cached, 0.0)
         
         try:
-            start_time = datetime.now()
+            start_ns = time.perf_counter_ns()
             updated_context = context_stats.copy()
             gemini_result = self.gemini_client.get_recommendation_justification(
                 site_id=site_id,
-                site_features=row.to_dict(),
+                site_features=record,
                 rules_result=None,
                 context_data=updated_context
             )
             
-            latency_ms = (datetime.now() - start_time).total_seconds() * 1000
+            latency_ms = (time.perf_counter_ns() - start_ns) / 1e6
             self.llm_failure_count = 0  # Reset on success
+            self._llm_cache_put(cache_key, gemini_result)
             
-            return {
-                "site_id": site_id,
-                "action": gemini_result["structured_result"]["action"],
-                "quantity": gemini_result["structured_result"]["quantity"],
-                "confidence": gemini_result["structured_result"]["confidence"],
-                "reason": gemini_result["draft_message"],
-                "llm_used": True,
-                "latency_ms": round(latency_ms, 2),
-                "gemini_result": gemini_result
-            }
+            return self._llm_site_result(site_id, gemini_result, latency_ms)
         except Exception as e:
             self.llm_failure_count += 1
             print(f"Individual LLM processing failed for {site_id}: {e}. Using rules engine.")
-            return self._process_site_with_rules(row, site_id)
+            return self._process_site_with_rules(record, site_id)
+    
+    def _process_sites_individual_llm_parallel(self, llm_sites: List[tuple], context_stats: Dict[str, Any]) -> List[Any]:
+        """
+        Process LLM-priority sites on max_concurrent worker threads.
+        
+        Returns:
+            One entry per site, in order: the site result, or the exception
+            raised for that site
+        """
+        def process_one(site_tuple: tuple) -> Any:
+            row_idx, row = site_tuple
+            try:
+                return self._process_site_individual_llm(row, row["site_id"], context_stats)
+            except Exception as e:
+                return e
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrent, len(llm_sites))) as executor:
+            return list(executor.map(process_one, llm_sites))
+    
+    async def _gather_llm_batched(self, llm_sites: List[tuple], context_stats: Dict[str, Any]) -> List[Any]:
+        """
+        Process LLM-priority sites through a DynamicBatcher, so individually
+        submitted sites share batch API calls of up to max_batch_size sites.
+        
+        Returns:
+            One entry per site, in order: the site result, or the exception
+            raised for that site's batch
+        """
+        async def flush(batch: List[tuple]) -> List[Dict[str, Any]]:
+            batch_start_ns = time.perf_counter_ns()
+            batch_results = await asyncio.to_thread(self._process_sites_batch_llm, batch, context_stats)
+            batch_latency = (time.perf_counter_ns() - batch_start_ns) / 1e6
+            for batch_result in batch_results:
+                batch_result["latency_ms"] = round(batch_latency / len(batch), 2)
+            return batch_results
+        
+        max_in_flight = self.max_concurrent if self.use_parallel else 1
+        async with DynamicBatcher(self.max_batch_size, Config.LLM_BATCH_TIMEOUT_MS, flush, max_in_flight) as batcher:
+            return await asyncio.gather(*(batcher.submit(site) for site in llm_sites), return_exceptions=True)
+    
+    def _process_llm_sites(self, llm_sites: List[tuple], context_stats: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Process LLM-priority sites through the live API (batched, micro-batched, parallel or sequential)."""
+        results = []
+        if not llm_sites:
+            return results
+        
+        if self.use_batch_api and self.batch_api_size > 1 and self.use_parallel and not self.batch_sizer:
+            # Fixed-size batches don't wait on latency feedback, so send them
+            # all at once; the client bounds how many are in flight
+            batches = [
+                llm_sites[start:start + self.batch_api_size]
+                for start in range(0, len(llm_sites), self.batch_api_size)
+            ]
+            self.instrumentation.log_event("processing_llm_batches", {
+                "batch_count": len(batches),
+                "batch_size": self.batch_api_size
+            })
+            
+            batches_start_ns = time.perf_counter_ns()
+            processed_batches = self._process_sites_batches_llm(batches, context_stats)
+            site_latency = round((time.perf_counter_ns() - batches_start_ns) / 1e6 / len(llm_sites), 2)
+            
+            for batch_results in processed_batches:
+                for batch_result in batch_results:
+                    batch_result["latency_ms"] = site_latency
+                    results.append(batch_result)
+        elif self.use_batch_api and self.batch_api_size > 1:
+            # Process in batches using batch API, one call at a time (parallel
+            # processing is off, or the adaptive sizer needs each call's latency)
+            batch_idx = 0
+            batch_num = 0
+            while batch_idx < len(llm_sites):
+                batch_size = self.batch_sizer.size if self.batch_sizer else self.batch_api_size
+                batch = llm_sites[batch_idx:batch_idx + batch_size]
+                batch_idx += len(batch)
+                batch_num += 1
+                
+                self.instrumentation.log_event("processing_llm_batch", {
+                    "batch_number": batch_num,
+                    "batch_size": len(batch)
+                })
+                
+                cache_hits_before = self.llm_cache_hits
+                batch_start_ns = time.perf_counter_ns()
+                batch_results = self._process_sites_batch_llm(batch, context_stats)
+                batch_latency = (time.perf_counter_ns() - batch_start_ns) / 1e6
+                
+                # Only batches sent to the API whole say anything about call
+                # latency; cache hits would inflate the size's throughput
+                if self.batch_sizer and self.llm_cache_hits == cache_hits_before:
+                    self.batch_sizer.record(
+                        len(batch), batch_latency, any(r["llm_used"] for r in batch_results)
+                    )
+                
+                # Add batch results to main results
+                for batch_result in batch_results:
+                    batch_result["latency_ms"] = round(batch_latency / len(batch), 2)
+                    results.append(batch_result)
+                
+                # Rate limiting delay between batches
+                if batch_idx < len(llm_sites):
+                    time.sleep(self.chunk_delay)
+        else:
+            # Process individually (with optional micro-batching and parallel processing)
+            if self.max_batch_size > 1 or self.use_parallel:
+                if self.max_batch_size > 1:
+                    # Sites submitted one by one, flushed together in small batches
+                    outcomes = asyncio.run(self._gather_llm_batched(llm_sites, context_stats))
+                else:
+                    # Concurrent processing, bounded by max_concurrent
+                    outcomes = self._process_sites_individual_llm_parallel(llm_sites, context_stats)
+                for (row_idx, row), outcome in zip(llm_sites, outcomes):
+                    if isinstance(outcome, BaseException):
+                        site_id = row["site_id"]
+                        print(f"Error processing {site_id} in parallel: {outcome}")
+                        results.append(self._process_site_with_rules(row, site_id))
+                    else:
+                        results.append(outcome)
+            else:
+                # Sequential individual processing
+                for row_idx, row in llm_sites:
+                    site_id = row["site_id"]
+                    result = self._process_site_individual_llm(row, site_id, context_stats)
+                    results.append(result)
+        
+        return results
+    
+    def _start_batch_job(
+        self,
+        sites: List[tuple],
+        context_stats: Dict[str, Any]
+    ) -> Tuple[Optional[str], List[Dict[str, Any]], List[tuple]]:
+        """
+        Submit sites as a Gemini Batch Mode job, answering cached sites directly.
+        
+        Returns:
+            (job name or None if nothing was submitted, results for cached
+            sites, sites awaiting a result)
+        """
+        cached_results = []
+        pending = []
+        for row_idx, row in sites:
+            cached = self._llm_cache_get(self._llm_cache_key(row, context_stats))
+            if cached is not None:
+                cached_results.append(self._llm_site_result(row["site_id"], cached, 0.0))
+            else:
+                pending.append((row_idx, row))
+        
+        if not pending:
+            return None, cached_results, pending
+        
+        try:
+            job_name = self.gemini_client.submit_batch_job(
+                sites_data=[
+                    {"site_id": row["site_id"], "site_features": row, "rules_result": None}
+                    for _, row in pending
+                ],
+                context_data=context_stats.copy()
+            )
+        except Exception as e:
+            print(f"Batch job submission failed: {e}. Processing those sites with live calls.")
+            return None, cached_results, pending
+        
+        self.instrumentation.log_event("batch_job_submitted", {
+            "job_name": job_name,
+            "num_sites": len(pending)
+        })
+        return job_name, cached_results, pending
+    
+    def _collect_batch_job(
+        self,
+        job_name: str,
+        sites: List[tuple],
+        context_stats: Dict[str, Any]
+    ) -> Tuple[List[Dict[str, Any]], List[tuple]]:
+        """
+        Wait for a batch job and map its results to sites.
+        
+        Returns:
+            (results for sites the job answered, sites it did not answer)
+        """
+        try:
+            job_results = self.gemini_client.poll_batch_job(job_name, Config.GEMINI_BATCH_JOB_TIMEOUT)
+        except Exception as e:
+            print(f"Batch job {job_name} failed: {e}. Keeping rules results for those sites.")
+            job_results = {}
+        
+        results = []
+        unanswered = []
+        for row_idx, row in sites:
+            site_id = row["site_id"]
+            gemini_result = job_results.get(site_id)
+            if gemini_result is None:
+                unanswered.append((row_idx, row))
+                continue
+            self._llm_cache_put(self._llm_cache_key(row, context_stats), gemini_result)
+            results.append(self._llm_site_result(site_id, gemini_result, 0.0))
+        
+        self.instrumentation.log_event("batch_job_collected", {
+            "job_name": job_name,
+            "answered": len(results),
+            "unanswered": len(unanswered)
+        })
+        return results, unanswered
+    
+    def _start_batch_job_merge(
+        self,
+        job_name: str,
+        sites: List[tuple],
+        context_stats: Dict[str, Any],
+        output_path: Optional[Path]
+    ) -> Future:
+        """
+        Collect a batch job in a background thread so the run does not wait for it.
+        
+        Returns:
+            Future resolving to the number of sites the job answered
+        """
+        future = Future()
+        
+        def merge():
+            try:
+                future.set_result(self._merge_batch_job(job_name, sites, context_stats, output_path))
+            except Exception as e:
+                print(f"Merging batch job {job_name} failed: {e}")
+                future.set_exception(e)
+        
+        threading.Thread(target=merge, name="batch-job-merge", daemon=True).start()
+        return future
+    
+    def _merge_batch_job(
+        self,
+        job_name: str,
+        sites: List[tuple],
+        context_stats: Dict[str, Any],
+        output_path: Optional[Path]
+    ) -> int:
+        """
+        Wait for a batch job and merge its answers into the run's output.
+        
+        Answers go into the LLM cache, so later runs reuse them, and replace
+        the job's pending rules results in the output file, which is rewritten
+        atomically. Sites the job did not answer keep their rules results.
+        
+        Returns:
+            Number of sites the job answered
+        """
+        job_results, _ = self._collect_batch_job(job_name, sites, context_stats)
+        if output_path is None or not output_path.exists():
+            return len(job_results)
+        
+        answers = {result["site_id"]: result for result in job_results}
+        lines = []
+        with open(output_path) as output_file:
+            for line in output_file:
+                record = json.loads(line)
+                batch_job = record.get("batch_job")
+                if batch_job and batch_job.get("name") == job_name:
+                    answer = answers.get(record["site_id"])
+                    if answer is not None:
+                        record.update(answer)
+                        record["llm"] = answer["gemini_result"]
+                    record["batch_job"] = {"name": job_name, "status": "merged" if answer is not None else "unanswered"}
+                    line = json.dumps(record) + "\n"
+                lines.append(line)
+        
+        tmp_path = output_path.with_name(output_path.name + ".tmp")
+        with open(tmp_path, "w") as output_file:
+            output_file.writelines(lines)
+            output_file.flush()
+            os.fsync(output_file.fileno())
+        os.replace(tmp_path, output_path)
+        return len(job_results)
+    
+    def _analyze_waste_and_excursions(self, data: Dict[str, pd.DataFrame]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Analyze waste patterns, then detect temperature excursions (steps 2a and 2b)."""
+        waste_analysis = self.waste_analyzer.analyze_waste_patterns(
+            data.get("waste", pd.DataFrame()),
+            data.get("inventory", pd.DataFrame()),
+            data.get("dispense", pd.DataFrame())
+        )
+        temp_excursions = self.temp_excursion_handler.detect_excursions(
+            data.get("shipment", pd.DataFrame()),
+            data.get("waste", pd.DataFrame())
+        )
+        return waste_analysis, temp_excursions
     
     def run(
         self,
@@ -206,6 +663,15 @@ class Orchestrator:
         """
         Run the complete forecasting pipeline.
         
+        The run blocks, and runs its micro-batched LLM calls on an event loop
+        of its own, so it must not be called from a running event loop; from
+        async code use await asyncio.to_thread(orchestrator.run, ...).
+        
+        A Gemini Batch Mode job (USE_GEMINI_BATCH_JOBS) is not waited for:
+        its sites are returned with rules results marked as pending, and
+        batch_job_merge completes once the job's answers are in the LLM
+        cache and output_path.
+        
         Args:
             upload_dir: Optional directory containing uploaded CSV files
             output_path: Optional path to save JSONL output
@@ -218,8 +684,21 @@ class Orchestrator:
                 "session_id": str,
                 "output_path": str
             }
+        
+        Raises:
+            RuntimeError: If called from a thread with a running event loop
         """
-        session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(
+                "Orchestrator.run() blocks and cannot be called from a running event loop; "
+                "use await asyncio.to_thread(orchestrator.run, ...)"
+            )
+        
+        session_id = time.strftime("%Y%m%d_%H%M%S")
         
         with self.instrumentation.trace(
             name="forecasting_pipeline",
@@ -233,33 +712,30 @@ class Orchestrator:
                     "num_sites": len(data["sites"]) if "sites" in data else 0
                 })
                 
-                # Step 2: Compute features
+                # Steps 2, 2a and 2b: compute features alongside waste analysis and
+                # temperature excursion detection. Features only read the sites,
+                # dispense, inventory and enrollment frames. Waste analysis parses
+                # the waste frame's dates in place before excursion detection reads
+                # it, so those two run in order on the second worker.
                 self.instrumentation.log_event("feature_computation_start")
-                site_features = compute_site_features(data)
-                self.instrumentation.log_event("feature_computation_complete", {
-                    "num_sites": len(site_features)
-                })
-                
-                # Step 2a: Analyze waste patterns
                 self.instrumentation.log_event("waste_analysis_start")
-                waste_analysis = self.waste_analyzer.analyze_waste_patterns(
-                    data.get("waste", pd.DataFrame()),
-                    data.get("inventory", pd.DataFrame()),
-                    data.get("dispense", pd.DataFrame())
-                )
-                self.instrumentation.log_event("waste_analysis_complete", {
-                    "total_waste": waste_analysis.get("total_waste", 0)
-                })
-                
-                # Step 2b: Detect temperature excursions
                 self.instrumentation.log_event("temp_excursion_detection_start")
-                temp_excursions = self.temp_excursion_handler.detect_excursions(
-                    data.get("shipment", pd.DataFrame()),
-                    data.get("waste", pd.DataFrame())
-                )
-                self.instrumentation.log_event("temp_excursion_detection_complete", {
-                    "sites_with_excursions": len(temp_excursions)
-                })
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    features_future = executor.submit(compute_site_features, data)
+                    waste_future = executor.submit(self._analyze_waste_and_excursions, data)
+                    
+                    site_features = features_future.result()
+                    self.instrumentation.log_event("feature_computation_complete", {
+                        "num_sites": len(site_features)
+                    })
+                    
+                    waste_analysis, temp_excursions = waste_future.result()
+                    self.instrumentation.log_event("waste_analysis_complete", {
+                        "total_waste": waste_analysis.get("total_waste", 0)
+                    })
+                    self.instrumentation.log_event("temp_excursion_detection_complete", {
+                        "sites_with_excursions": len(temp_excursions)
+                    })
                 
                 # Step 3-5: Process sites with hybrid optimizations
                 results = []
@@ -273,86 +749,65 @@ class Orchestrator:
                 }
                 
                 # Sort sites by priority (urgency_score descending, days_to_expiry ascending)
-                sites_list = list(site_features.iterrows())
-                sites_list.sort(key=lambda x: (-x[1]["urgency_score"], x[1]["days_to_expiry"]))
+                # (np.lexsort is stable and treats its last key as the primary one)
+                priority_order = np.lexsort((
+                    site_features["days_to_expiry"].to_numpy(),
+                    -site_features["urgency_score"].to_numpy()
+                ))
+                sorted_sites = site_features.iloc[priority_order]
+                # Plain (index, record) pairs; records are built once here and
+                # passed as dicts to the rules engine and LLM calls
+                records = sorted_sites.to_dict(orient="records")
+                sites_list = list(zip(sorted_sites.index, records))
                 
                 # Separate sites into LLM-priority and rules-only
-                llm_sites = []
-                rules_sites = []
+                use_llm = self._classify_sites(sorted_sites).to_numpy()
+                llm_sites = [site for site, flag in zip(sites_list, use_llm) if flag]
+                rules_sites = [site for site, flag in zip(sites_list, use_llm) if not flag]
                 
-                for row_idx, row in sites_list:
-                    if self._should_use_llm(row):
-                        llm_sites.append((row_idx, row))
-                    else:
-                        rules_sites.append((row_idx, row))
+                # Medium-urgency LLM sites can wait for a discounted batch job
+                batch_job_sites = []
+                if self.use_batch_jobs:
+                    urgency = sorted_sites["urgency_score"].to_numpy()
+                    deferred = (
+                        use_llm
+                        & (urgency >= Config.LLM_BATCH_THRESHOLD)
+                        & (urgency < Config.LLM_PRIORITY_THRESHOLD)
+                    )
+                    llm_sites = [site for site, flag in zip(sites_list, use_llm & ~deferred) if flag]
+                    batch_job_sites = [site for site, flag in zip(sites_list, deferred) if flag]
                 
                 self.instrumentation.log_event("site_classification", {
                     "llm_sites": len(llm_sites),
+                    "batch_job_sites": len(batch_job_sites),
                     "rules_sites": len(rules_sites),
                     "total_sites": len(sites_list)
                 })
                 
+                # Submit the batch job without waiting for it: its sites get rules
+                # results now, replaced by the job's answers when it finishes
+                batch_job_name = None
+                if batch_job_sites:
+                    batch_job_name, batch_job_results, batch_job_sites = self._start_batch_job(
+                        batch_job_sites, initial_context_stats
+                    )
+                    results.extend(batch_job_results)
+                    if batch_job_name:
+                        for row_idx, row in batch_job_sites:
+                            result = self._process_site_with_rules(row, row["site_id"])
+                            result["batch_job"] = {"name": batch_job_name, "status": "pending"}
+                            results.append(result)
+                
                 # Process LLM-priority sites
-                if llm_sites:
-                    if self.use_batch_api and self.batch_api_size > 1:
-                        # Process in batches using batch API
-                        for batch_idx in range(0, len(llm_sites), self.batch_api_size):
-                            batch = llm_sites[batch_idx:batch_idx + self.batch_api_size]
-                            batch_num = (batch_idx // self.batch_api_size) + 1
-                            
-                            self.instrumentation.log_event("processing_llm_batch", {
-                                "batch_number": batch_num,
-                                "batch_size": len(batch)
-                            })
-                            
-                            batch_start = datetime.now()
-                            batch_results = self._process_sites_batch_llm(batch, initial_context_stats)
-                            batch_latency = (datetime.now() - batch_start).total_seconds() * 1000
-                            
-                            # Add batch results to main results
-                            for batch_result in batch_results:
-                                batch_result["latency_ms"] = round(batch_latency / len(batch), 2)
-                                results.append(batch_result)
-                            
-                            # Rate limiting delay between batches
-                            if batch_idx + self.batch_api_size < len(llm_sites):
-                                time.sleep(self.chunk_delay)
-                    else:
-                        # Process individually (with optional parallel processing)
-                        if self.use_parallel and self.rate_limiter:
-                            # Parallel processing with rate limiting
-                            def process_with_rate_limit(site_tuple):
-                                row_idx, row = site_tuple
-                                site_id = row["site_id"]
-                                with self.rate_limiter:
-                                    return self._process_site_individual_llm(row, site_id, initial_context_stats)
-                            
-                            with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
-                                future_to_site = {
-                                    executor.submit(process_with_rate_limit, site): site
-                                    for site in llm_sites
-                                }
-                                
-                                for future in as_completed(future_to_site):
-                                    try:
-                                        result = future.result()
-                                        results.append(result)
-                                    except Exception as e:
-                                        site_tuple = future_to_site[future]
-                                        row_idx, row = site_tuple
-                                        site_id = row["site_id"]
-                                        print(f"Error processing {site_id} in parallel: {e}")
-                                        results.append(self._process_site_with_rules(row, site_id))
-                        else:
-                            # Sequential individual processing
-                            for row_idx, row in llm_sites:
-                                site_id = row["site_id"]
-                                result = self._process_site_individual_llm(row, site_id, initial_context_stats)
-                                results.append(result)
+                results.extend(self._process_llm_sites(llm_sites, initial_context_stats))
+                
+                # Sites whose batch job could not be submitted go through the live API
+                if not batch_job_name:
+                    results.extend(self._process_llm_sites(batch_job_sites, initial_context_stats))
                 
                 # Process rules-only sites (fast, no API calls)
                 if rules_sites:
-                    if self.use_parallel and self.rate_limiter:
+                    if self.use_parallel:
                         # Parallel processing for rules-only sites
                         def process_rules_site(site_tuple):
                             row_idx, row = site_tuple
@@ -382,88 +837,48 @@ class Orchestrator:
                             results.append(result)
                 
                 # Enrich all results with additional data (waste, temp excursions, etc.)
-                for result in results:
-                    site_id = result["site_id"]
-                    # Find corresponding row
-                    row = None
-                    for row_idx, r in sites_list:
-                        if r["site_id"] == site_id:
-                            row = r
-                            break
-                    
-                    if row is None:
-                        continue
-                    
-                    # Get site-specific waste and temp excursion data
-                    site_waste = waste_analysis.get("waste_by_site", {}).get(site_id, {})
-                    site_excursions = temp_excursions.get(site_id, {})
-                    
-                    # Generate temp excursion justification if needed
-                    temp_justification = None
-                    if site_excursions.get("total_excursions", 0) > 0 and self.llm_available:
-                        try:
-                            recent_exc = site_excursions.get("recent_excursions", [])
-                            if recent_exc:
-                                latest_exc = recent_exc[-1]
-                                exc_date_str = latest_exc.get("date", datetime.now().strftime("%Y-%m-%d"))
-                                if isinstance(exc_date_str, str):
-                                    exc_date = datetime.strptime(exc_date_str, "%Y-%m-%d")
-                                else:
-                                    exc_date = exc_date_str
-                                temp_justification = self.temp_excursion_handler.generate_justification(
-                                    site_excursions,
-                                    site_id,
-                                    row.get("site_name", "Unknown"),
-                                    latest_exc.get("quantity_affected", 0),
-                                    exc_date,
-                                    latest_exc.get("temperature")
-                                )
-                        except Exception as e:
-                            print(f"Warning: Could not generate LLM justification for temp excursion: {e}")
-                            temp_justification = None
-                    
-                    # Enrich result with full data
-                    result.update({
-                        "site_name": row.get("site_name", "Unknown"),
-                        "region": row.get("region", "Unknown"),
-                        "projected_30d_demand": int(row["projected_30d_demand"]),
-                        "current_inventory": int(row["current_inventory"]),
-                        "weekly_dispense_kits": float(row["weekly_dispense_kits"]),
-                        "days_to_expiry": int(row["days_to_expiry"]),
-                        "urgency_score": float(row["urgency_score"]),
-                        "llm": result.get("gemini_result", {}),
-                        "predicted_30d_enrollment": int(row.get("predicted_30d_enrollment", 0)),
-                        "enrollment_trend": row.get("enrollment_trend", "unknown"),
-                        "screen_fail_rate": float(row.get("screen_fail_rate", 0.30)),
-                        "waste_data": {
-                            "total_waste": site_waste.get("total_waste", 0),
-                            "waste_by_reason": site_waste.get("waste_by_reason", {})
-                        },
-                        "temp_excursions": {
-                            "total_excursions": site_excursions.get("total_excursions", 0),
-                            "total_quantity_affected": site_excursions.get("total_quantity_affected", 0),
-                            "excursion_rate": site_excursions.get("excursion_rate", 0.0),
-                            "justification": temp_justification
-                        }
-                    })
-                    
-                    # Log to AgentOps
-                    self.instrumentation.log_event("site_processed", {
-                        "site_id": site_id,
-                        "action": result["action"],
-                        "quantity": result["quantity"],
-                        "confidence": result.get("confidence", 0.5),
-                        "projected_demand": int(row["projected_30d_demand"]),
-                        "latency_ms": result.get("latency_ms", 0.0),
-                        "llm_used": result.get("llm_used", False)
-                    })
-                
-                # Step 6: Save to JSONL
+                row_by_id = {r["site_id"]: r for _, r in sites_list}
+                waste_by_site = waste_analysis.get("waste_by_site") or _EMPTY
+                temp_justifications = self._temp_excursion_justifications(results, row_by_id, temp_excursions)
                 if output_path:
                     output_path.parent.mkdir(parents=True, exist_ok=True)
-                    with open(output_path, 'w') as f:
-                        for result in results:
-                            f.write(json.dumps(result) + '\n')
+                with (open(output_path, "w", buffering=1 << 20) if output_path else nullcontext()) as output_file:
+                    for result_num, result in enumerate(results, 1):
+                        site_id = result["site_id"]
+                        row = row_by_id.get(site_id)
+                        if row is None:
+                            if output_file:
+                                self._write_result(output_file, result, result_num)
+                            continue
+                        
+                        self._enrich_result(
+                            result,
+                            row,
+                            waste_by_site.get(site_id) or _EMPTY,
+                            temp_excursions.get(site_id) or _EMPTY,
+                            temp_justifications.get(site_id)
+                        )
+                        
+                        # Log to AgentOps
+                        self.instrumentation.log_event("site_processed", {
+                            "site_id": site_id,
+                            "action": result["action"],
+                            "quantity": result["quantity"],
+                            "confidence": result.get("confidence", 0.5),
+                            "projected_demand": int(row["projected_30d_demand"]),
+                            "latency_ms": result.get("latency_ms", 0.0),
+                            "llm_used": result.get("llm_used", False)
+                        })
+                        
+                        # Step 6: Save to JSONL as each result is ready
+                        if output_file:
+                            self._write_result(output_file, result, result_num)
+                
+                # The output file is complete; the job's answers are merged into it later
+                if batch_job_name:
+                    self.batch_job_merge = self._start_batch_job_merge(
+                        batch_job_name, batch_job_sites, initial_context_stats, output_path
+                    )
                 
                 # Step 7: Depot optimization (if depot data available)
                 depot_optimization = None
@@ -496,6 +911,11 @@ class Orchestrator:
                     "sites_affected": len(temp_excursions),
                     "total_excursions": sum(s.get("total_excursions", 0) for s in temp_excursions.values())
                 }
+                if batch_job_name:
+                    summary["batch_job"] = {
+                        "name": batch_job_name,
+                        "pending_sites": len(batch_job_sites)
+                    }
                 if depot_optimization:
                     summary["depot_optimization"] = {
                         "total_allocated": depot_optimization.get("total_allocated", 0),
@@ -519,6 +939,96 @@ class Orchestrator:
                 })
                 raise
     
+    def _enrich_result(
+        self,
+        result: Dict[str, Any],
+        row: Dict[str, Any],
+        site_waste: Dict[str, Any],
+        site_excursions: Dict[str, Any],
+        temp_justification: Optional[str]
+    ) -> None:
+        """
+        Add site features, waste and temperature excursion data to a result in place.
+        
+        Pure dictionary work with no I/O, so each site's enrichment is independent.
+        """
+        result.update({
+            "site_name": row.get("site_name", "Unknown"),
+            "region": row.get("region", "Unknown"),
+            "projected_30d_demand": int(row["projected_30d_demand"]),
+            "current_inventory": int(row["current_inventory"]),
+            "weekly_dispense_kits": float(row["weekly_dispense_kits"]),
+            "days_to_expiry": int(row["days_to_expiry"]),
+            "urgency_score": float(row["urgency_score"]),
+            "llm": result.get("gemini_result", {}),
+            "predicted_30d_enrollment": int(row.get("predicted_30d_enrollment", 0)),
+            "enrollment_trend": row.get("enrollment_trend", "unknown"),
+            "screen_fail_rate": float(row.get("screen_fail_rate", 0.30)),
+            "waste_data": {
+                "total_waste": site_waste.get("total_waste", 0),
+                "waste_by_reason": site_waste.get("waste_by_reason", {})
+            },
+            "temp_excursions": {
+                "total_excursions": site_excursions.get("total_excursions", 0),
+                "total_quantity_affected": site_excursions.get("total_quantity_affected", 0),
+                "excursion_rate": site_excursions.get("excursion_rate", 0.0),
+                "justification": temp_justification
+            }
+        })
+    
+    def _temp_excursion_justifications(
+        self,
+        results: List[Dict[str, Any]],
+        row_by_id: Dict[str, Dict[str, Any]],
+        temp_excursions: Dict[str, Any]
+    ) -> Dict[str, str]:
+        """Generate justifications for every processed site with excursions, in batched LLM calls."""
+        if not self.llm_available:
+            return {}
+        
+        cases = []
+        for result in results:
+            site_id = result["site_id"]
+            row = row_by_id.get(site_id)
+            site_excursions = temp_excursions.get(site_id) or _EMPTY
+            if row is None or site_excursions.get("total_excursions", 0) <= 0:
+                continue
+            try:
+                recent_exc = site_excursions.get("recent_excursions", [])
+                if recent_exc:
+                    latest_exc = recent_exc[-1]
+                    exc_date_str = latest_exc.get("date", datetime.now().strftime("%Y-%m-%d"))
+                    if isinstance(exc_date_str, str):
+                        exc_date = datetime.strptime(exc_date_str, "%Y-%m-%d")
+                    else:
+                        exc_date = exc_date_str
+                    cases.append({
+                        "excursion_data": site_excursions,
+                        "site_id": site_id,
+                        "site_name": row.get("site_name", "Unknown"),
+                        "quantity_affected": latest_exc.get("quantity_affected", 0),
+                        "date": exc_date,
+                        "temperature": latest_exc.get("temperature")
+                    })
+            except Exception as e:
+                print(f"Warning: Could not generate LLM justification for temp excursion: {e}")
+        
+        if not cases:
+            return {}
+        try:
+            return self.temp_excursion_handler.batch_generate_justifications(cases)
+        except Exception as e:
+            print(f"Warning: Could not generate LLM justifications for temp excursions: {e}")
+            return {}
+    
+    def _write_result(self, output_file, result: Dict[str, Any], result_num: int) -> None:
+        """Append one result to the JSONL output, syncing to disk every _FSYNC_EVERY records."""
+        output_file.write(json.dumps(result))
+        output_file.write("\n")
+        if result_num % _FSYNC_EVERY == 0:
+            output_file.flush()
+            os.fsync(output_file.fileno())
+    
     def _compute_summary(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Compute summary statistics from results."""
         if not results:
@@ -559,8 +1069,13 @@ class Orchestrator:
                 "rules_sites": rules_sites_count,
                 "llm_percentage": round((llm_sites_count / total_sites * 100) if total_sites > 0 else 0, 2),
                 "batch_api_used": self.use_batch_api,
+                "batch_jobs_used": self.use_batch_jobs,
                 "parallel_processing_used": self.use_parallel,
-                "selective_llm_used": self.use_selective_llm
+                "selective_llm_used": self.use_selective_llm,
+                "llm_cache_hits": self.llm_cache_hits,
+                "llm_cache_hit_rate": round(
+                    (self.llm_cache_hits / self.llm_cache_lookups * 100) if self.llm_cache_lookups > 0 else 0, 2
+                )
             }
         }
 
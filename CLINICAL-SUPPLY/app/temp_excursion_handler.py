@@ -1,15 +1,34 @@
 from typing import Dict, Any, List, Optional
+import orjson
 import pandas as pd
 from datetime import datetime, timedelta
 from app.gemini_client import GeminiClient
 from app.config import Config
 
 
+# Incidents per batched justification call; larger prompts lose detail per incident
+_MAX_BATCH_JUSTIFICATIONS = 16
+
+# Seconds to wait for an LLM justification before falling back to the template
+_JUSTIFICATION_TIMEOUT = 10
+
+
 class TempExcursionHandler:
     """Handles temperature excursion detection and regulatory justification."""
     
-    def __init__(self):
-        """Initialize temperature excursion handler."""
+    def __init__(self, gemini_client: Optional[GeminiClient] = None):
+        """
+        Initialize temperature excursion handler.
+        
+        Args:
+            gemini_client: Client to share (and its connection pool); one is
+                created if not given
+        """
+        if gemini_client is not None:
+            self.gemini_client = gemini_client
+            self.llm_available = True
+            return
+        
         # Initialize Gemini client with error handling - make it optional
         try:
             self.gemini_client = GeminiClient()
@@ -178,10 +197,9 @@ Format as a professional regulatory document suitable for FDA/EMA submission.
                 if not api_key:
                     raise Exception("No available API keys")
                 params = {"key": api_key}
-                import requests
-                # Use shorter timeout for temp excursion (10 seconds) to fail fast
-                timeout = 10  # Shorter timeout for temp excursion justifications
-                response = requests.post(url, params=params, json=payload, timeout=timeout)
+                # Use shorter timeout for temp excursion to fail fast
+                # Reuse the Gemini client's pooled connections
+                response = self.gemini_client.session.post(url, params=params, json=payload, timeout=_JUSTIFICATION_TIMEOUT)
                 response.raise_for_status()
                 result = response.json()
                 
@@ -199,6 +217,94 @@ Format as a professional regulatory document suitable for FDA/EMA submission.
             site_id, site_name, quantity_affected, date, temperature, excursion_data
         )
     
+    def batch_generate_justifications(self, cases: List[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        Generate regulatory justifications for several sites' excursions,
+        sharing one LLM call per group of up to _MAX_BATCH_JUSTIFICATIONS
+        incidents.
+        
+        Args:
+            cases: List of dicts with the generate_justification arguments:
+                excursion_data, site_id, site_name, quantity_affected, date,
+                temperature (optional)
+            
+        Returns:
+            Justification text by site_id; sites the LLM did not cover get
+            the template-based justification
+        """
+        justifications = {}
+        if self.llm_available and self.gemini_client:
+            for start in range(0, len(cases), _MAX_BATCH_JUSTIFICATIONS):
+                group = cases[start:start + _MAX_BATCH_JUSTIFICATIONS]
+                try:
+                    justifications.update(self._generate_llm_justifications(group))
+                except Exception as e:
+                    print(f"Error generating batched LLM justifications: {e}. Using template-based justifications.")
+        
+        for case in cases:
+            if case["site_id"] not in justifications:
+                justifications[case["site_id"]] = self._generate_template_justification(
+                    case["site_id"],
+                    case["site_name"],
+                    case["quantity_affected"],
+                    case["date"],
+                    case.get("temperature"),
+                    case["excursion_data"]
+                )
+        return justifications
+    
+    def _generate_llm_justifications(self, cases: List[Dict[str, Any]]) -> Dict[str, str]:
+        """Ask the LLM for one justification per case in a single call."""
+        incidents = []
+        for idx, case in enumerate(cases, 1):
+            temperature = case.get("temperature")
+            excursion_data = case["excursion_data"]
+            incidents.append(f"""**Incident {idx}: {case['site_id']}**
+- Site Name: {case['site_name']}
+- Date: {case['date'].strftime('%Y-%m-%d')}
+- Quantity Affected: {case['quantity_affected']} kits
+- Temperature: {temperature if temperature else 'Not recorded'}°C
+- Total Excursions at Site: {excursion_data.get('total_excursions', 0)}
+- Site Excursion Rate: {excursion_data.get('excursion_rate', 0.0):.2%}
+""")
+        
+        incident_text = "\n".join(incidents)
+        prompt = f"""You are a regulatory affairs expert for clinical supply chain. Generate a professional temperature excursion justification document for each incident below. The acceptable range for all sites is 2-8°C (standard cold chain).
+
+{incident_text}
+**Requirements:**
+Each justification must be regulatory-compliant and include:
+1. Root cause analysis
+2. Impact assessment on product quality
+3. Corrective and preventive actions (CAPA)
+4. Regulatory compliance statement
+5. Product stability data reference (if applicable)
+
+Format each as a professional regulatory document suitable for FDA/EMA submission.
+
+**Required JSON Response:**
+{{
+  "justifications": [
+    {{"site_id": "site ID from the incident heading", "justification": "full justification document"}}
+  ]
+}}
+
+Return ONLY valid JSON, no other text."""
+        
+        response = self.gemini_client.generate_content(prompt, timeout=_JUSTIFICATION_TIMEOUT)
+        try:
+            text = response["candidates"][0]["content"]["parts"][0]["text"]
+            items = orjson.loads(text)["justifications"]
+        except (KeyError, IndexError, TypeError, orjson.JSONDecodeError) as e:
+            raise ValueError(f"Invalid batched justification response: {e}")
+        
+        site_ids = {case["site_id"] for case in cases}
+        return {
+            item["site_id"]: item["justification"]
+            for item in items
+            if isinstance(item, dict) and item.get("site_id") in site_ids and item.get("justification")
+        }
+    
     def _generate_template_justification(
         self,
         site_id: str,
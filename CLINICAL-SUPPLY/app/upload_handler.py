@@ -1,4 +1,6 @@
+import asyncio
 import csv
+import logging
 import shutil
 import inspect
 import io
@@ -15,6 +17,8 @@ try:
 except ImportError:
     CHARDET_AVAILABLE = False
 
+logger = logging.getLogger(__name__)
+
 
 class UploadValidationError(Exception):
     """Raised when uploaded files fail validation."""
@@ -134,9 +138,6 @@ def validate_saved_file(file_path: Path) -> Tuple[bool, str]:
     Returns:
         Tuple of (is_valid, error_message)
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
     try:
         # Check file exists
         if not file_path.exists():
@@ -178,6 +179,63 @@ def validate_saved_file(file_path: Path) -> Tuple[bool, str]:
         return False, f"Validation error: {e}"
 
 
+# Chunk size for streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+async def _write_async_upload(file_obj: Any, file_path: Path, filename: str) -> None:
+    """
+    Stream an async file object (e.g. FastAPI UploadFile) to disk in chunks.
+    
+    UTF-16 files (detected by BOM) are read fully and re-encoded as UTF-8;
+    other files are saved byte for byte, whatever their size.
+    
+    Args:
+        file_obj: File object with an async read() method
+        file_path: Destination path
+        filename: Original filename (for logging)
+    """
+    head = await file_obj.read(UPLOAD_CHUNK_SIZE)
+    
+    # UTF-16 needs the whole file to re-encode as UTF-8 before saving
+    if head.startswith(b'\xff\xfe') or head.startswith(b'\xfe\xff'):
+        content = head + await file_obj.read()
+        logger.warning(f"{filename} appears to be UTF-16 ({len(content)} bytes), attempting to fix...")
+        try:
+            # Try to decode and re-encode as UTF-8
+            decoded = None
+            for enc in ['utf-16-le', 'utf-16-be', 'utf-16', 'utf-8', 'latin-1']:
+                try:
+                    decoded = content.decode(enc, errors='replace')
+                    logger.info(f"Successfully decoded {filename} with {enc}")
+                    break
+                except UnicodeDecodeError:
+                    continue
+            
+            if decoded:
+                # Re-encode as UTF-8
+                content = decoded.encode('utf-8', errors='replace')
+                logger.info(f"Re-encoded {filename} to UTF-8, new size: {len(content)} bytes")
+        except Exception as e:
+            logger.warning(f"Could not fix encoding for {filename}: {e}, saving as-is")
+        
+        await asyncio.to_thread(file_path.write_bytes, content)
+        return
+    
+    # File I/O runs in a worker thread so a slow disk doesn't stall the event loop
+    size = 0
+    f = await asyncio.to_thread(open, file_path, 'wb')
+    try:
+        chunk = head
+        while chunk:
+            await asyncio.to_thread(f.write, chunk)
+            size += len(chunk)
+            chunk = await file_obj.read(UPLOAD_CHUNK_SIZE)
+    finally:
+        await asyncio.to_thread(f.close)
+    logger.info(f"Saved {filename}: {size} bytes")
+
+
 async def save_uploaded_files(
     uploaded_files: Dict[str, Any],
     upload_dir: Path
@@ -192,9 +250,6 @@ async def save_uploaded_files(
     Returns:
         Dictionary mapping CSV key to saved file path
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
     upload_dir.mkdir(parents=True, exist_ok=True)
     saved_paths = {}
     
@@ -211,51 +266,8 @@ async def save_uploaded_files(
             )
             
             if is_async_read or isinstance(file_obj, UploadFile):
-                # FastAPI UploadFile object - async read
-                content = await file_obj.read()
-                
-                # DEBUG: Log file info
-                logger.info(f"Saving {filename}: {len(content)} bytes")
-                if len(content) > 0:
-                    # Check first 100 bytes
-                    first_bytes = content[:min(100, len(content))]
-                    logger.info(f"First 100 bytes (hex): {first_bytes.hex()[:200]}")
-                    # Try to decode and show first line
-                    for enc in ['utf-8', 'latin-1', 'utf-16-le']:
-                        try:
-                            sample = first_bytes.decode(enc, errors='strict')
-                            logger.info(f"Decoded with {enc}: {sample[:50]}")
-                            break
-                        except:
-                            continue
-                
-                # Try to detect and fix encoding issues before saving
-                try:
-                    # Try to detect if file is UTF-16 or other problematic encoding
-                    is_utf16 = content.startswith(b'\xff\xfe') or content.startswith(b'\xfe\xff')
-                    
-                    if is_utf16 or len(content) > 50000:  # Suspiciously large for CSV
-                        logger.warning(f"{filename} appears to be UTF-16 or oversized ({len(content)} bytes), attempting to fix...")
-                        
-                        # Try to decode and re-encode as UTF-8
-                        decoded = None
-                        for enc in ['utf-16-le', 'utf-16-be', 'utf-16', 'utf-8', 'latin-1']:
-                            try:
-                                decoded = content.decode(enc, errors='replace')
-                                logger.info(f"Successfully decoded {filename} with {enc}")
-                                break
-                            except:
-                                continue
-                        
-                        if decoded:
-                            # Re-encode as UTF-8
-                            content = decoded.encode('utf-8', errors='replace')
-                            logger.info(f"Re-encoded {filename} to UTF-8, new size: {len(content)} bytes")
-                except Exception as e:
-                    logger.warning(f"Could not fix encoding for {filename}: {e}, saving as-is")
-                
-                with open(file_path, 'wb') as f:
-                    f.write(content)
+                # FastAPI UploadFile object - async read, streamed to disk
+                await _write_async_upload(file_obj, file_path, filename)
                 # Reset file pointer if needed (check if seek is async)
                 if hasattr(file_obj, 'seek'):
                     try:
@@ -323,9 +335,6 @@ def load_uploaded_csvs(upload_dir: Path) -> Dict[str, pd.DataFrame]:
             missing_files.append(filename)
         else:
             try:
-                import logging
-                logger = logging.getLogger(__name__)
-                
                 df = None
                 last_error = None
                 encoding_attempts = []
@@ -638,8 +647,6 @@ def load_uploaded_csvs(upload_dir: Path) -> Dict[str, pd.DataFrame]:
                 df.columns = df.columns.str.strip()
                 
                 # Log columns for debugging
-                import logging
-                logger = logging.getLogger(__name__)
                 logger.info(f"Successfully loaded {filename} with columns: {list(df.columns)}")
                 logger.info(f"DataFrame shape: {df.shape}, first row: {df.head(1).to_dict() if not df.empty else 'EMPTY'}")
                 
@@ -734,9 +741,6 @@ def validate_csv_columns(dataframes: Dict[str, pd.DataFrame]) -> None:
         "waste": ["site_id"],  # Flexible - accept any waste columns
     }
     
-    import logging
-    logger = logging.getLogger(__name__)
-    
     for key, df in dataframes.items():
         if key in required_columns:
             filename = Config.REQUIRED_CSV_FILES[key]
@@ -12,6 +12,7 @@ from datetime import datetime
 
 import websockets
 from websockets.client import connect
+from websockets.protocol import State
 
 # Import supply agent modules to use returned results
 from app.depot_optimizer import DepotOptimizer
@@ -51,8 +52,14 @@ class RecruitmentAgentClient:
         """Disconnect from the recruitment agent"""
         if self.websocket:
             await self.websocket.close()
+            self.websocket = None
             logger.info("Disconnected from recruitment agent")
     
+    @property
+    def is_connected(self) -> bool:
+        """Whether the websocket connection is open"""
+        return self.websocket is not None and self.websocket.state is State.OPEN
+    
     async def _call_method(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """Call a method on the recruitment agent via JSON-RPC"""
         if not self.websocket:
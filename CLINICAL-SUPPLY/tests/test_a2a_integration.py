@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app import a2a_integration
+from app.a2a_integration import extract_enrollment_curve_from_supply_data
+
+
+@pytest.fixture
+def weekly_enrollment_df():
+    """Weekly enrollment rows with missing sites, values and fail rates."""
+    return pd.DataFrame({
+        "site_id": ["SITE_002", "SITE_001", "SITE_002", None, "SITE_003", "SITE_001", "SITE_004"],
+        "weekly_enrollment": [4.0, 2.5, np.nan, 9.0, 1.0, 3.5, np.nan],
+        "screen_fail_rate": [0.2, np.nan, 0.4, 0.1, 0.3, 0.25, np.nan],
+    })
+
+
+@pytest.mark.parametrize("agg", [
+    pytest.param(a2a_integration._agg_site_means, id="active"),
+    pytest.param(a2a_integration._agg_site_means_kernel, id="kernel-python"),
+    pytest.param(a2a_integration._agg_site_means_numpy, id="numpy-fallback"),
+])
+def test_agg_site_means_matches_pandas_groupby(agg, weekly_enrollment_df):
+    """Test the single-pass site aggregation against the pandas groupby it replaced."""
+    df = weekly_enrollment_df
+    codes, uniques = pd.factorize(df["site_id"])
+    
+    total, mean_fail = agg(
+        codes.astype(np.int64),
+        df["weekly_enrollment"].to_numpy(dtype=np.float64),
+        df["screen_fail_rate"].to_numpy(dtype=np.float64),
+        len(uniques)
+    )
+    
+    assert total == pytest.approx(df.groupby("site_id")["weekly_enrollment"].mean().sum())
+    assert mean_fail == pytest.approx(df["screen_fail_rate"].mean())
+
+
+def test_weekly_enrollment_curve_matches_groupby_result(weekly_enrollment_df):
+    """Test the weekly_enrollment curve against the original groupby computation."""
+    df = weekly_enrollment_df
+    monthly = int(df.groupby("site_id")["weekly_enrollment"].mean().sum() * 4.348)
+    expected = int(monthly * (1 - df["screen_fail_rate"].mean()))
+    
+    assert extract_enrollment_curve_from_supply_data(df, months=3) == [expected] * 3
+
+
+def test_enrollment_date_curve_matches_period_groupby():
+    """Test integer month buckets against grouping by calendar month periods."""
+    df = pd.DataFrame({
+        "enrollment_date": ["2024-01-03", "2024-01-28", "2024-03-15", None, "2024-06-01", "2024-06-30", "2024-12-31"],
+        "subject_count": [2, 3, 7, 5, np.nan, 4, 1],
+    })
+    dates = pd.to_datetime(df["enrollment_date"])
+    expected = int(df.groupby(dates.dt.to_period("M"))["subject_count"].sum().mean())
+    
+    assert extract_enrollment_curve_from_supply_data(df, months=4) == [expected] * 4
@@ -0,0 +1,71 @@
+import pytest
+from app.orchestrator import AdaptiveBatchSizer
+
+
+def make_sizer(size: int = 4, max_size: int = 16, budget_ms: float = 1000.0) -> AdaptiveBatchSizer:
+    """Sizer without random exploration, so choices are deterministic."""
+    return AdaptiveBatchSizer(size, max_size, budget_ms, epsilon=0.0)
+
+
+def test_choose_size_tries_untried_neighbour_first():
+    """Test that an unsampled neighbour is tried before a sampled one, larger first."""
+    sizer = make_sizer()
+    sizer.throughput_ema = {4: 10.0}
+    
+    assert sizer._choose_size() == 8
+
+
+def test_choose_size_does_not_explore_smaller_size_deterministically():
+    """Test that an unsampled smaller size is left to epsilon exploration."""
+    sizer = make_sizer()
+    sizer.throughput_ema = {4: 10.0, 8: 5.0}
+    
+    assert sizer._choose_size() == 4
+
+
+def test_choose_size_moves_to_higher_throughput():
+    """Test that a clearly faster neighbour is chosen."""
+    sizer = make_sizer()
+    sizer.throughput_ema = {2: 5.0, 4: 10.0, 8: 20.0}
+    
+    assert sizer._choose_size() == 8
+
+
+def test_choose_size_keeps_current_size_on_ties():
+    """Test that a neighbour within the tie tolerance does not move the size."""
+    sizer = make_sizer()
+    sizer.throughput_ema = {2: 10.3, 4: 10.0, 8: 10.2}
+    
+    assert sizer._choose_size() == 4
+
+
+def test_choose_size_skips_sizes_over_latency_budget():
+    """Test that a size whose p95 latency exceeds the budget is not chosen."""
+    sizer = make_sizer(budget_ms=500.0)
+    sizer.throughput_ema = {2: 5.0, 4: 10.0, 8: 20.0}
+    sizer.samples.extend([(8, 900.0, True), (4, 400.0, True), (2, 200.0, True)])
+    
+    assert sizer._choose_size() == 4
+
+
+def test_choose_size_falls_back_to_smallest_when_all_over_budget():
+    """Test that the smallest candidate is used when none fits the budget."""
+    sizer = make_sizer(budget_ms=100.0)
+    sizer.throughput_ema = {2: 5.0, 4: 10.0, 8: 20.0}
+    sizer.samples.extend([(8, 900.0, True), (4, 400.0, True), (2, 200.0, True)])
+    
+    assert sizer._choose_size() == 2
+
+
+@pytest.mark.parametrize("initial_size", [1, 4, 8, 16])
+def test_flat_throughput_does_not_drift_to_size_one(initial_size):
+    """Test that latency proportional to batch size never shrinks the batch to 1."""
+    sizer = make_sizer(size=initial_size, budget_ms=30000.0)
+    remaining = 50
+    
+    while remaining:
+        batch_size = min(sizer.size, remaining)
+        sizer.record(batch_size, batch_size * 100.0, True)
+        remaining -= batch_size
+    
+    assert sizer.size > 1
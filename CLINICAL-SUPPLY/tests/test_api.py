@@ -0,0 +1,26 @@
+import asyncio
+from datetime import datetime
+import pytest
+from fastapi import HTTPException
+from app.api import _parse_date, generate_temp_justification
+
+
+def test_parse_date_accepts_padded_and_unpadded_dates():
+    """Test that YYYY-MM-DD dates parse with or without zero padding."""
+    assert _parse_date("2024-01-05") == datetime(2024, 1, 5)
+    assert _parse_date("2024-1-5") == datetime(2024, 1, 5)
+
+
+@pytest.mark.parametrize("value", ["2024-01-05T10:00:00", "20240105", "2024-13-01", "05/01/2024"])
+def test_parse_date_rejects_other_formats(value):
+    """Test that anything other than a YYYY-MM-DD date raises ValueError."""
+    with pytest.raises(ValueError):
+        _parse_date(value)
+
+
+def test_temp_justification_rejects_invalid_date_with_422():
+    """Test that a malformed date is a client error, raised before any data is loaded."""
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(generate_temp_justification("SITE_001", 3, "2024-13-01"))
+    
+    assert excinfo.value.status_code == 422
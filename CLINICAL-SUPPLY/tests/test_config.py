@@ -0,0 +1,68 @@
+import threading
+from collections import deque
+import pytest
+from app.config import Config
+
+
+@pytest.fixture
+def upload_pool(tmp_path, monkeypatch):
+    """Small upload slot pool under a temporary directory."""
+    monkeypatch.setattr(Config, "UPLOAD_BASE_DIR", tmp_path)
+    monkeypatch.setattr(Config, "UPLOAD_SLOT_COUNT", 4)
+    monkeypatch.setattr(Config, "_free_upload_slots", deque())
+    monkeypatch.setattr(Config, "_upload_slots_in_use", set())
+    monkeypatch.setattr(Config, "_upload_slot_root", None)
+    Config.provision_upload_slots()
+    return tmp_path
+
+
+def test_released_slot_is_cleared_and_reused(upload_pool):
+    """Test that a released slot is emptied and handed out again only after release."""
+    upload_dir = Config.acquire_upload_dir()
+    (upload_dir / "results.jsonl").write_text("{}")
+    others = [Config.acquire_upload_dir() for _ in range(3)]
+    
+    assert upload_dir not in others
+    with pytest.raises(RuntimeError):
+        Config.acquire_upload_dir()
+    assert (upload_dir / "results.jsonl").exists()
+    
+    Config.release_upload_dir(upload_dir)
+    
+    assert list(upload_dir.iterdir()) == []
+    assert Config.acquire_upload_dir() == upload_dir
+
+
+def test_release_ignores_slot_not_in_use(upload_pool):
+    """Test that releasing twice does not put a slot in the pool twice."""
+    upload_dir = Config.acquire_upload_dir()
+    Config.release_upload_dir(upload_dir)
+    Config.release_upload_dir(upload_dir)
+    
+    acquired = [Config.acquire_upload_dir() for _ in range(4)]
+    
+    assert len(set(acquired)) == 4
+
+
+def test_concurrent_acquire_hands_out_distinct_slots(upload_pool):
+    """Test that threads acquiring at once never share a slot."""
+    acquired = []
+    errors = []
+    barrier = threading.Barrier(6)
+    
+    def acquire():
+        barrier.wait()
+        try:
+            acquired.append(Config.acquire_upload_dir())
+        except RuntimeError as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=acquire) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(acquired) == 4
+    assert len(set(acquired)) == 4
+    assert len(errors) == 2
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from app.depot_optimizer import DepotOptimizer, _safety_stock_kernel, _safety_stock_numpy
+
+
+def greedy_allocation(site_demands, depot_inventory, site_inventory, lead_times, shipping_costs=None):
+    """Reference per-site greedy allocation the optimizer's array version must match."""
+    plan = {"allocations": [], "total_allocated": 0, "unmet_demand": {}, "excess_inventory": {}, "optimization_score": 0.0}
+    net_demands = {
+        site_id: max(0, demand - site_inventory.get(site_id, 0)) for site_id, demand in site_demands.items()
+    }
+    remaining = depot_inventory.copy()
+    for site_id, net_demand in sorted(net_demands.items(), key=lambda x: x[1], reverse=True):
+        if net_demand <= 0:
+            continue
+        candidates = []
+        for depot_id, available in remaining.items():
+            if available <= 0 or site_id not in lead_times.get(depot_id, {}):
+                continue
+            score = lead_times[depot_id][site_id]
+            if shipping_costs and site_id in shipping_costs.get(depot_id, {}):
+                score += shipping_costs[depot_id][site_id] * 0.1
+            candidates.append((depot_id, min(net_demand, available), score))
+        if not candidates:
+            plan["unmet_demand"][site_id] = net_demand
+            continue
+        depot_id, qty, _ = min(candidates, key=lambda x: x[2])
+        plan["allocations"].append({
+            "depot_id": depot_id, "site_id": site_id, "quantity": qty, "lead_time_days": lead_times[depot_id][site_id]
+        })
+        plan["total_allocated"] += qty
+        remaining[depot_id] -= qty
+        if qty < net_demand:
+            plan["unmet_demand"][site_id] = net_demand - qty
+    plan["excess_inventory"] = {depot_id: qty for depot_id, qty in remaining.items() if qty > 0}
+    total_demand = sum(net_demands.values())
+    if total_demand > 0:
+        plan["optimization_score"] = plan["total_allocated"] / total_demand * 100
+    return plan
+
+
+LEAD_TIMES = {
+    "DEPOT_A": {"S1": 7, "S2": 3, "S3": 5, "S4": 2},
+    "DEPOT_B": {"S1": 4, "S2": 3, "S3": 9},
+    "DEPOT_C": {"S4": 1},
+}
+SHIPPING_COSTS = {"DEPOT_A": {"S1": 5.0, "S2": 1.0}, "DEPOT_B": {"S2": 20.0}}
+
+
+@pytest.mark.parametrize("site_demands,depot_inventory,site_inventory,shipping_costs", [
+    ({"S1": 40, "S2": 25, "S3": 25, "S4": 10, "S5": 8}, {"DEPOT_A": 50, "DEPOT_B": 30, "DEPOT_C": 0}, {"S3": 5}, None),
+    ({"S1": 40, "S2": 25, "S3": 25, "S4": 10}, {"DEPOT_A": 20, "DEPOT_B": 30, "DEPOT_C": 4}, {"S1": 50}, SHIPPING_COSTS),
+    ({"S1": 12.5, "S2": 7.25, "S3": 3.5, "S4": 1.75}, {"DEPOT_A": 10, "DEPOT_B": 9, "DEPOT_C": 1}, {}, SHIPPING_COSTS),
+])
+def test_allocation_matches_greedy_reference(site_demands, depot_inventory, site_inventory, shipping_costs):
+    """Test the array allocation gives the same plan as the per-site greedy loop."""
+    expected = greedy_allocation(site_demands, depot_inventory, site_inventory, LEAD_TIMES, shipping_costs)
+    
+    plan = DepotOptimizer().optimize_depot_allocation(
+        site_demands, depot_inventory, site_inventory, LEAD_TIMES, shipping_costs
+    )
+    
+    assert plan["allocations"] == expected["allocations"]
+    assert plan["total_allocated"] == pytest.approx(expected["total_allocated"])
+    assert plan["unmet_demand"] == pytest.approx(expected["unmet_demand"])
+    assert plan["excess_inventory"] == pytest.approx(expected["excess_inventory"])
+    assert plan["optimization_score"] == pytest.approx(expected["optimization_score"])
+
+
+def test_float_demand_is_not_truncated_from_integer_stock():
+    """Test that fractional allocations leave the exact remainder in integer stock."""
+    plan = DepotOptimizer().optimize_depot_allocation(
+        {"S1": 2.5, "S2": 2.5}, {"DEPOT_A": 6}, {}, {"DEPOT_A": {"S1": 1, "S2": 1}}
+    )
+    
+    assert [a["quantity"] for a in plan["allocations"]] == [2.5, 2.5]
+    assert plan["excess_inventory"] == {"DEPOT_A": 1.0}
+
+
+def test_calculate_total_cost_matches_per_allocation_sum():
+    """Test shipping plus placeholder holding cost against a per-allocation loop."""
+    plan = greedy_allocation({"S1": 40, "S2": 25, "S4": 10}, {"DEPOT_A": 50, "DEPOT_B": 30}, {}, LEAD_TIMES)
+    holding_costs = {"DEPOT_A": 0.5, "DEPOT_B": 0.25}
+    expected = sum(
+        SHIPPING_COSTS.get(a["depot_id"], {}).get(a["site_id"], 0.0) * a["quantity"] for a in plan["allocations"]
+    ) + sum(cost * 100 for cost in holding_costs.values())
+    
+    assert DepotOptimizer().calculate_total_cost(plan, SHIPPING_COSTS, holding_costs) == pytest.approx(expected)
+
+
+def test_safety_stock_kernel_matches_numpy_fallback():
+    """Test the numba kernel (run as plain Python here) and the NumPy fallback agree."""
+    avg_demand = np.array([0.0, 3.0, 10.5, 42.0])
+    lead_time = np.array([7.0, 14.0, 3.0, 21.0])
+    cv = np.array([0.2, 0.5, 0.2, 0.1])
+    
+    np.testing.assert_array_equal(
+        _safety_stock_kernel(avg_demand, lead_time, cv, 1.645),
+        _safety_stock_numpy(avg_demand, lead_time, cv, 1.645)
+    )
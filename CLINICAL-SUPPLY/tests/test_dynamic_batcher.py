@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from app.dynamic_batcher import DynamicBatcher
+
+
+class RecordingFlush:
+    """flush_fn that records each batch and doubles its items."""
+    
+    def __init__(self, delay: float = 0.0):
+        self.batches = []
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+    
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        return [item * 2 for item in items]
+
+
+@pytest.mark.asyncio
+async def test_flushes_when_max_size_reached():
+    """Test that a full batch is flushed without waiting for the timeout."""
+    flush = RecordingFlush()
+    
+    async with DynamicBatcher(2, 10_000, flush) as batcher:
+        results = await asyncio.wait_for(
+            asyncio.gather(batcher.submit(1), batcher.submit(2)), timeout=1.0
+        )
+    
+    assert results == [2, 4]
+    assert flush.batches == [[1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_flushes_partial_batch_on_timeout():
+    """Test that a batch below max_size is flushed once its timeout passes."""
+    flush = RecordingFlush()
+    
+    async with DynamicBatcher(10, 20, flush) as batcher:
+        result = await asyncio.wait_for(batcher.submit(3), timeout=1.0)
+    
+    assert result == 6
+    assert flush.batches == [[3]]
+
+
+@pytest.mark.asyncio
+async def test_flush_exception_reaches_every_item():
+    """Test that every item in a failed batch gets the flush exception."""
+    async def failing_flush(items):
+        raise ValueError("flush failed")
+    
+    async with DynamicBatcher(3, 10_000, failing_flush) as batcher:
+        results = await asyncio.gather(
+            *(batcher.submit(i) for i in range(3)), return_exceptions=True
+        )
+    
+    assert len(results) == 3
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_short_flush_result_raises_for_missing_items():
+    """Test that items without a result get a RuntimeError."""
+    async def short_flush(items):
+        return items[:1]
+    
+    async with DynamicBatcher(2, 10_000, short_flush) as batcher:
+        results = await asyncio.gather(
+            batcher.submit("a"), batcher.submit("b"), return_exceptions=True
+        )
+    
+    assert results[0] == "a"
+    assert isinstance(results[1], RuntimeError)
+
+
+@pytest.mark.asyncio
+async def test_close_drains_pending_items():
+    """Test that leaving the context flushes queued items without waiting out the timeout."""
+    flush = RecordingFlush()
+    
+    async def run():
+        async with DynamicBatcher(10, 10_000, flush) as batcher:
+            tasks = [asyncio.create_task(batcher.submit(i)) for i in range(3)]
+            await asyncio.sleep(0)  # let the submits reach the queue
+        return await asyncio.gather(*tasks)
+    
+    results = await asyncio.wait_for(run(), timeout=1.0)
+    
+    assert results == [0, 2, 4]
+    assert flush.batches == [[0, 1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight_bounds_concurrent_flushes():
+    """Test that no more than max_in_flight flushes run at once."""
+    flush = RecordingFlush(delay=0.02)
+    
+    async with DynamicBatcher(1, 10_000, flush, max_in_flight=2) as batcher:
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+    
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert len(flush.batches) == 6
+    assert flush.peak == 2
@@ -0,0 +1,51 @@
+import pytest
+import pandas as pd
+from app.enrollment_predictor import EnrollmentPredictor
+
+
+def test_predict_enrollment_from_weekly_enrollment():
+    """Test per-site predictions and trends from weekly enrollment counts."""
+    enrollment_df = pd.DataFrame({
+        "site_id": ["SITE_001"] * 3 + ["SITE_002"] * 3,
+        "weekly_enrollment": [7, 7, 7, 2, 4, 6]
+    })
+    
+    result = EnrollmentPredictor.predict_enrollment(enrollment_df)
+    
+    assert result["SITE_001"]["avg_weekly_enrollment"] == 7.0
+    assert result["SITE_001"]["predicted_30d_enrollment"] == 30
+    assert result["SITE_001"]["enrollment_trend"] == "stable"
+    assert result["SITE_002"]["enrollment_trend"] == "increasing"
+
+
+def test_predict_enrollment_without_site_id_returns_empty():
+    """Test that data without a site_id column yields no predictions."""
+    assert EnrollmentPredictor.predict_enrollment(pd.DataFrame({"weekly_enrollment": [1]})) == {}
+
+
+def test_predict_screen_fail_rate_averages_per_site():
+    """Test screen fail rates are averaged per site."""
+    enrollment_df = pd.DataFrame({
+        "site_id": ["SITE_001", "SITE_001", "SITE_002"],
+        "screen_fail_rate": [0.2, 0.4, 0.1]
+    })
+    
+    result = EnrollmentPredictor.predict_screen_fail_rate(enrollment_df)
+    
+    assert result["SITE_001"] == pytest.approx(0.3)
+    assert result["SITE_002"] == pytest.approx(0.1)
+
+
+def test_predict_screen_fail_rate_defaults_when_missing():
+    """Test the default fail rate is used when the data has none."""
+    enrollment_df = pd.DataFrame({"site_id": ["SITE_001", "SITE_002"]})
+    
+    result = EnrollmentPredictor.predict_screen_fail_rate(enrollment_df)
+    
+    assert result == {"SITE_001": 0.30, "SITE_002": 0.30}
+
+
+def test_adjust_demand_for_enrollment_uses_higher_demand():
+    """Test demand takes the larger of historical and enrollment-based demand."""
+    assert EnrollmentPredictor.adjust_demand_for_enrollment(10, 40, 0.25) == 30
+    assert EnrollmentPredictor.adjust_demand_for_enrollment(50, 40, 0.25) == 50
@@ -0,0 +1,295 @@
+import json
+import threading
+import time
+import numpy as np
+import pytest
+import requests
+from app.config import Config
+from app.gemini_client import GeminiClient, CircuitOpenError
+
+
+@pytest.fixture
+def fresh_shared_state(monkeypatch):
+    """Isolate the process-wide key and breaker state for one test."""
+    monkeypatch.setattr(Config, "_API_KEYS", ("test-key-1",))
+    monkeypatch.setattr(GeminiClient, "_buckets", {})
+    monkeypatch.setattr(GeminiClient, "_key_row", {})
+    monkeypatch.setattr(GeminiClient, "_cooldowns", np.zeros(0))
+    monkeypatch.setattr(GeminiClient, "_breaker_failures", 0)
+    monkeypatch.setattr(GeminiClient, "_breaker_open_until", 0.0)
+
+
+def _server_error(*args, **kwargs):
+    response = requests.Response()
+    response.status_code = 500
+    response.url = "https://example.invalid"
+    return response
+
+
+def test_open_breaker_short_circuits_new_client(fresh_shared_state, monkeypatch):
+    """Test that a breaker opened by one client makes a newly built client fail fast."""
+    first = GeminiClient()
+    monkeypatch.setattr(first.session, "post", _server_error)
+    
+    for _ in range(GeminiClient._breaker_threshold):
+        with pytest.raises(requests.exceptions.HTTPError):
+            first._call_gemini_api("prompt", use_cache=False)
+    
+    second = GeminiClient()
+    calls = []
+    monkeypatch.setattr(second.session, "post", lambda *args, **kwargs: calls.append(args))
+    
+    with pytest.raises(CircuitOpenError):
+        second._call_gemini_api("prompt", use_cache=False)
+    assert calls == []
+
+
+def test_clients_share_key_buckets(fresh_shared_state):
+    """Test that clients using the same API key draw from one token bucket."""
+    first = GeminiClient()
+    second = GeminiClient()
+    
+    assert first.buckets["test-key-1"] is second.buckets["test-key-1"]
+
+
+def test_generate_content_uses_given_timeout(fresh_shared_state, monkeypatch):
+    """Test that generate_content passes its timeout to the HTTP request."""
+    client = GeminiClient()
+    timeouts = []
+    
+    def post(*args, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"candidates": []}'
+        return response
+    
+    monkeypatch.setattr(client.session, "post", post)
+    
+    assert client.generate_content("prompt", timeout=10) == {"candidates": []}
+    assert timeouts == [10]
+
+
+def test_batch_recommendations_many_runs_batches_concurrently(fresh_shared_state, monkeypatch):
+    """Test that batches run concurrently and results come back in batch order."""
+    client = GeminiClient()
+    monkeypatch.setattr(client, "max_in_flight", 2)
+    active = []
+    peak = []
+    lock = threading.Lock()
+    
+    def get_batch_recommendations(sites_data, context_data=None):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+        if sites_data[0]["site_id"] == "FAIL":
+            raise ValueError("batch failed")
+        return [site["site_id"] for site in sites_data]
+    
+    monkeypatch.setattr(client, "get_batch_recommendations", get_batch_recommendations)
+    batches = [[{"site_id": "A"}], [{"site_id": "FAIL"}], [{"site_id": "B"}, {"site_id": "C"}], [{"site_id": "D"}]]
+    
+    outcomes = client.get_batch_recommendations_many(batches)
+    
+    assert outcomes[0] == ["A"]
+    assert isinstance(outcomes[1], ValueError)
+    assert outcomes[2:] == [["B", "C"], ["D"]]
+    assert max(peak) == 2
+
+
+def test_key_cooldown_is_shared_across_clients(fresh_shared_state, monkeypatch):
+    """Test that a key put in cooldown by one client is skipped by another."""
+    monkeypatch.setattr(Config, "_API_KEYS", ("test-key-1", "test-key-2"))
+    first = GeminiClient()
+    first._mark_key_failure("test-key-1", 429)
+    
+    second = GeminiClient()
+    
+    assert [second._get_next_available_key() for _ in range(3)] == ["test-key-2"] * 3
+
+
+def _json_response(payload):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(payload).encode()
+    return response
+
+
+def _batch_job(state, inlined=None):
+    job = {"name": "batches/1", "metadata": {"state": state}}
+    if inlined is not None:
+        job["done"] = True
+        job["response"] = {"inlinedResponses": {"inlinedResponses": inlined}}
+    return job
+
+
+def _inlined_reply(site_id, action):
+    text = json.dumps({"structured_result": {"action": action, "quantity": 3, "confidence": 0.8, "reasons": []}})
+    return {
+        "metadata": {"key": site_id},
+        "response": {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+    }
+
+
+@pytest.fixture
+def batch_job_client(fresh_shared_state, monkeypatch):
+    """Client whose batch job requests are recorded and answered from a reply queue."""
+    client = GeminiClient()
+    client.requests = []
+    client.replies = []
+    client.sleeps = []
+    
+    def request(method, url, data=None, **kwargs):
+        client.requests.append((method, url, json.loads(data) if data else None))
+        return _json_response(client.replies.pop(0))
+    
+    monkeypatch.setattr(client.session, "request", request)
+    monkeypatch.setattr(client, "_sleep", client.sleeps.append)
+    return client
+
+
+def test_submit_batch_job_keys_requests_by_site_id(batch_job_client):
+    """Test that each site's request carries its site_id as the custom key."""
+    batch_job_client.replies.append({"name": "batches/1"})
+    sites = [{"site_id": "SITE_001", "site_features": {}}, {"site_id": "SITE_002", "site_features": {}}]
+    
+    job_name = batch_job_client.submit_batch_job(sites)
+    
+    method, url, body = batch_job_client.requests[0]
+    requests_list = body["batch"]["input_config"]["requests"]["requests"]
+    assert job_name == "batches/1"
+    assert method == "POST" and url.endswith(":batchGenerateContent")
+    assert [r["metadata"]["key"] for r in requests_list] == ["SITE_001", "SITE_002"]
+    assert batch_job_client._batch_job_keys == {"batches/1": "test-key-1"}
+
+
+def test_poll_batch_job_maps_responses_to_site_ids(batch_job_client):
+    """Test that polling waits for the job and returns parsed replies by custom key."""
+    batch_job_client.replies.extend([
+        _batch_job("BATCH_STATE_RUNNING"),
+        _batch_job("BATCH_STATE_SUCCEEDED", [
+            _inlined_reply("SITE_002", "resupply"),
+            {"metadata": {"key": "SITE_003"}, "error": {"message": "quota"}},
+            _inlined_reply("SITE_001", "no_action"),
+        ]),
+    ])
+    
+    results = batch_job_client.poll_batch_job("batches/1", timeout=60)
+    
+    assert set(results) == {"SITE_001", "SITE_002"}
+    assert results["SITE_001"]["structured_result"]["action"] == "no_action"
+    assert results["SITE_002"]["structured_result"]["action"] == "resupply"
+    assert batch_job_client.sleeps == [5.0]
+
+
+def test_poll_batch_job_cancels_job_after_timeout(batch_job_client):
+    """Test that a job still running at the deadline is cancelled."""
+    batch_job_client.replies.extend([_batch_job("BATCH_STATE_RUNNING"), {}])
+    
+    with pytest.raises(TimeoutError):
+        batch_job_client.poll_batch_job("batches/1", timeout=0)
+    
+    assert batch_job_client.requests[-1][:2] == ("POST", f"{batch_job_client.api_root}/batches/1:cancel")
+
+
+def test_poll_batch_job_raises_for_failed_job(batch_job_client):
+    """Test that a job ending in a state other than succeeded raises."""
+    batch_job_client.replies.append(_batch_job("BATCH_STATE_FAILED"))
+    
+    with pytest.raises(RuntimeError, match="BATCH_STATE_FAILED"):
+        batch_job_client.poll_batch_job("batches/1", timeout=60)
+
+
+def test_cancel_batch_job_ignores_request_errors(batch_job_client, monkeypatch):
+    """Test that cancellation is best effort and does not raise."""
+    monkeypatch.setattr(batch_job_client.session, "request", _server_error)
+    
+    batch_job_client.cancel_batch_job("batches/1")
+
+
+def test_response_cache_serves_repeated_prompt_without_request(fresh_shared_state, monkeypatch):
+    """Test that a repeated prompt and model is answered from the response cache."""
+    client = GeminiClient()
+    prompts = []
+    
+    def post(url, data=None, **kwargs):
+        prompts.append((url, json.loads(data)["contents"][0]["parts"][0]["text"]))
+        return _json_response({"candidates": [], "n": len(prompts)})
+    
+    monkeypatch.setattr(client.session, "post", post)
+    
+    first = client._call_gemini_api("prompt A")
+    assert client._call_gemini_api("prompt A") == first
+    assert client._call_gemini_api("prompt B")["n"] == 2
+    assert client._call_gemini_api("prompt A", model_override="other-model")["n"] == 3
+    assert len(prompts) == 3
+    
+    # use_cache=False skips the lookup and refreshes the cached response
+    assert client._call_gemini_api("prompt A", use_cache=False)["n"] == 4
+    assert client._call_gemini_api("prompt A")["n"] == 4
+
+
+def _batch_reply(payload):
+    text = payload if isinstance(payload, str) else json.dumps(payload)
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+def test_parse_batch_response_orders_results_by_site_id(fresh_shared_state):
+    """Test that replies are matched by site_id, in input order, with fallbacks for missing sites."""
+    client = GeminiClient()
+    response = _batch_reply({"sites": [
+        {"site_id": "S2", "structured_result": {"action": "resupply", "quantity": 4}, "draft_message": "two"},
+        {"site_id": "S9", "draft_message": "not requested"},
+        {"site_id": "S1", "structured_result": {"action": "no_resupply", "quantity": 0}},
+    ]})
+    
+    results = client._parse_batch_response(response, ["S1", "S2", "S3", "S2"])
+    
+    assert results[0]["structured_result"]["action"] == "no_resupply"
+    assert results[1]["draft_message"] == "two"
+    assert results[3] is results[1]
+    assert results[2]["structured_result"]["confidence"] == 0.3
+    assert "S3 not found" in results[2]["structured_result"]["reasons"][0]
+
+
+@pytest.mark.parametrize("response", [
+    _batch_reply("not json"),
+    _batch_reply({"results": []}),
+    {"candidates": []},
+])
+def test_parse_batch_response_rejects_malformed_replies(fresh_shared_state, response):
+    """Test that unparseable or incomplete replies raise ValueError."""
+    with pytest.raises(ValueError):
+        GeminiClient()._parse_batch_response(response, ["S1"])
+
+
+def test_real_length_key_is_redacted_from_http_errors(fresh_shared_state, monkeypatch):
+    """Test that a full-length API key in a request URL does not reach the error message."""
+    api_key = "AIzaSyTEST-0123456789abcdefghijklmnopq"
+    monkeypatch.setattr(Config, "_API_KEYS", (api_key,))
+    client = GeminiClient()
+    
+    def post(url, params=None, **kwargs):
+        response = requests.Response()
+        response.status_code = 400
+        response.url = f"{url}?key={params['key']}"
+        return response
+    
+    monkeypatch.setattr(client.session, "post", post)
+    
+    with pytest.raises(requests.exceptions.HTTPError) as excinfo:
+        client._call_gemini_api("prompt", use_cache=False)
+    
+    assert api_key not in str(excinfo.value)
+    assert "***API_KEY_HIDDEN***" in str(excinfo.value)
+
+
+def test_short_key_warns_that_it_is_not_scrubbed(fresh_shared_state, capsys):
+    """Test that a key too short to scrub safely is reported at construction."""
+    client = GeminiClient()
+    
+    assert client._scrubbed_keys == frozenset()
+    assert "1 API key(s) shorter than 20 characters" in capsys.readouterr().out
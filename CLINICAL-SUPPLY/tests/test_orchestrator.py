@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+import pytest
+from app.config import Config
+from app.orchestrator import Orchestrator
+
+
+def _gemini_result(site_id):
+    return {
+        "structured_result": {"action": "resupply", "quantity": 7, "confidence": 0.9, "reasons": []},
+        "draft_message": f"LLM {site_id}"
+    }
+
+
+class FakeBatchClient:
+    """Batch client that answers every site, except batches containing a FAIL site."""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def get_batch_recommendations_many(self, batches, context_data=None):
+        self.calls.append([[site["site_id"] for site in sites_data] for sites_data in batches])
+        return [
+            ValueError("batch failed") if any(site["site_id"].startswith("FAIL") for site in sites_data)
+            else [_gemini_result(site["site_id"]) for site in sites_data]
+            for sites_data in batches
+        ]
+
+
+def _site(site_id):
+    return {"site_id": site_id, "projected_30d_demand": 20, "current_inventory": 5, "days_to_expiry": 90}
+
+
+@pytest.fixture
+def orchestrator(monkeypatch):
+    monkeypatch.setattr(Config, "_API_KEYS", ())
+    monkeypatch.setattr(Orchestrator, "_llm_cache", type(Orchestrator._llm_cache)())
+    orchestrator = Orchestrator()
+    orchestrator.gemini_client = FakeBatchClient()
+    orchestrator.use_batch_api = True
+    orchestrator.batch_api_size = 2
+    orchestrator.use_parallel = True
+    orchestrator.batch_sizer = None
+    return orchestrator
+
+
+@pytest.mark.asyncio
+async def test_run_rejects_running_event_loop(monkeypatch):
+    """Test that run() fails fast instead of blocking a running event loop."""
+    monkeypatch.setattr(Config, "_API_KEYS", ())
+    orchestrator = Orchestrator()
+    
+    with pytest.raises(RuntimeError, match="asyncio.to_thread"):
+        orchestrator.run()
+
+
+def test_parallel_batches_are_sent_in_one_concurrent_call(orchestrator):
+    """Test that fixed-size batches go to the client together and results keep site order."""
+    llm_sites = [(idx, _site(site_id)) for idx, site_id in enumerate(["S1", "S2", "FAIL3", "S4", "S5"])]
+    
+    results = orchestrator._process_llm_sites(llm_sites, {})
+    
+    assert orchestrator.gemini_client.calls == [[["S1", "S2"], ["FAIL3", "S4"], ["S5"]]]
+    assert [r["site_id"] for r in results] == ["S1", "S2", "FAIL3", "S4", "S5"]
+    assert [r["llm_used"] for r in results] == [True, True, False, False, True]
+
+
+def test_parallel_batches_send_only_cache_misses(orchestrator):
+    """Test that cached sites are answered without being sent again."""
+    orchestrator._process_llm_sites([(0, _site("S1")), (1, _site("S2"))], {})
+    orchestrator.gemini_client.calls.clear()
+    
+    results = orchestrator._process_llm_sites([(0, _site("S1")), (1, _site("S3")), (2, _site("S2"))], {})
+    
+    assert orchestrator.gemini_client.calls == [[["S3"]]]
+    assert all(r["llm_used"] for r in results)
+
+
+class FakeIndividualClient:
+    """Single-site client that records peak concurrency and fails FAIL sites."""
+    
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+    
+    def get_recommendation_justification(self, site_id, site_features, rules_result=None, context_data=None):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        if site_id.startswith("FAIL"):
+            raise ValueError("call failed")
+        return _gemini_result(site_id)
+
+
+def test_parallel_individual_calls_are_bounded_and_keep_order(orchestrator):
+    """Test that individual calls run on max_concurrent threads and results keep site order."""
+    orchestrator.gemini_client = FakeIndividualClient()
+    orchestrator.use_batch_api = False
+    orchestrator.max_batch_size = 1
+    orchestrator.max_concurrent = 2
+    llm_sites = [(idx, _site(site_id)) for idx, site_id in enumerate(["S1", "FAIL2", "S3", "S4", "S5"])]
+    
+    results = orchestrator._process_llm_sites(llm_sites, {})
+    
+    assert [r["site_id"] for r in results] == ["S1", "FAIL2", "S3", "S4", "S5"]
+    assert [r["llm_used"] for r in results] == [True, False, True, True, True]
+    assert orchestrator.gemini_client.peak == 2
+
+
+class FakeBatchJobClient:
+    """Batch job client that answers only the sites in answered."""
+    
+    def __init__(self, answered):
+        self.answered = answered
+    
+    def poll_batch_job(self, job_name, timeout):
+        return {site_id: _gemini_result(site_id) for site_id in self.answered}
+
+
+def test_batch_job_merge_replaces_pending_results_by_site_id(orchestrator, tmp_path):
+    """Test that job answers replace the job's pending rules results in the output file."""
+    orchestrator.gemini_client = FakeBatchJobClient(["S2"])
+    sites = [(0, _site("S1")), (1, _site("S2"))]
+    output_path = tmp_path / "results.jsonl"
+    records = [
+        {"site_id": "S0", "llm_used": True},
+        *(
+            dict(orchestrator._process_site_with_rules(row, row["site_id"]), batch_job={"name": "batches/1", "status": "pending"})
+            for _, row in sites
+        ),
+    ]
+    output_path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    
+    merged = orchestrator._start_batch_job_merge("batches/1", sites, {}, output_path).result(timeout=5)
+    
+    s0, s1, s2 = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert merged == 1
+    assert s0 == {"site_id": "S0", "llm_used": True}
+    assert not s1["llm_used"] and s1["batch_job"]["status"] == "unanswered"
+    assert s2["llm_used"] and s2["reason"] == "LLM S2" and s2["batch_job"]["status"] == "merged"
+    assert s2["llm"] == _gemini_result("S2")
+    assert orchestrator._llm_cache_get(orchestrator._llm_cache_key(sites[1][1], {})) == _gemini_result("S2")
+
+
+class FakeClock:
+    """Monotonic clock that only moves when the test advances it."""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+def test_llm_cache_entry_expires_after_ttl(orchestrator, monkeypatch):
+    """Test that a cached LLM result is served until its TTL passes, then dropped."""
+    clock = FakeClock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    monkeypatch.setattr(Config, "LLM_CACHE_TTL", 60)
+    key = orchestrator._llm_cache_key(_site("S1"), {})
+    orchestrator._llm_cache_put(key, _gemini_result("S1"))
+    
+    clock.now += 59
+    assert orchestrator._llm_cache_get(key) == _gemini_result("S1")
+    clock.now += 1
+    assert orchestrator._llm_cache_get(key) is None
+    assert key not in Orchestrator._llm_cache
+
+
+def test_llm_cache_disabled_with_zero_ttl(orchestrator, monkeypatch):
+    """Test that LLM_CACHE_TTL=0 neither stores nor serves results."""
+    monkeypatch.setattr(Config, "LLM_CACHE_TTL", 0)
+    key = orchestrator._llm_cache_key(_site("S1"), {})
+    orchestrator._llm_cache_put(key, _gemini_result("S1"))
+    
+    assert orchestrator._llm_cache_get(key) is None
+    assert len(Orchestrator._llm_cache) == 0
+
+
+def test_llm_cache_key_is_stable_across_instances_and_key_order(orchestrator):
+    """Test that equal inputs hash to one key regardless of dict order or orchestrator."""
+    site = _site("S1")
+    reordered = dict(reversed(list(site.items())))
+    context = {"total_sites": 3, "avg_demand": 12.5}
+    
+    key = orchestrator._llm_cache_key(site, context)
+    
+    assert len(key) == 64
+    assert orchestrator._llm_cache_key(reordered, dict(reversed(list(context.items())))) == key
+    assert Orchestrator()._llm_cache_key(site, context) == key
+
+
+def test_llm_cache_keys_differ_for_different_sites_and_context(orchestrator):
+    """Test that a change in site features or run context gives a separate entry."""
+    context = {"total_sites": 3, "avg_demand": 12.5}
+    key = orchestrator._llm_cache_key(_site("S1"), context)
+    orchestrator._llm_cache_put(key, _gemini_result("S1"))
+    
+    other_keys = [
+        orchestrator._llm_cache_key(_site("S2"), context),
+        orchestrator._llm_cache_key(dict(_site("S1"), current_inventory=6), context),
+        orchestrator._llm_cache_key(_site("S1"), dict(context, avg_demand=13.0)),
+        orchestrator._llm_cache_key(_site("S1"), {}),
+    ]
+    
+    assert len({key, *other_keys}) == 5
+    assert all(orchestrator._llm_cache_get(other) is None for other in other_keys)
+    assert orchestrator._llm_cache_get(key) == _gemini_result("S1")
@@ -0,0 +1,48 @@
+import io
+import pytest
+from app import upload_handler
+from app.upload_handler import _write_async_upload
+
+
+class AsyncBytesFile:
+    """Minimal async file object over in-memory bytes, like FastAPI's UploadFile."""
+    
+    def __init__(self, content: bytes):
+        self._buffer = io.BytesIO(content)
+    
+    async def read(self, size: int = -1) -> bytes:
+        return self._buffer.read(size)
+
+
+def _csv_bytes(min_size: int) -> bytes:
+    rows = ["site_id,site_name,region"]
+    while sum(len(row) + 1 for row in rows) <= min_size:
+        rows.append(f"SITE_{len(rows):05d},Clinique Sainte-Anne é,Europe")
+    return ("\n".join(rows) + "\n").encode("utf-8")
+
+
+@pytest.mark.asyncio
+async def test_large_utf8_upload_is_saved_unchanged(tmp_path, monkeypatch):
+    """Test that a UTF-8 CSV over 50KB is streamed to disk byte for byte."""
+    monkeypatch.setattr(upload_handler, "UPLOAD_CHUNK_SIZE", 16 * 1024)
+    content = _csv_bytes(60_000)
+    file_path = tmp_path / "sites.csv"
+    
+    await _write_async_upload(AsyncBytesFile(content), file_path, "sites.csv")
+    
+    assert len(content) > 50_000
+    assert file_path.read_bytes() == content
+
+
+@pytest.mark.asyncio
+async def test_large_utf16_upload_is_reencoded_as_utf8(tmp_path, monkeypatch):
+    """Test that a UTF-16 CSV (BOM) over 50KB is saved as UTF-8."""
+    monkeypatch.setattr(upload_handler, "UPLOAD_CHUNK_SIZE", 16 * 1024)
+    text = _csv_bytes(30_000).decode("utf-8")
+    content = text.encode("utf-16")
+    file_path = tmp_path / "sites.csv"
+    
+    await _write_async_upload(AsyncBytesFile(content), file_path, "sites.csv")
+    
+    assert len(content) > 50_000
+    assert file_path.read_bytes().decode("utf-8").lstrip("\ufeff") == text